@@ -1,22 +1,8 @@
-import os
-from dotenv import load_dotenv
-from flask import Flask
 from src.models.user import db, User
+from src.services.standalone import create_app
 
-# Charger les variables d'environnement
-load_dotenv()
-
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Forcer SSL pour Neon
-if app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql"):
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "connect_args": {"sslmode": "require"}
-    }
-
-db.init_app(app)
+# .env, normalisation de l'URL et SSL (PGSSLMODE) comme l'application
+app = create_app()
 
 # Ajouter un utilisateur de test
 with app.app_context():
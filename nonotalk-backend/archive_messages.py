@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Archive les conversations inactives en stockage froid (voir src/services/archive.py).
+
+Objectif:
+- Garder la table `message` et ses index réduits aux conversations vivantes
+- À lancer périodiquement (cron / tâche planifiée Render); une transaction par
+  conversation, sans bloquer l'application
+- Imprimer le script de partitionnement mensuel de `message` (Postgres), à
+  relire et lancer pendant une maintenance
+- NE PAS importer src.main ni les routes (comme reset_db.py)
+
+Exemples:
+
+    python archive_messages.py --idle-days 180
+    python archive_messages.py --dry-run
+    python archive_messages.py --restore 1234
+    python archive_messages.py --print-partition-ddl > partition_message.sql
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+# S'assurer que le répertoire projet (celui contenant 'src/') est dans sys.path
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import func, select
+
+from src.models.user import db, ArchivedConversation, Message
+from src.models.schema import ensure_schema
+from src.services import archive
+from src.services.standalone import create_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="par défaut DATABASE_URL")
+    parser.add_argument("--idle-days", type=int, default=archive.ARCHIVE_IDLE_DAYS,
+                        help="archiver les conversations sans activité depuis ce nombre de jours")
+    parser.add_argument("--limit", type=int, help="nombre maximal de conversations à archiver")
+    parser.add_argument("--dry-run", action="store_true", help="compter les candidates sans rien déplacer")
+    parser.add_argument("--restore", type=int, metavar="CONVERSATION_ID", help="restaurer une conversation")
+    parser.add_argument("--print-partition-ddl", action="store_true",
+                        help="imprimer le script de partitionnement mensuel de message (Postgres)")
+    args = parser.parse_args()
+
+    app = create_app(args.database_url)
+    with app.app_context():
+        if args.print_partition_ddl:
+            # Les messages archivés reviennent avec leur date d'origine: partitions dès le plus ancien
+            first = min(filter(None, (
+                db.session.execute(select(func.min(Message.timestamp))).scalar(),
+                db.session.execute(select(func.min(ArchivedConversation.first_timestamp))).scalar(),
+            )), default=None)
+            print(archive.partition_ddl((first or datetime.utcnow()).date()))
+            return
+        ensure_schema()
+        if args.restore:
+            restored = archive.restore_conversation(args.restore)
+            db.session.commit()
+            print(f"✓ {restored} messages restaurés")
+            return
+
+        started = time.perf_counter()
+        conversations, messages = archive.archive_idle(args.idle_days, limit=args.limit, dry_run=args.dry_run)
+        verb = "à archiver" if args.dry_run else "archivés"
+        print(f"✓ {conversations} conversations / {messages} messages {verb} "
+              f"en {time.perf_counter() - started:.1f} s")
+        stats = archive.archive_stats()
+        print(f"  table chaude: {stats['hot_messages']} messages; archives: {stats['archived_conversations']} "
+              f"conversations, {stats['archived_messages']} messages, {stats['archived_bytes'] / 1e6:.1f} Mo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Recalcule les agrégats quotidiens (daily_emotion_stat) à partir des messages.
+
+Objectif:
+- Initialiser les agrégats des messages écrits avant leur introduction, ou
+  insérés hors ORM (seed_dataset.py, imports)
+- Traiter les utilisateurs par tranches d'identifiants, une transaction par
+  tranche: pas de verrou long sur la table pendant que l'application écrit
+- NE PAS importer src.main ni les routes (comme reset_db.py)
+
+Exemples:
+
+    python backfill_rollups.py
+    python backfill_rollups.py --since 2026-10-01 --batch-users 5000
+    python backfill_rollups.py --user-id 42 --user-id 43
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+# S'assurer que le répertoire projet (celui contenant 'src/') est dans sys.path
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import func, select
+
+from src.models.user import db, User
+from src.models.schema import ensure_schema
+from src.services.rollups import rebuild
+from src.services.standalone import create_app
+
+
+def backfill(user_ids=None, since=None, batch_users=1000):
+    started = time.perf_counter()
+    if user_ids:
+        rows = rebuild(user_ids=user_ids, since=since)
+        print(f"✓ {rows} lignes recalculées pour {len(user_ids)} utilisateur(s)")
+        return
+
+    low, high = db.session.execute(select(func.min(User.id), func.max(User.id))).one()
+    db.session.close()
+    if low is None:
+        print("✓ Aucun utilisateur")
+        return
+    total = 0
+    for first in range(low, high + 1, batch_users):
+        # Tranche d'identifiants (les trous éventuels ne coûtent rien)
+        total += rebuild(user_ids=range(first, first + batch_users), since=since)
+        done = min(high, first + batch_users - 1)
+        print(f"  utilisateurs {first}..{done}: {total} lignes ({time.perf_counter() - started:.1f} s)")
+    print(f"✓ {total} lignes recalculées en {time.perf_counter() - started:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="par défaut DATABASE_URL")
+    parser.add_argument("--user-id", type=int, action="append", dest="user_ids",
+                        help="limiter à cet utilisateur (répétable)")
+    parser.add_argument("--since", type=date.fromisoformat,
+                        help="ne recalculer qu'à partir de ce jour (AAAA-MM-JJ, UTC)")
+    parser.add_argument("--batch-users", type=int, default=1000, help="utilisateurs par transaction")
+    args = parser.parse_args()
+
+    app = create_app(args.database_url)
+    with app.app_context():
+        ensure_schema()
+        backfill(user_ids=args.user_ids, since=args.since, batch_users=args.batch_users)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Octets et CPU par requête des routes d'historique (liste des conversations,
+messages d'une conversation): ancien chemin (objets ORM, to_dict(), jsonify)
+contre lecture par colonnes + services/serialization.py (json puis orjson),
+et revalidation avec If-None-Match (304).
+
+Base SQLite temporaire: un utilisateur, --conversations conversations dont
+une de --messages messages. Chaque variante est appelée --requests fois via
+le client de test Flask (pile WSGI complète, sans réseau).
+
+    python benchmarks/bench_history.py --messages 500 --requests 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+_DB_DIR = tempfile.mkdtemp(prefix='bench_history_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_DB_DIR, 'bench.db')}"
+
+from flask import Blueprint, jsonify, session
+from sqlalchemy import func
+
+from benchmarks.fake_openai import WORDS
+from src.main import app
+from src.models.schema import ensure_schema
+from src.models.user import db, User, Conversation, Message
+from src.services import serialization
+
+legacy_bp = Blueprint('legacy_history', __name__)
+
+
+@legacy_bp.route('/conversations')
+def legacy_conversations():
+    """Reproduction de get_conversations avant les ETag."""
+    message_counts = db.session.query(
+        Message.conversation_id, func.count(Message.id).label('message_count')
+    ).group_by(Message.conversation_id).subquery()
+    rows = db.session.query(Conversation, func.coalesce(message_counts.c.message_count, 0)).outerjoin(
+        message_counts, message_counts.c.conversation_id == Conversation.id
+    ).filter(Conversation.user_id == session['user_id']).order_by(Conversation.updated_at.desc()).all()
+    return jsonify({'conversations': [conv.to_dict(message_count=count) for conv, count in rows]}), 200
+
+
+@legacy_bp.route('/conversations/<int:conversation_id>/messages')
+def legacy_messages(conversation_id):
+    """Reproduction de get_messages avant les ETag."""
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=session['user_id']).first()
+    messages = Message.query.filter_by(conversation_id=conversation.id).order_by(Message.timestamp.asc()).all()
+    return jsonify({'messages': [msg.to_dict() for msg in messages]}), 200
+
+
+def seed(conversations, messages):
+    with app.app_context():
+        ensure_schema()
+        user = User(username='bench_history')
+        user.set_pin('1234')
+        db.session.add(user)
+        db.session.flush()
+        start = datetime.utcnow() - timedelta(days=30)
+        convs = [Conversation(user_id=user.id, title=f'Conversation {i}', updated_at=start + timedelta(hours=i))
+                 for i in range(conversations)]
+        db.session.add_all(convs)
+        db.session.flush()
+        big = convs[0]
+        for i in range(messages):
+            words = [WORDS[(i * 7 + k) % len(WORDS)] for k in range(12 + i % 40)]
+            db.session.add(Message(
+                conversation_id=big.id, content=' '.join(words).capitalize() + ' é.',
+                is_user=i % 2 == 0, timestamp=start + timedelta(minutes=i),
+                emotion_detected='calme' if i % 6 == 0 else None,
+            ))
+        for conv in convs[1:]:
+            db.session.add(Message(conversation_id=conv.id, content='Bonjour Nono', is_user=True))
+        db.session.commit()
+        return user.id, big.id
+
+
+def measure(client, url, requests, headers=None):
+    sizes = []
+    cpu = []
+    status = None
+    for _ in range(requests):
+        start = time.thread_time()
+        response = client.get(url, headers=headers or {})
+        body = response.get_data()
+        cpu.append((time.thread_time() - start) * 1000)
+        sizes.append(len(body))
+        status = response.status_code
+    return status, statistics.mean(sizes), statistics.median(cpu), response.headers.get('ETag')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    app.register_blueprint(legacy_bp, url_prefix='/bench/legacy')
+    app.config['SESSION_COOKIE_SECURE'] = False
+    user_id, conversation_id = seed(args.conversations, args.messages)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+    orjson_module = serialization.orjson
+    print(f"{args.conversations} conversations, {args.messages} messages; backend JSON disponible: "
+          f"{'orjson' if orjson_module else 'json'}")
+    for label, path in (('conversations', '/conversations'),
+                        ('messages', f'/conversations/{conversation_id}/messages')):
+        print(f"\n{label}")
+        results = [('avant (ORM + jsonify)', measure(client, '/bench/legacy' + path, args.requests))]
+        serialization.orjson = None
+        results.append(('colonnes + json', measure(client, '/api/chat' + path, args.requests)))
+        serialization.orjson = orjson_module
+        if orjson_module:
+            results.append(('colonnes + orjson', measure(client, '/api/chat' + path, args.requests)))
+        etag = results[-1][1][3]
+        results.append(('If-None-Match (304)',
+                        measure(client, '/api/chat' + path, args.requests, {'If-None-Match': etag})))
+        for name, (status, size, cpu_ms, _) in results:
+            print(f"  {name:<22} statut={status}  octets={size:8.0f}  CPU/requête={cpu_ms:7.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
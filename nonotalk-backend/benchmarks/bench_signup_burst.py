@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Rafale d'inscriptions issues d'une invitation virale: ancien /register
+(SELECT username, SELECT email, invitation, parrain, lecture-modification-
+écriture des compteurs) contre le nouveau (insertion directe, parrain en
+une requête jointe, incréments atomiques).
+
+Un parrain a invité --signups adresses; --threads clients s'inscrivent en
+même temps (un tiers via parrain_email plutôt que par invitation, et
+--duplicates inscriptions en double pour passer par les contraintes
+d'unicité). Pour chaque variante: débit, p50/p95, requêtes SQL par
+inscription, et compteurs du parrain à l'arrivée (attendus:
+filleuls_count = inscriptions réussies, quota +5 chacune). Les requêtes
+passent par le client de test Flask (pile WSGI complète, sans réseau).
+
+Base SQLite temporaire par défaut; --database-url pour Postgres (les tables
+sont créées puis les lignes du banc supprimées à la fin). --cheap-pin
+remplace le hachage du PIN (scrypt) par un hachage rapide pour isoler le
+chemin base de données.
+
+    python benchmarks/bench_signup_burst.py --signups 300 --threads 16
+    python benchmarks/bench_signup_burst.py --cheap-pin --database-url postgresql://...
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help="par défaut une base SQLite temporaire")
+    parser.add_argument('--signups', type=int, default=300, help="inscriptions par variante")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duplicates', type=int, default=20, help="inscriptions rejetées (username déjà pris)")
+    parser.add_argument('--cheap-pin', action='store_true', help="hachage du PIN rapide (isole la base)")
+    return parser.parse_args()
+
+
+ARGS = _parse_args() if __name__ == '__main__' else None
+if ARGS and ARGS.database_url:
+    os.environ['DATABASE_URL'] = ARGS.database_url
+else:
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_signup_'), 'bench.db')}"
+
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request, session
+from sqlalchemy import delete, event
+from sqlalchemy.exc import IntegrityError
+
+from src.main import app
+from src.models.schema import ensure_schema
+from src.models.user import db, Invitation, User
+
+legacy_bp = Blueprint('legacy_signup', __name__)
+
+
+@legacy_bp.route('/register', methods=['POST'])
+def legacy_register():
+    """Reproduction de /register avant l'insertion directe."""
+    data = request.get_json()
+    username, email, pin, parrain_email = data['username'], data['email'], data['pin'], data.get('parrain_email')
+    if User.query.filter_by(username=username).first():
+        return jsonify({'error': "Ce nom d'utilisateur existe déjà"}), 400
+    if User.query.filter_by(email=email).first():
+        return jsonify({'error': 'Cet email est déjà utilisé'}), 400
+    # Compteurs initialisés ici: dans la route d'origine, add_quota() sur un quota encore None (défaut
+    # appliqué au flush) échouait en 500 pour tout filleul; on ne mesure que le coût des requêtes
+    new_user = User(username=username, email=email, parrain_email=parrain_email,
+                    quota_remaining=10, total_quota=10, filleuls_count=0)
+    new_user.set_pin(pin)
+    bonus_quota = 0
+    invitation = Invitation.query.filter_by(email=email, accepted=False).first()
+    if invitation:
+        parrain = db.session.get(User, invitation.inviter_id)
+        if parrain:
+            parrain.add_quota(5)
+            parrain.filleuls_count += 1
+            new_user.add_quota(5)
+            bonus_quota = 5
+            invitation.accepted = True
+            invitation.accepted_at = datetime.utcnow()
+    elif parrain_email:
+        parrain = User.query.filter_by(email=parrain_email).first()
+        if parrain:
+            parrain.add_quota(5)
+            parrain.filleuls_count += 1
+            new_user.add_quota(5)
+            bonus_quota = 5
+    db.session.add(new_user)
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        if 'username' in str(e).lower():
+            return jsonify({'error': "Ce nom d'utilisateur existe déjà"}), 400
+        return jsonify({'error': 'Cet email est déjà utilisé'}), 400
+    session['user_id'] = new_user.id
+    return jsonify({'message': 'Inscription réussie', 'user': new_user.to_dict(), 'bonus_quota': bonus_quota}), 201
+
+
+_queries = threading.local()
+
+
+def _count_queries(conn, cursor, statement, parameters, context, executemany):
+    _queries.count = getattr(_queries, 'count', 0) + 1
+
+
+def seed_sponsor(tag, signups):
+    """Parrain + invitations en attente (2/3 des inscrits; le reste passe par parrain_email)."""
+    with app.app_context():
+        sponsor = User(username=f'sponsor_{tag}', email=f'sponsor_{tag}@example.org')
+        sponsor.set_pin('1234')
+        db.session.add(sponsor)
+        db.session.flush()
+        db.session.add_all(Invitation(inviter_id=sponsor.id, email=f'{tag}_{i}@example.org')
+                           for i in range(signups) if i % 3)
+        db.session.commit()
+        return sponsor.id, sponsor.email
+
+
+def burst(path, tag, sponsor_email, signups, threads, duplicates):
+    payloads = [{'username': f'{tag}_{i}', 'email': f'{tag}_{i}@example.org', 'pin': '1234',
+                 'parrain_email': None if i % 3 else sponsor_email} for i in range(signups)]
+    # Doublons: même username qu'un inscrit, autre email (rejetés par la contrainte d'unicité)
+    payloads += [{'username': f'{tag}_{i}', 'email': f'{tag}_dup_{i}@example.org', 'pin': '1234'}
+                 for i in range(duplicates)]
+    clients = threading.local()
+
+    def register(payload):
+        client = getattr(clients, 'client', None)
+        if client is None:
+            client = clients.client = app.test_client()
+        _queries.count = 0
+        start = time.perf_counter()
+        response = client.post(path, json=payload)
+        return response.status_code, (time.perf_counter() - start) * 1000, _queries.count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(register, payloads))
+    return time.perf_counter() - start, results
+
+
+def report(label, sponsor_id, elapsed, results):
+    created = [r for r in results if r[0] == 201]
+    rejected = [r for r in results if r[0] == 400]
+    errors = [r for r in results if r[0] not in (201, 400)]
+    latencies = sorted(r[1] for r in results)
+    with app.app_context():
+        sponsor = db.session.get(User, sponsor_id)
+        filleuls, quota = sponsor.filleuls_count, sponsor.quota_remaining
+    print(f"\n{label}")
+    print(f"  {len(created)} inscriptions, {len(rejected)} rejetées, {len(errors)} erreurs "
+          f"en {elapsed:.2f} s -> {len(created) / elapsed:.0f} inscriptions/s")
+    print(f"  latence p50={statistics.median(latencies):.1f} ms  "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1]:.1f} ms")
+    print(f"  requêtes SQL: {statistics.mean(r[2] for r in created):.1f} par inscription, "
+          f"{statistics.mean(r[2] for r in rejected) if rejected else 0:.1f} par rejet")
+    lost = len(created) - filleuls
+    print(f"  parrain: filleuls_count={filleuls} (attendu {len(created)}), quota={quota} "
+          f"(attendu {10 + 5 * len(created)}){'  <- incréments perdus: ' + str(lost) if lost else ''}")
+
+
+def cleanup(tags):
+    with app.app_context():
+        for tag in tags:
+            db.session.execute(delete(Invitation.__table__).where(Invitation.email.like(f'{tag}_%')))
+            db.session.execute(delete(User.__table__).where(User.username.like(f'{tag}_%')))
+            db.session.execute(delete(User.__table__).where(User.username == f'sponsor_{tag}'))
+        db.session.commit()
+
+
+def main(args):
+    app.register_blueprint(legacy_bp, url_prefix='/bench/legacy')
+    app.config['SESSION_COOKIE_SECURE'] = False
+    if args.cheap_pin:
+        User.set_pin = lambda self, pin: setattr(self, 'pin_hash', f'bench${pin}')
+    with app.app_context():
+        ensure_schema()
+        event.listen(db.engine, 'before_cursor_execute', _count_queries)
+        dialect = db.engine.dialect.name
+
+    run = uuid.uuid4().hex[:6]
+    tags = []
+    print(f"{dialect}: {args.signups} inscriptions + {args.duplicates} doublons, {args.threads} threads, "
+          f"PIN {'rapide' if args.cheap_pin else 'scrypt'}")
+    try:
+        for label, path in (('avant (vérifications + lecture-modification-écriture)', '/bench/legacy/register'),
+                            ('insertion directe + incréments atomiques', '/api/auth/register')):
+            tag = f'b{run}{len(tags)}'
+            tags.append(tag)
+            sponsor_id, sponsor_email = seed_sponsor(tag, args.signups)
+            elapsed, results = burst(path, tag, sponsor_email, args.signups, args.threads, args.duplicates)
+            report(label, sponsor_id, elapsed, results)
+    finally:
+        if args.database_url:
+            cleanup(tags)
+
+
+if __name__ == '__main__':
+    main(ARGS)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Trames et CPU par réponse SSE: ancien cadrage (une trame + json.dumps par token,
+padding de 2 Ko) contre l'étage de sortie regroupé de services/sse.py.
+
+Un thread producteur publie les deltas d'une génération au rythme d'un modèle
+(--tokens-per-s); on mesure côté consommateur le nombre de trames (donc
+d'écritures), les octets et le temps CPU du thread qui sérialise.
+
+    python benchmarks/bench_sse_framing.py --replies 10 --tokens 180 --tokens-per-s 120
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.fake_openai import WORDS
+from src.services.generations import Generation
+from src.services.sse import coalesced_frames
+
+
+def legacy_frames(gen):
+    """Reproduction du cadrage d'origine de send_message_stream."""
+    def event(data_obj):
+        return f"data: {json.dumps(data_obj, ensure_ascii=False)}\n\n"
+
+    cursor = 0
+    yield ":" + (" " * 2048) + "\n\n"
+    while True:
+        events, finished = gen.read_after(cursor, timeout=15)
+        for seq, payload in events:
+            yield event(payload)
+            cursor = seq
+        if finished and cursor >= gen.last_seq:
+            return
+
+
+def produce(gen, tokens, tokens_per_s):
+    interval = 1.0 / tokens_per_s
+    gen.publish({'type': 'start', 'generation_id': gen.id})
+    for i in range(tokens):
+        time.sleep(interval)
+        word = WORDS[i % len(WORDS)]
+        gen.publish({'type': 'delta', 'content': word if i == 0 else ' ' + word})
+    gen.publish({'type': 'done', 'text': gen.text})
+    gen.finish()
+
+
+def measure(make_frames, tokens, tokens_per_s):
+    gen = Generation(user_id=1, conversation_id=1)
+    producer = threading.Thread(target=produce, args=(gen, tokens, tokens_per_s))
+    frames = 0
+    size = 0
+    cpu_start = time.thread_time()
+    producer.start()
+    for chunk in make_frames(gen):
+        frames += 1
+        size += len(chunk.encode('utf-8'))
+    cpu_ms = (time.thread_time() - cpu_start) * 1000
+    producer.join()
+    return frames, size, cpu_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replies', type=int, default=10)
+    parser.add_argument('--tokens', type=int, default=180)
+    parser.add_argument('--tokens-per-s', type=float, default=120.0)
+    args = parser.parse_args()
+
+    for label, make_frames in (('avant', legacy_frames), ('après', coalesced_frames)):
+        runs = [measure(make_frames, args.tokens, args.tokens_per_s) for _ in range(args.replies)]
+        print(f"{label:<6} trames/réponse={statistics.mean(r[0] for r in runs):6.1f}  "
+              f"octets/réponse={statistics.mean(r[1] for r in runs):8.0f}  "
+              f"CPU/réponse={statistics.mean(r[2] for r in runs):6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
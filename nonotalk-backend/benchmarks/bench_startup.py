@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Temps d'import de src.main et mémoire par worker, avant / après.
+
+Mode "import" (par défaut): N processus neufs importent src.main; on relève
+la durée d'import et le RSS, en mode paresseux et en mode préchargé
+(PRELOAD_APP=1). Avec --ref, la même mesure est faite sur une autre révision
+git (checkout temporaire via `git worktree`) pour comparer avant / après.
+
+Mode "workers" (--workers N, nécessite gunicorn): démarre gunicorn avec et
+sans --preload, attend /api/health, puis lit Rss / Pss / Private de chaque
+worker dans /proc/<pid>/smaps_rollup. Pss répartit les pages partagées entre
+les processus: c'est la mémoire réellement consommée par worker.
+
+    python benchmarks/bench_startup.py --runs 5 --ref HEAD~1
+    python benchmarks/bench_startup.py --workers 4
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())
+start = time.perf_counter()
+import src.main  # noqa: F401
+elapsed = time.perf_counter() - start
+rss_kb = next(int(l.split()[1]) for l in open('/proc/self/status') if l.startswith('VmRSS'))
+print(json.dumps({'import_ms': elapsed * 1000, 'rss_mb': rss_kb / 1024,
+                  'langchain_loaded': 'langchain_openai' in sys.modules}))
+'''
+
+
+def bench_env(tmpdir, **extra):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmpdir, 'startup.db')}",
+        'OPENAI_API_BASE': 'http://127.0.0.1:9/v1',
+        'OPENAI_KEEPALIVE_INTERVAL': '0',
+        'PRELOAD_APP': '',
+    })
+    env.update(extra)
+    return env
+
+
+def measure_import(cwd, env, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE], cwd=cwd, env=env, capture_output=True, text=True)
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr else 'import échoué')
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        'import_ms': round(statistics.median(s['import_ms'] for s in samples)),
+        'rss_mb': round(statistics.median(s['rss_mb'] for s in samples), 1),
+        'langchain_loaded': samples[-1]['langchain_loaded'],
+    }
+
+
+def checkout(ref, directory):
+    subprocess.run(['git', 'worktree', 'add', '--detach', directory, ref], cwd=PROJECT_ROOT, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Le dépôt contient le backend dans un sous-dossier
+    top = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=PROJECT_ROOT, capture_output=True,
+                         text=True, check=True).stdout.strip()
+    return os.path.join(directory, os.path.relpath(PROJECT_ROOT, top))
+
+
+def remove_checkout(directory):
+    subprocess.run(['git', 'worktree', 'remove', '--force', directory], cwd=PROJECT_ROOT,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def smaps_rollup(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(':') in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss_mb': round(values.get('Rss', 0), 1),
+        'pss_mb': round(values.get('Pss', 0), 1),
+        'private_mb': round(values.get('Private_Clean', 0) + values.get('Private_Dirty', 0), 1),
+    }
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+
+def measure_workers(tmpdir, workers, preload):
+    import httpx
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = bench_env(tmpdir, PRELOAD_APP='1' if preload else '')
+    cmd = ['gunicorn', 'src.main:app', '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+    if preload:
+        cmd.append('--preload')
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError('gunicorn arrêté au démarrage')
+            try:
+                if httpx.get(f'http://127.0.0.1:{port}/api/health', timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        ready_ms = (time.perf_counter() - start) * 1000
+        # Laisser tous les workers finir de démarrer
+        deadline = time.monotonic() + 30
+        while len(children(proc.pid)) < workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+        time.sleep(1)
+        per_worker = [smaps_rollup(pid) for pid in children(proc.pid)]
+        return {
+            'ready_ms': round(ready_ms),
+            'master': smaps_rollup(proc.pid),
+            'workers': per_worker,
+            'total_pss_mb': round(sum(w['pss_mb'] for w in per_worker) + smaps_rollup(proc.pid)['pss_mb'], 1),
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=15)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--ref', help='révision git de comparaison (ex: HEAD~1)')
+    parser.add_argument('--workers', type=int, default=0, help='mesurer N workers gunicorn (0: désactivé)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='nonotalk-startup-')
+    try:
+        subprocess.run([sys.executable, 'init_db.py'], cwd=PROJECT_ROOT, env=bench_env(tmpdir),
+                       check=True, stdout=subprocess.DEVNULL)
+        rows = [
+            ('actuel, paresseux', measure_import(PROJECT_ROOT, bench_env(tmpdir), args.runs)),
+            ('actuel, PRELOAD_APP=1', measure_import(PROJECT_ROOT, bench_env(tmpdir, PRELOAD_APP='1'), args.runs)),
+        ]
+        if args.ref:
+            worktree = os.path.join(tmpdir, 'ref')
+            try:
+                ref_root = checkout(args.ref, worktree)
+                rows.insert(0, (f'{args.ref}', measure_import(ref_root, bench_env(tmpdir), args.runs)))
+            finally:
+                remove_checkout(worktree)
+
+        print(f"Import de src.main (médiane sur {args.runs} processus):")
+        print(f"  {'variante':<24} {'import ms':>10} {'RSS Mo':>8}  langchain chargé")
+        for name, r in rows:
+            print(f"  {name:<24} {r['import_ms']:>10} {r['rss_mb']:>8}  {'oui' if r['langchain_loaded'] else 'non'}")
+
+        if args.workers:
+            if shutil.which('gunicorn') is None:
+                print("\ngunicorn introuvable: mesure par worker ignorée")
+                return
+            print(f"\ngunicorn, {args.workers} workers (Mo par worker: RSS / PSS / privé):")
+            for preload in (False, True):
+                r = measure_workers(tmpdir, args.workers, preload)
+                label = '--preload' if preload else 'sans preload'
+                workers = ', '.join(f"{w['rss_mb']:.0f}/{w['pss_mb']:.0f}/{w['private_mb']:.0f}" for w in r['workers'])
+                print(f"  {label:<13} prêt en {r['ready_ms']} ms, PSS total {r['total_pss_mb']} Mo | {workers}")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Mesure du gain du pool partagé + keep-alive sur la latence du premier token.
+
+Lance le faux serveur OpenAI en TLS (certificat auto-signé généré via openssl)
+avec un délai de connexion simulé, puis compare après une période d'inactivité:
+- "froid": la connexion a expiré, chaque requête repaie TCP + TLS;
+- "keep-alive": même pool, mais le pinger de services/openai_pool garde la connexion ouverte.
+
+    python benchmarks/bench_upstream_pool.py --requests 20 --connect-delay-ms 40
+"""
+import argparse
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import httpx
+from openai import OpenAI
+
+from benchmarks.fake_openai import FakeOpenAIConfig, start_fake_openai
+from src.services.openai_pool import build_http_client
+
+
+def make_self_signed_cert(directory):
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+         '-keyout', keyfile, '-out', certfile],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return certfile, keyfile
+
+
+def first_token_ms(openai_client):
+    start = time.perf_counter()
+    stream = openai_client.chat.completions.create(
+        model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'bonjour'}], max_tokens=8, stream=True,
+    )
+    ttft = None
+    for chunk in stream:
+        choice = (chunk.choices or [None])[0]
+        if ttft is None and choice is not None and choice.delta and choice.delta.content:
+            ttft = (time.perf_counter() - start) * 1000
+    return ttft
+
+
+def run_scenario(base_url, verify, requests, idle_s, keepalive_expiry, ping_interval):
+    http_client = build_http_client(
+        verify=verify,
+        limits=httpx.Limits(max_connections=4, max_keepalive_connections=4, keepalive_expiry=keepalive_expiry),
+    )
+    openai_client = OpenAI(api_key='sk-fake-key', base_url=base_url, http_client=http_client, max_retries=0)
+    stop = threading.Event()
+
+    def pinger():
+        while not stop.wait(ping_interval):
+            try:
+                http_client.head(f"{base_url}/models")
+            except httpx.HTTPError:
+                pass
+
+    if ping_interval:
+        threading.Thread(target=pinger, daemon=True).start()
+
+    samples = []
+    try:
+        first_token_ms(openai_client)  # ouverture initiale, exclue des mesures
+        for _ in range(requests):
+            time.sleep(idle_s)
+            samples.append(first_token_ms(openai_client))
+    finally:
+        stop.set()
+        http_client.close()
+    return samples
+
+
+def summarize(label, samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    print(f"{label:<12} n={len(samples):<3} p50={statistics.median(samples):7.1f} ms  "
+          f"p95={p95:7.1f} ms  moy={statistics.mean(samples):7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--idle-s', type=float, default=0.6, help="inactivité entre deux requêtes")
+    parser.add_argument('--connect-delay-ms', type=float, default=40.0)
+    parser.add_argument('--ttft-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = make_self_signed_cert(tmp)
+        server = start_fake_openai(
+            config=FakeOpenAIConfig(ttft_ms=args.ttft_ms, tokens_per_s=500, connect_delay_ms=args.connect_delay_ms),
+            certfile=certfile, keyfile=keyfile,
+        )
+        verify = ssl.create_default_context(cafile=certfile)
+        # La connexion expire pendant l'inactivité; seul le pinger la garde ouverte
+        expiry = args.idle_s / 2
+        try:
+            cold = run_scenario(server.base_url, verify, args.requests, args.idle_s, expiry, ping_interval=0)
+            warm = run_scenario(server.base_url, verify, args.requests, args.idle_s, expiry, ping_interval=expiry / 3)
+        finally:
+            server.shutdown()
+
+    print(f"TTFT après {args.idle_s:.1f} s d'inactivité (délai de connexion simulé {args.connect_delay_ms:.0f} ms)")
+    summarize('froid', cold)
+    summarize('keep-alive', warm)
+    print(f"gain médian: {statistics.median(cold) - statistics.median(warm):.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Faux serveur OpenAI local pour les benchmarks (aucune complétion facturée).
+
+Sert /v1/chat/completions (stream ou non, usage inclus), /v1/audio/transcriptions,
+/v1/audio/speech et HEAD/GET /v1/models, avec débit de tokens, time-to-first-token
+et injection d'erreurs configurables. Utilisable seul:
+
+    python benchmarks/fake_openai.py --port 8089 --ttft-ms 150 --tokens-per-s 60 --error-rate 0.02
+
+puis OPENAI_API_BASE=http://127.0.0.1:8089/v1 côté backend.
+"""
+import argparse
+import json
+import random
+import socket
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "Je comprends que ce moment soit difficile pour toi. Ce que tu ressens est "
+    "légitime et mérite d'être entendu. Qu'est-ce qui te pèse le plus aujourd'hui ?"
+).split(' ')
+
+
+class FakeOpenAIConfig:
+    def __init__(self, ttft_ms=120.0, tokens_per_s=80.0, max_tokens=180, connect_delay_ms=0.0,
+                 stt_ms=400.0, tts_ms=300.0, error_rate=0.0, error_status=500):
+        self.ttft_ms = ttft_ms
+        self.tokens_per_s = tokens_per_s
+        self.max_tokens = max_tokens
+        # Simule les allers-retours TCP/TLS d'une connexion neuve vers une région distante
+        self.connect_delay_ms = connect_delay_ms
+        self.stt_ms = stt_ms
+        self.tts_ms = tts_ms
+        # Fraction des requêtes POST qui échouent avec error_status (429, 500, 503...)
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeOpenAI/1.0'
+
+    def setup(self):
+        super().setup()
+        # Pas de Nagle: sinon les petits chunks SSE attendent l'ACK retardé du client (~40 ms)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_HEAD(self):
+        self.send_response(200 if self.path.rstrip('/').endswith('/models') else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            return self._send_json(200, {'object': 'list', 'data': [{'id': 'gpt-4o-mini', 'object': 'model'}]})
+        self._send_json(404, {'error': {'message': 'not found'}})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if self.config.error_rate and random.random() < self.config.error_rate:
+            self._read_body()
+            return self._send_json(self.config.error_status, {
+                'error': {'message': 'injected failure', 'type': 'server_error', 'code': 'fake_error'}
+            })
+        if path.endswith('/chat/completions'):
+            return self._chat_completions(self._read_json())
+        if path.endswith('/audio/transcriptions'):
+            return self._transcriptions()
+        if path.endswith('/audio/speech'):
+            return self._speech(self._read_json())
+        self._read_body()
+        self._send_json(404, {'error': {'message': 'not found'}})
+
+    def _transcriptions(self):
+        # Corps multipart ignoré: seule la durée compte pour le benchmark
+        self._read_body()
+        time.sleep(self.config.stt_ms / 1000.0)
+        self._send_json(200, {'text': "Je me sens un peu fatigué aujourd'hui."})
+
+    def _speech(self, body):
+        time.sleep(self.config.tts_ms / 1000.0)
+        # ~1 Ko d'audio factice par tranche de 16 caractères, envoyé en morceaux comme l'API
+        total = max(1024, len(body.get('input') or '') * 64)
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            chunk = b'\xff\xfb' + b'\x00' * 4094
+            sent = 0
+            while sent < total:
+                piece = chunk[:min(len(chunk), total - sent)]
+                self._write_chunk(piece)
+                sent += len(piece)
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _tokens(self, body):
+        n = min(int(body.get('max_tokens') or self.config.max_tokens), self.config.max_tokens)
+        return [(w if i == 0 else ' ' + w) for i, w in enumerate((WORDS * (n // len(WORDS) + 1))[:n])]
+
+    def _chat_completions(self, body):
+        tokens = self._tokens(body)
+        model = body.get('model') or 'gpt-4o-mini'
+        prompt_tokens = sum(len(str(m.get('content', '')).split()) for m in body.get('messages') or [])
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                 'total_tokens': prompt_tokens + len(tokens)}
+        time.sleep(self.config.ttft_ms / 1000.0)
+
+        if not body.get('stream'):
+            return self._send_json(200, {
+                'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': ''.join(tokens)}}],
+                'usage': usage,
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        interval = 1.0 / self.config.tokens_per_s if self.config.tokens_per_s > 0 else 0.0
+
+        def chunk(delta, finish_reason=None, **extra):
+            payload = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                       'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            payload.update(extra)
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+        try:
+            chunk({'role': 'assistant', 'content': ''})
+            for i, token in enumerate(tokens):
+                if i and interval:
+                    time.sleep(interval)
+                chunk({'content': token})
+            chunk({}, 'stop')
+            if (body.get('stream_options') or {}).get('include_usage'):
+                payload = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                           'model': model, 'choices': [], 'usage': usage}
+                self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Le client a fermé le stream (annulation): on arrête de générer
+            self.close_connection = True
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config, ssl_context=None):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config
+        if ssl_context is not None:
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        if self.config.connect_delay_ms:
+            time.sleep(self.config.connect_delay_ms / 1000.0)
+        return sock, addr
+
+    def finish_request(self, request, client_address):
+        # Handshake TLS dans le thread de la requête, pas dans la boucle d'accept
+        if isinstance(request, ssl.SSLSocket):
+            try:
+                request.do_handshake()
+            except (ssl.SSLError, OSError):
+                return
+        super().finish_request(request, client_address)
+
+    @property
+    def base_url(self):
+        scheme = 'https' if isinstance(self.socket, ssl.SSLSocket) else 'http'
+        host, port = self.server_address[:2]
+        return f"{scheme}://{'localhost' if scheme == 'https' else host}:{port}/v1"
+
+
+def start_fake_openai(host='127.0.0.1', port=0, config=None, certfile=None, keyfile=None):
+    """Démarrer le faux serveur dans un thread; retourne le serveur (voir .base_url)."""
+    ssl_context = None
+    if certfile:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(certfile, keyfile)
+    server = FakeOpenAIServer((host, port), config or FakeOpenAIConfig(), ssl_context=ssl_context)
+    threading.Thread(target=server.serve_forever, name='fake-openai', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--ttft-ms', type=float, default=120.0)
+    parser.add_argument('--tokens-per-s', type=float, default=80.0)
+    parser.add_argument('--max-tokens', type=int, default=180)
+    parser.add_argument('--connect-delay-ms', type=float, default=0.0)
+    parser.add_argument('--stt-ms', type=float, default=400.0)
+    parser.add_argument('--tts-ms', type=float, default=300.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(args.ttft_ms, args.tokens_per_s, args.max_tokens, args.connect_delay_ms,
+                              args.stt_ms, args.tts_ms, args.error_rate, args.error_status)
+    server = start_fake_openai(args.host, args.port, config, args.certfile, args.keyfile)
+    print(f"Faux OpenAI prêt sur {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Test de charge de bout en bout contre le faux serveur OpenAI.
+
+Démarre le faux OpenAI (débit de tokens, TTFT et taux d'erreur réglables),
+lance le backend dans un sous-processus (serveur threadé werkzeug ou gunicorn)
+sur SQLite ou Postgres, puis envoie /send, /send-stream, /speech-to-text et
+/text-to-speech à concurrence croissante. Pour chaque palier: p50/p95/p99 par
+endpoint, TTFT du streaming, débit, et saturation relevée sur /api/metrics
+(requêtes en cours, connexions du pool empruntées, générations actives).
+/text-to-speech étant simulé côté backend, chaque appel est suivi de la
+synthèse sur le faux /audio/speech (--tts-ms).
+
+Les résultats sont enregistrés en JSON dans benchmarks/results/ et peuvent
+être comparés à un run précédent:
+
+    python benchmarks/load_test.py --concurrency 1,4,16 --duration 15
+    python benchmarks/load_test.py --database-url postgresql://... --server gunicorn --workers 2 --threads 8
+    python benchmarks/load_test.py --compare benchmarks/results/<run>.json
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from benchmarks.fake_openai import FakeOpenAIConfig, start_fake_openai
+
+RESULTS_DIR = os.path.join(PROJECT_ROOT, 'benchmarks', 'results')
+ENDPOINTS = ('send', 'send-stream', 'stt', 'tts')
+SATURATION_METRICS = {
+    'in_flight': 'nonotalk_http_requests_in_flight',
+    'pool_checked_out': 'nonotalk_db_pool_checked_out',
+    'generations_active': 'nonotalk_generations_active',
+}
+# ~2 Ko d'octets quelconques: le backend ne décode pas l'audio, le faux serveur non plus
+FAKE_WEBM = b'\x1aE\xdf\xa3' + os.urandom(2044)
+PROMPTS = (
+    "J'ai passé une journée calme, on a parlé de mes enfants.",
+    "Je n'arrive pas bien à dormir ces temps-ci.",
+    "Raconte-moi quelque chose de gai.",
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def normalize_db_url(url):
+    # Même normalisation que src/main.py, pour la connexion directe du harnais
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    if url.startswith('postgresql://'):
+        url = url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    return url
+
+
+def start_backend(args, port, database_url, openai_base):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': database_url,
+        'OPENAI_API_BASE': openai_base,
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_KEEPALIVE_INTERVAL': '0',
+        'PYTHONUNBUFFERED': '1',
+    })
+    if args.server == 'gunicorn':
+        cmd = ['gunicorn', 'src.main:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(args.workers), '--worker-class', 'gthread', '--threads', str(args.threads),
+               '--timeout', '120']
+    else:
+        cmd = [sys.executable, '-c',
+               'from src.main import app; '
+               f'app.run(host="127.0.0.1", port={port}, threaded=True, debug=False, use_reloader=False)']
+    log = open(os.path.join(tempfile.gettempdir(), f'nonotalk-load-{port}.log'), 'w')
+    # Le schéma n'est plus créé à l'import de src.main
+    subprocess.run([sys.executable, 'init_db.py'], cwd=PROJECT_ROOT, env=env, check=True, stdout=log)
+    proc = subprocess.Popen(cmd, cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'backend arrêté au démarrage, voir {log.name}')
+        try:
+            if httpx.get(f'{base}/api/health', timeout=1).status_code == 200:
+                return proc, base, log.name
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'backend injoignable après 60 s, voir {log.name}')
+
+
+class VirtualUser:
+    """Un utilisateur de test: sa session, sa conversation, son client HTTP."""
+
+    def __init__(self, base, run_id, index, openai_base):
+        self.base = base
+        self.username = f'bench_{run_id}_{index}'
+        self.client = httpx.Client(base_url=base, timeout=httpx.Timeout(120.0, connect=5.0))
+        self.openai = httpx.Client(base_url=openai_base, timeout=httpx.Timeout(120.0, connect=5.0))
+        self.conversation_id = None
+
+    def register(self):
+        resp = self.client.post('/api/auth/register', json={
+            'username': self.username, 'email': f'{self.username}@bench.invalid', 'pin': '1234',
+        })
+        resp.raise_for_status()
+        # Cookie de session "Secure": httpx ne le renverrait pas en http, on le fixe à la main
+        session_cookie = resp.cookies.get('session')
+        self.client.headers['Cookie'] = f'session={session_cookie}'
+
+    def open_conversation(self):
+        resp = self.client.post('/api/chat/conversations', json={'title': 'bench'})
+        resp.raise_for_status()
+        self.conversation_id = resp.json()['conversation']['id']
+
+    def call(self, endpoint, n):
+        """Retourne (ok, statut, ttft_ms ou None)."""
+        prompt = PROMPTS[n % len(PROMPTS)]
+        if endpoint == 'send':
+            resp = self.client.post(f'/api/chat/conversations/{self.conversation_id}/send', json={'message': prompt})
+            return resp.status_code == 200, resp.status_code, None
+        if endpoint == 'send-stream':
+            return self._stream(prompt)
+        if endpoint == 'stt':
+            resp = self.client.post('/api/speech-to-text', files={'audio': ('voice.webm', FAKE_WEBM, 'audio/webm')})
+            return resp.status_code == 200, resp.status_code, None
+        return self._tts(prompt)
+
+    def _tts(self, prompt):
+        # /text-to-speech est encore simulé côté backend (fichier vide, aucun appel OpenAI): la synthèse
+        # est demandée au faux /audio/speech à la suite, pour que le palier en porte la latence
+        resp = self.client.post('/api/text-to-speech', json={'text': prompt, 'voice': 'nova'})
+        if resp.status_code != 200:
+            return False, resp.status_code, None
+        with self.openai.stream('POST', '/audio/speech', json={'model': 'tts-1', 'voice': 'nova', 'input': prompt}) as speech:
+            for _ in speech.iter_bytes():
+                pass
+        return speech.status_code == 200, speech.status_code, None
+
+    def _stream(self, prompt):
+        start = time.perf_counter()
+        ttft = None
+        outcome = None
+        url = f'/api/chat/conversations/{self.conversation_id}/send-stream'
+        with self.client.stream('POST', url, json={'message': prompt}) as resp:
+            if resp.status_code != 200:
+                resp.read()
+                return False, resp.status_code, None
+            for line in resp.iter_lines():
+                if not line.startswith('data:'):
+                    continue
+                kind = json.loads(line[5:]).get('type')
+                if kind == 'delta' and ttft is None:
+                    ttft = (time.perf_counter() - start) * 1000
+                elif kind in ('done', 'error', 'cancelled'):
+                    outcome = kind
+                    if kind != 'cancelled':
+                        break
+        return outcome == 'done', resp.status_code, ttft
+
+
+def grant_quota(database_url, run_id):
+    """Quota illimité pour les comptes du run (10 par défaut épuiserait le test en quelques secondes)."""
+    engine = create_engine(normalize_db_url(database_url))
+    with engine.begin() as conn:
+        conn.execute(text('UPDATE "user" SET quota_remaining = 1000000, total_quota = 1000000 '
+                          'WHERE username LIKE :prefix'), {'prefix': f'bench_{run_id}_%'})
+    engine.dispose()
+
+
+def parse_gauges(body):
+    values = {}
+    for key, name in SATURATION_METRICS.items():
+        match = re.search(rf'^{name}(?:{{[^}}]*}})? (\S+)$', body, re.MULTILINE)
+        if match:
+            try:
+                values[key] = float(match.group(1))
+            except ValueError:
+                pass
+    return values
+
+
+class SaturationSampler(threading.Thread):
+    """Relève les jauges de /api/metrics pendant un palier (un seul worker par scrape sous gunicorn)."""
+
+    def __init__(self, base, interval):
+        super().__init__(daemon=True)
+        self.base = base
+        self.interval = interval
+        self.peaks = defaultdict(float)
+        self.samples = defaultdict(list)
+        self._stopped = threading.Event()
+
+    def run(self):
+        with httpx.Client(base_url=self.base, timeout=5) as client:
+            while not self._stopped.is_set():
+                try:
+                    for key, value in parse_gauges(client.get('/api/metrics').text).items():
+                        self.peaks[key] = max(self.peaks[key], value)
+                        self.samples[key].append(value)
+                except httpx.HTTPError:
+                    pass
+                self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return {key: {'max': self.peaks[key], 'mean': round(statistics.fmean(v), 2)}
+                for key, v in self.samples.items() if v}
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None}
+    if len(values) == 1:
+        return {'p50': round(values[0], 1), 'p95': round(values[0], 1), 'p99': round(values[0], 1)}
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': round(cuts[49], 1), 'p95': round(cuts[94], 1), 'p99': round(cuts[98], 1)}
+
+
+def run_level(users, endpoints, concurrency, duration, base, sample_interval):
+    records = []
+    records_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(index):
+        user = users[index]
+        n = index
+        while time.monotonic() < stop_at:
+            endpoint = endpoints[n % len(endpoints)]
+            start = time.perf_counter()
+            try:
+                ok, status, ttft = user.call(endpoint, n)
+            except httpx.HTTPError as e:
+                ok, status, ttft = False, type(e).__name__, None
+            latency = (time.perf_counter() - start) * 1000
+            with records_lock:
+                records.append((endpoint, ok, status, latency, ttft))
+            n += 1
+
+    sampler = SaturationSampler(base, sample_interval)
+    sampler.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    saturation = sampler.stop()
+
+    per_endpoint = {}
+    for endpoint in endpoints:
+        rows = [r for r in records if r[0] == endpoint]
+        ok_rows = [r for r in rows if r[1]]
+        errors = defaultdict(int)
+        for r in rows:
+            if not r[1]:
+                errors[str(r[2])] += 1
+        entry = {
+            'requests': len(rows),
+            'errors': dict(errors),
+            'throughput_rps': round(len(ok_rows) / elapsed, 2),
+            'latency_ms': percentiles([r[3] for r in ok_rows]),
+        }
+        if endpoint == 'send-stream':
+            entry['ttft_ms'] = percentiles([r[4] for r in ok_rows if r[4] is not None])
+        per_endpoint[endpoint] = entry
+    return {
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 2),
+        'requests': len(records),
+        'throughput_rps': round(sum(1 for r in records if r[1]) / elapsed, 2),
+        'endpoints': per_endpoint,
+        'saturation': saturation,
+    }
+
+
+def print_level(level):
+    sat = level['saturation']
+    print(f"\n== concurrence {level['concurrency']}: {level['requests']} requêtes, "
+          f"{level['throughput_rps']} req/s | en cours max {sat.get('in_flight', {}).get('max', '-')}, "
+          f"pool max {sat.get('pool_checked_out', {}).get('max', '-')}, "
+          f"générations max {sat.get('generations_active', {}).get('max', '-')}")
+    print(f"  {'endpoint':<12} {'n':>6} {'err':>5} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'ttft50':>8} {'ttft95':>8}")
+    for name, e in level['endpoints'].items():
+        lat, ttft = e['latency_ms'], e.get('ttft_ms') or {}
+        fmt = lambda v: '-' if v is None else f'{v:.0f}'
+        print(f"  {name:<12} {e['requests']:>6} {sum(e['errors'].values()):>5} {e['throughput_rps']:>7} "
+              f"{fmt(lat['p50']):>8} {fmt(lat['p95']):>8} {fmt(lat['p99']):>8} "
+              f"{fmt(ttft.get('p50')):>8} {fmt(ttft.get('p95')):>8}")
+
+
+def compare(current, previous):
+    """Écarts de débit et de p95 par (palier, endpoint) entre deux runs."""
+    before = {(lvl['concurrency'], name): e for lvl in previous['levels'] for name, e in lvl['endpoints'].items()}
+    print(f"\n== comparaison avec {previous.get('run_id')} ({previous.get('label') or ''})")
+    print(f"  {'c':>4} {'endpoint':<12} {'req/s':>16} {'p95 ms':>18}")
+    for lvl in current['levels']:
+        for name, e in lvl['endpoints'].items():
+            old = before.get((lvl['concurrency'], name))
+            if not old:
+                continue
+            p95_new, p95_old = e['latency_ms']['p95'], old['latency_ms']['p95']
+            p95 = '-' if p95_new is None or p95_old is None else f'{p95_old:.0f} -> {p95_new:.0f}'
+            print(f"  {lvl['concurrency']:>4} {name:<12} "
+                  f"{old['throughput_rps']:>7} -> {e['throughput_rps']:<7} {p95:>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4,16', help='paliers de concurrence, séparés par des virgules')
+    parser.add_argument('--duration', type=float, default=15.0, help='durée de chaque palier (s)')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--database-url', help='Postgres à tester (défaut: SQLite temporaire)')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ttft-ms', type=float, default=150.0)
+    parser.add_argument('--tokens-per-s', type=float, default=80.0)
+    parser.add_argument('--max-tokens', type=int, default=60)
+    parser.add_argument('--stt-ms', type=float, default=400.0)
+    parser.add_argument('--tts-ms', type=float, default=300.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--sample-interval', type=float, default=0.25)
+    parser.add_argument('--label', default='', help='libellé libre enregistré avec les résultats')
+    parser.add_argument('--compare', help='fichier de résultats précédent à comparer')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"endpoints inconnus: {', '.join(sorted(unknown))}")
+
+    tmpdir = tempfile.mkdtemp(prefix='nonotalk-load-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    fake_config = FakeOpenAIConfig(
+        ttft_ms=args.ttft_ms, tokens_per_s=args.tokens_per_s, max_tokens=args.max_tokens,
+        stt_ms=args.stt_ms, tts_ms=args.tts_ms, error_rate=args.error_rate,
+    )
+    fake_server = start_fake_openai(port=free_port(), config=fake_config)
+    openai_base = f'http://127.0.0.1:{fake_server.server_address[1]}/v1'
+    proc, base, log_path = start_backend(args, free_port(), database_url, openai_base)
+
+    run_id = time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:4]
+    result = {
+        'run_id': run_id,
+        'label': args.label,
+        'database': 'postgresql' if database_url.startswith('postgres') else 'sqlite',
+        'server': args.server if args.server == 'werkzeug' else f'gunicorn gthread {args.workers}x{args.threads}',
+        'fake_openai': vars(fake_config),
+        'endpoints': endpoints,
+        'levels': [],
+    }
+    try:
+        users = [VirtualUser(base, run_id.replace('-', ''), i, openai_base) for i in range(max(levels))]
+        for user in users:
+            user.register()
+        grant_quota(database_url, run_id.replace('-', ''))
+        for user in users:
+            user.open_conversation()
+        print(f"run {run_id}: {result['database']}, {result['server']}, {len(users)} utilisateurs, log {log_path}")
+
+        for concurrency in levels:
+            level = run_level(users, endpoints, concurrency, args.duration, base, args.sample_interval)
+            result['levels'].append(level)
+            print_level(level)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake_server.shutdown()
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f'{run_id}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nrésultats: {path}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
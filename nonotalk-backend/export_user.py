@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Exporte toutes les données d'un utilisateur en NDJSON (même format que
+GET /api/auth/export, voir src/services/export.py).
+
+Objectif:
+- Répondre à une demande de portabilité sans passer par l'API
+- Lecture par lots et écriture au fil de l'eau: mémoire constante, même pour
+  des centaines de milliers de messages
+- NE PAS importer src.main ni les routes (comme reset_db.py)
+
+Exemples:
+
+    python export_user.py --username mamie_jo > mamie_jo.ndjson
+    python export_user.py --user-id 42 --gzip --output export-42.ndjson.gz
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# S'assurer que le répertoire projet (celui contenant 'src/') est dans sys.path
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+from src.models.user import db, User
+from src.services.export import export_records, ndjson_chunks
+from src.services.standalone import create_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="par défaut DATABASE_URL")
+    who = parser.add_mutually_exclusive_group(required=True)
+    who.add_argument("--user-id", type=int)
+    who.add_argument("--username")
+    parser.add_argument("--output", default="-", help="fichier de sortie (par défaut la sortie standard)")
+    parser.add_argument("--gzip", action="store_true", help="compresser en gzip")
+    args = parser.parse_args()
+
+    app = create_app(args.database_url)
+    with app.app_context():
+        user_id = args.user_id
+        if args.username:
+            user_id = db.session.query(User.id).filter_by(username=args.username).scalar()
+        if user_id is None or db.session.get(User, user_id) is None:
+            print("✗ Utilisateur introuvable", file=sys.stderr)
+            sys.exit(1)
+
+        started = time.perf_counter()
+        written = 0
+        out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        try:
+            for chunk in ndjson_chunks(export_records(user_id), compress=args.gzip):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        print(f"✓ {written} octets exportés en {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
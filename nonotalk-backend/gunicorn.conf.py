@@ -0,0 +1,147 @@
+"""
+Configuration gunicorn de production (chargée automatiquement depuis le
+répertoire courant, ou via `gunicorn -c gunicorn.conf.py src.main:app`).
+
+Choix du modèle de workers:
+- Les routes passent l'essentiel de leur temps à attendre (OpenAI, SMTP, base)
+  et /send-stream garde une connexion ouverte toute la durée d'une réponse:
+  des workers `sync` (défaut de gunicorn) bloqueraient un processus entier par
+  stream et le tueraient au bout de 30 s.
+- `gthread` par défaut: quelques processus (CPU effectifs + 1, plafonnés) et
+  beaucoup de threads chacun. Les générations tournent déjà dans des threads
+  (services/generations.py), le profileur lit les piles des threads et psycopg
+  attend en C: le modèle threadé est celui que le code suppose.
+- `gevent` seulement sur demande explicite (GUNICORN_WORKER_CLASS=gevent, paquet
+  gevent installé); le préchargement est alors désactivé car le monkey-patching
+  doit précéder l'import de l'application.
+
+Métriques: chaque worker a son registre; METRICS_MULTIPROC_DIR (par défaut
+un répertoire temporaire, vidé au démarrage du maître) leur permet d'écrire
+leurs instantanés pour que /api/metrics agrège tous les workers
+(services/metrics.py).
+
+Variables: GUNICORN_WORKER_CLASS (auto | gthread | gevent | sync),
+WEB_CONCURRENCY (nombre de workers), GUNICORN_MAX_WORKERS, GUNICORN_THREADS,
+GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_KEEPALIVE, PRELOAD_APP,
+METRICS_MULTIPROC_DIR.
+"""
+import glob
+import importlib.util
+import math
+import multiprocessing
+import os
+import signal
+import tempfile
+
+
+def effective_cpus():
+    """CPU réellement disponibles: quota cgroup (conteneur Render) puis affinité."""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+def _choose_worker_class():
+    requested = os.getenv('GUNICORN_WORKER_CLASS', 'auto').strip().lower()
+    if requested == 'gevent':
+        if importlib.util.find_spec('gevent') is not None:
+            return 'gevent'
+        print("[gunicorn] gevent demandé mais non installé: gthread utilisé")
+        return 'gthread'
+    if requested in ('gthread', 'sync'):
+        return requested
+    return 'gthread'
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+cpus = effective_cpus()
+worker_class = _choose_worker_class()
+
+if worker_class == 'gevent':
+    workers = int(os.getenv('WEB_CONCURRENCY', str(cpus)))
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+else:
+    # Chaque worker coûte ~50 Mo: le plafond protège les petites instances qui voient tous les cœurs de l'hôte
+    workers = int(os.getenv('WEB_CONCURRENCY', str(min(cpus + 1, int(os.getenv('GUNICORN_MAX_WORKERS', '4'))))))
+    # Un thread par requête en cours, streams SSE compris
+    threads = int(os.getenv('GUNICORN_THREADS', '16')) if worker_class == 'gthread' else 1
+
+# gthread/gevent: le timeout ne surveille que la boucle du worker, pas la durée d'une requête;
+# un stream long n'est donc pas tué. Il reste utile pour détecter un worker bloqué.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# Temps laissé aux streams en cours au déploiement (SIGTERM); < maxShutdownDelaySeconds de Render
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '75'))
+# Supérieur au délai d'inactivité du proxy devant l'app (60 s), sinon il réutilise une connexion fermée
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '75'))
+
+preload_app = worker_class != 'gevent' and os.getenv('PRELOAD_APP', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+# Lu par src/main.py: partage copy-on-write avant le fork, dimensionnement du pool SQL (services/db_pool.py)
+os.environ['PRELOAD_APP'] = '1' if preload_app else '0'
+os.environ['GUNICORN_WORKER_CLASS'] = worker_class
+os.environ['WEB_CONCURRENCY'] = str(workers)
+if worker_class == 'gthread':
+    os.environ['GUNICORN_THREADS'] = str(threads)
+elif worker_class == 'gevent':
+    os.environ['GUNICORN_WORKER_CONNECTIONS'] = str(worker_connections)
+
+# Lu par src/services/metrics.py à l'import (maître avec preload, sinon chaque worker)
+os.environ.setdefault('METRICS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), f'nonotalk-metrics-{bind.rsplit(":", 1)[-1]}'))
+
+# Les en-têtes X-Forwarded-* du proxy Render sont fiables
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '*')
+
+
+def on_starting(server):
+    # Instantanés d'un lancement précédent: leurs compteurs s'ajouteraient à ceux des nouveaux workers
+    directory = os.environ['METRICS_MULTIPROC_DIR']
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def when_ready(server):
+    server.log.info(
+        "nonotalk: %s x %s workers%s, timeout %ss, graceful %ss, keepalive %ss, preload %s (cpus=%s)",
+        worker_class, workers,
+        f" x {threads} threads" if worker_class == 'gthread' else '',
+        timeout, graceful_timeout, keepalive, preload_app, cpus,
+    )
+
+
+def post_worker_init(worker):
+    from src.services import openai_pool, startup
+
+    # Connexion TLS vers OpenAI ouverte dès le démarrage du worker, pas à la première requête
+    openai_pool.start_keepalive()
+
+    # SIGTERM: /api/ready passe à 503 avant que le worker arrête d'accepter
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def _on_term(signum, frame):
+        startup.begin_drain()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, _on_term)
+
+
+def worker_exit(server, worker):
+    # Les connexions en cours sont terminées; restent les générations dont le client
+    # s'est déconnecté: les laisser finir pour que la réponse soit enregistrée en base
+    from src.services import startup
+    from src.services.generations import active_generations, drain_generations
+
+    if not active_generations():
+        return
+    remaining = max(0.0, graceful_timeout - startup.drain_elapsed() - 2)
+    left = drain_generations(remaining)
+    if left:
+        server.log.warning("nonotalk: %s génération(s) interrompue(s) à l'arrêt", left)
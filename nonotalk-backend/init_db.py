@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Création / mise à niveau du schéma, à lancer une fois par déploiement.
+
+Objectif:
+- Sortir db.create_all() du chemin d'import de src.main (auparavant exécuté
+  par chaque worker gunicorn à chaque démarrage)
+- NE PAS importer src.main, ni les routes Flask, ni LangChain
+- create_all + colonnes additives manquantes (voir src/models/schema.py)
+"""
+
+import os
+import sys
+
+# S'assurer que le répertoire projet (celui contenant 'src/') est dans sys.path
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from src.models.schema import ensure_schema
+from src.services.standalone import create_app
+
+
+def init_database() -> None:
+    app = create_app()
+    try:
+        with app.app_context():
+            ensure_schema()
+        print("✓ Schéma à jour")
+    except Exception as e:
+        print(f"✗ Erreur lors de la création du schéma: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    init_database()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Pose l'index de recherche plein texte Postgres (voir src/services/search.py).
+
+Objectif:
+- Sortir la colonne message.search_vector et son index GIN de la
+  transaction de déploiement (init_db.py): une colonne GENERATED STORED
+  réécrit toute la table sous verrou exclusif
+- Colonne nullable + trigger, remplissage par lots (une transaction par
+  lot), puis CREATE INDEX CONCURRENTLY: l'application continue d'écrire
+- Reprise possible après interruption (lots déjà remplis sautés, index
+  invalide recréé); la recherche reste en LIKE jusqu'à la fin, puis les
+  workers utilisent l'index à leur prochain démarrage
+- NE PAS importer src.main ni les routes (comme reset_db.py)
+
+Exemples:
+
+    python migrate_search_index.py
+    python migrate_search_index.py --batch-size 20000 --lock-timeout 2s
+"""
+
+import argparse
+import os
+import sys
+
+# S'assurer que le répertoire projet (celui contenant 'src/') est dans sys.path
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+from src.models.user import db
+from src.models.schema import ensure_schema
+from src.services.search import SEARCH_INDEX_BATCH_SIZE, migrate_search_index
+from src.services.standalone import create_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="par défaut DATABASE_URL")
+    parser.add_argument("--batch-size", type=int, default=SEARCH_INDEX_BATCH_SIZE, help="messages par transaction")
+    parser.add_argument("--lock-timeout", default="5s",
+                        help="attente maximale du verrou de l'ALTER TABLE (réessayer plus tard si dépassée)")
+    args = parser.parse_args()
+
+    app = create_app(args.database_url)
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            print("✓ Rien à faire: hors Postgres, l'index (FTS5) est créé par init_db.py")
+            return
+        ensure_schema()
+        try:
+            migrate_search_index(db.engine, batch_size=args.batch_size, lock_timeout=args.lock_timeout)
+        except Exception as e:
+            print(f"✗ Migration interrompue (relançable): {e}")
+            sys.exit(1)
+    print("✓ Recherche plein texte indexée")
+
+
+if __name__ == "__main__":
+    main()
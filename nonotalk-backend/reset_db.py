@@ -18,36 +18,10 @@ PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from dotenv import load_dotenv
-from flask import Flask
-
 # Importer le db et les modèles pour que SQLAlchemy voie toutes les tables
 # (Pas d'import de src.main ni de routes ici)
 from src.models.user import db, User, Conversation, Message, CrisisAlert, Invitation  # noqa: F401
-
-
-def create_app() -> Flask:
-    """Crée une application Flask minimale, configurée uniquement pour SQLAlchemy."""
-    # Charger le .env depuis la racine du projet
-    load_dotenv(os.path.join(PROJECT_ROOT, ".env"))
-
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise RuntimeError(
-            "DATABASE_URL est manquante. Ajoutez-la dans le fichier .env à la racine du projet."
-        )
-
-    app = Flask(__name__)
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-    # Forcer SSL pour Neon (cohérent avec src/main.py)
-    if database_url.startswith("postgresql"):
-        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": {"sslmode": "require"}}
-
-    # Initialiser l'extension avec cette app
-    db.init_app(app)
-    return app
+from src.services.standalone import create_app
 
 
 def reset_database() -> None:
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Génère un jeu de données synthétique à l'échelle de la production.
+
+Objectif:
+- Charger des millions de lignes User / Conversation / Message / Invitation /
+  CrisisAlert en quelques minutes, pour tester les requêtes et les index
+- Insertions par lots hors ORM: COPY (psycopg) sur Postgres, executemany ailleurs
+- Distributions réalistes: longueur des conversations à queue lourde (Pareto),
+  nombre de conversations par utilisateur idem, parrainages, alertes rares
+- Ne PAS importer src.main ni les routes (comme reset_db.py)
+
+Les identifiants sont attribués par le script à partir du max existant: on
+peut relancer pour ajouter des données. Exemple:
+
+    python seed_dataset.py --users 100000 --conversations-mean 4 --messages-mean 30
+    python seed_dataset.py --database-url sqlite:////tmp/scale.db --users 20000 --seed 7
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# S'assurer que le répertoire projet (celui contenant 'src/') est dans sys.path
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
+
+from src.models.user import db, User, Conversation, Message, CrisisAlert, Invitation
+from src.models.schema import ensure_schema
+from src.services.standalone import create_app
+
+EMOTIONS = ('joie', 'tristesse', 'colère', 'peur', 'calme', 'fatigue', 'neutre')
+WORDS = (
+    "je", "tu", "il", "elle", "nous", "aujourd'hui", "hier", "demain", "mon", "ma", "petit", "fils",
+    "fille", "jardin", "soleil", "pluie", "souvenir", "promenade", "café", "voisin", "médecin",
+    "dormir", "manger", "rire", "parler", "téléphone", "famille", "amie", "musique", "radio",
+    "peu", "beaucoup", "toujours", "parfois", "content", "fatigué", "seul", "calme", "chat",
+    "marché", "église", "photo", "lettre", "recette", "tricot", "jeu", "cartes", "mots", "croisés",
+)
+CRISIS_PHRASES = (
+    "je veux mourir",
+    "plus envie de vivre",
+    "j'ai envie d'en finir",
+    "je pense au suicide",
+)
+
+
+def heavy_tail(rng, mean, alpha, cap):
+    """Entier >= 1 tiré d'une loi de Pareto de moyenne ~`mean` (alpha > 1; plus petit = queue plus lourde)."""
+    scale = mean * (alpha - 1) / alpha
+    return max(1, min(cap, int(scale * rng.paretovariate(alpha))))
+
+
+def sentence(rng, mean_words):
+    n = max(1, int(rng.lognormvariate(math.log(mean_words), 0.5)))
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+class TableWriter:
+    """Insertion par lots d'une table, colonnes dans l'ordre du modèle.
+
+    Les colonnes non fournies prennent leur valeur par défaut scalaire du
+    modèle (les défauts SQLAlchemy sont côté client: COPY ne les verrait pas).
+    """
+
+    def __init__(self, raw_connection, dialect, table):
+        self.raw = raw_connection
+        self.dialect = dialect
+        self.table = table
+        self.columns = [c.name for c in table.columns]
+        self.defaults = {}
+        for column in table.columns:
+            default = column.default
+            self.defaults[column.name] = default.arg if default is not None and default.is_scalar else None
+        self.rows = 0
+
+    def _tuples(self, rows):
+        columns, defaults = self.columns, self.defaults
+        values = [tuple(row.get(c, defaults[c]) for c in columns) for row in rows]
+        if self.dialect.name == 'sqlite':
+            # Même format texte que SQLAlchemy (l'adaptateur datetime de sqlite3 est déprécié)
+            values = [tuple(str(v) if isinstance(v, datetime) else v for v in row) for row in values]
+        return values
+
+    def write(self, rows):
+        if not rows:
+            return
+        quoted = ', '.join(f'"{c}"' for c in self.columns)
+        cursor = self.raw.cursor()
+        try:
+            if self.dialect.name == 'postgresql' and self.dialect.driver == 'psycopg':
+                with cursor.copy(f'COPY "{self.table.name}" ({quoted}) FROM STDIN') as copy:
+                    for values in self._tuples(rows):
+                        copy.write_row(values)
+            else:
+                marker = '?' if self.dialect.paramstyle == 'qmark' else '%s'
+                placeholders = ', '.join([marker] * len(self.columns))
+                cursor.executemany(f'INSERT INTO "{self.table.name}" ({quoted}) VALUES ({placeholders})',
+                                   self._tuples(rows))
+        finally:
+            cursor.close()
+        self.rows += len(rows)
+
+
+def next_ids():
+    """Premier identifiant libre de chaque table (pour pouvoir ajouter à une base existante)."""
+    ids = {}
+    for model in (User, Conversation, Message, Invitation, CrisisAlert):
+        ids[model.__tablename__] = (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+    db.session.rollback()
+    return ids
+
+
+def generate_block(rng, opts, ids, first_user_id, n_users, pin_hash, now):
+    """Lignes de `n_users` utilisateurs et de tout ce qui leur appartient."""
+    users, conversations, messages, invitations, alerts = [], [], [], [], []
+    span = timedelta(days=opts.days)
+    for user_id in range(first_user_id, first_user_id + n_users):
+        created = now - span * rng.random()
+        accepted = 0
+        if rng.random() < opts.invitation_rate:
+            for _ in range(rng.randint(1, 3)):
+                is_accepted = rng.random() < opts.accept_rate
+                accepted += is_accepted
+                sent = created + (now - created) * rng.random()
+                invitations.append({
+                    'id': ids['invitation'], 'inviter_id': user_id,
+                    'email': f"invite_{ids['invitation']}@example.org",
+                    'accepted': is_accepted, 'created_at': sent,
+                    'accepted_at': sent + timedelta(hours=rng.expovariate(1 / 48)) if is_accepted else None,
+                })
+                ids['invitation'] += 1
+
+        last_seen = created
+        for _ in range(heavy_tail(rng, opts.conversations_mean, opts.tail_alpha, opts.max_conversations)):
+            conversation_id = ids['conversation']
+            ids['conversation'] += 1
+            started = created + (now - created) * rng.random()
+            at = started
+            for i in range(heavy_tail(rng, opts.messages_mean, opts.tail_alpha, opts.max_messages)):
+                is_user = i % 2 == 0
+                at += timedelta(seconds=rng.expovariate(1 / 40))
+                messages.append({
+                    'id': ids['message'], 'conversation_id': conversation_id,
+                    'content': sentence(rng, 14 if is_user else 35), 'is_user': is_user, 'timestamp': at,
+                    'emotion_detected': rng.choice(EMOTIONS) if is_user and rng.random() < 0.3 else None,
+                })
+                ids['message'] += 1
+            conversations.append({
+                'id': conversation_id, 'user_id': user_id, 'title': sentence(rng, 3)[:200],
+                'created_at': started, 'updated_at': at,
+            })
+            last_seen = max(last_seen, at)
+
+        if rng.random() < opts.crisis_rate:
+            for _ in range(heavy_tail(rng, 1.5, opts.tail_alpha, 50)):
+                alerts.append({
+                    'id': ids['crisis_alert'], 'user_id': user_id, 'message_content': rng.choice(CRISIS_PHRASES),
+                    'timestamp': created + (now - created) * rng.random(), 'resolved': rng.random() < 0.8,
+                })
+                ids['crisis_alert'] += 1
+
+        parrain_email = None
+        if user_id > 1 and rng.random() < opts.referral_rate:
+            parrain_email = f"{opts.prefix}{rng.randint(max(1, first_user_id - 100000), user_id - 1)}@example.org"
+        users.append({
+            'id': user_id, 'username': f"{opts.prefix}{user_id}", 'email': f"{opts.prefix}{user_id}@example.org",
+            'pin_hash': pin_hash, 'quota_remaining': rng.randint(0, 10) + 5 * accepted,
+            'total_quota': 10 + 5 * accepted, 'parrain_email': parrain_email, 'filleuls_count': accepted,
+            'created_at': created, 'last_login': last_seen,
+        })
+    return users, conversations, messages, invitations, alerts
+
+
+def seed(opts):
+    app = create_app(opts.database_url)
+    rng = random.Random(opts.seed)
+    # Un seul hachage pour tous les comptes: même longueur que les vrais, PIN "1234"
+    pin_hash = generate_password_hash('1234')
+    now = datetime.utcnow()
+
+    with app.app_context():
+        ensure_schema()
+        engine = db.engine
+        ids = next_ids()
+        raw = engine.raw_connection()
+        try:
+            if engine.dialect.name == 'sqlite':
+                raw.execute('PRAGMA journal_mode=WAL')
+                raw.execute('PRAGMA synchronous=OFF')
+            writers = {model.__tablename__: TableWriter(raw, engine.dialect, model.__table__)
+                       for model in (User, Conversation, Message, Invitation, CrisisAlert)}
+            start = time.perf_counter()
+            done = 0
+            while done < opts.users:
+                n = min(opts.block_size, opts.users - done)
+                users, conversations, messages, invitations, alerts = generate_block(
+                    rng, opts, ids, ids['user'], n, pin_hash, now)
+                ids['user'] += n
+                # Ordre des clés étrangères: parents d'abord
+                writers['user'].write(users)
+                writers['conversation'].write(conversations)
+                for i in range(0, len(messages), opts.batch_size):
+                    writers['message'].write(messages[i:i + opts.batch_size])
+                writers['invitation'].write(invitations)
+                writers['crisis_alert'].write(alerts)
+                raw.commit()
+                done += n
+                total = sum(w.rows for w in writers.values())
+                elapsed = time.perf_counter() - start
+                print(f"  {done}/{opts.users} utilisateurs, {total} lignes, {total / elapsed:,.0f} lignes/s", flush=True)
+
+            if engine.dialect.name == 'postgresql':
+                cursor = raw.cursor()
+                # Les séquences SERIAL n'ont pas vu les id explicites
+                for name in writers:
+                    cursor.execute(f"SELECT setval(pg_get_serial_sequence('\"{name}\"', 'id'), "
+                                   f"(SELECT COALESCE(MAX(id), 1) FROM \"{name}\"))")
+                raw.commit()
+                if opts.analyze:
+                    cursor.execute('ANALYZE')
+                    raw.commit()
+                cursor.close()
+            elif opts.analyze:
+                raw.execute('ANALYZE')
+                raw.commit()
+        finally:
+            raw.close()
+
+    print("✓ Jeu de données généré:")
+    for name, writer in writers.items():
+        print(f"  {name:<14} {writer.rows:>12,}")
+    print(f"  en {time.perf_counter() - start:.1f} s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help="défaut: DATABASE_URL du .env")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--conversations-mean', type=float, default=4.0, help='conversations par utilisateur (moyenne)')
+    parser.add_argument('--messages-mean', type=float, default=24.0, help='messages par conversation (moyenne)')
+    parser.add_argument('--tail-alpha', type=float, default=1.6,
+                        help='exposant de Pareto (> 1); plus petit = queue plus lourde')
+    parser.add_argument('--max-conversations', type=int, default=500)
+    parser.add_argument('--max-messages', type=int, default=5000)
+    parser.add_argument('--invitation-rate', type=float, default=0.2, help="part des utilisateurs qui invitent")
+    parser.add_argument('--accept-rate', type=float, default=0.4, help="part des invitations acceptées")
+    parser.add_argument('--referral-rate', type=float, default=0.15, help="part des comptes avec un parrain_email")
+    parser.add_argument('--crisis-rate', type=float, default=0.01, help="part des utilisateurs avec des alertes")
+    parser.add_argument('--days', type=int, default=365, help="ancienneté maximale des données")
+    parser.add_argument('--prefix', default='synth_', help="préfixe des username / emails générés")
+    parser.add_argument('--block-size', type=int, default=1000, help="utilisateurs par transaction")
+    parser.add_argument('--batch-size', type=int, default=50000, help="lignes de messages par lot")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--no-analyze', dest='analyze', action='store_false')
+    opts = parser.parse_args(argv)
+    if opts.tail_alpha <= 1:
+        parser.error('--tail-alpha doit être > 1')
+    return opts
+
+
+if __name__ == "__main__":
+    try:
+        seed(parse_args())
+    except Exception as e:
+        print(f"✗ Erreur lors de la génération: {e}")
+        sys.exit(1)
@@ -10,31 +10,31 @@ load_dotenv(os.path.join(project_root, '.env'))
 
 from flask import Flask, send_from_directory
 from flask_cors import CORS
+from sqlalchemy import text
 from src.models.user import db
+from src.models.schema import ensure_schema
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
 from src.routes.chat import chat_bp
 from src.routes.tts import tts_bp
 from src.routes.static import static_bp
 from src.routes.invite import invite_bp
+from src.routes.metrics import metrics_bp
+from src.routes.crisis import crisis_bp
+from src.services import db_pool, logs, metrics, profiler, query_stats, replicas, search, startup
+from src.services.db_pool import normalize_database_url
+from src.services.generations import active_generations
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
 # Configuration
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'nonotalk-secret-key-2025')
-db_url = os.getenv('DATABASE_URL')
-# Normalise et force le driver psycopg (psycopg3) pour compatibilité Render/Python 3.13
-if db_url:
-    # Render fournit parfois 'postgres://', que SQLAlchemy déconseille
-    if db_url.startswith("postgres://"):
-        db_url = db_url.replace("postgres://", "postgresql://", 1)
-    # Remplacer +psycopg2 par +psycopg pour psycopg3
-    if db_url.startswith("postgresql+psycopg2://"):
-        db_url = db_url.replace("postgresql+psycopg2://", "postgresql+psycopg://", 1)
-    # Si aucun driver n'est précisé, on impose psycopg (psycopg3)
-    if db_url.startswith("postgresql://") and "+psycopg" not in db_url and "+psycopg2" not in db_url and "+pg8000" not in db_url:
-        db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+
+app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(os.getenv('DATABASE_URL'))
+# Réplicas en lecture (DATABASE_REPLICA_URLS="url1,url2"): binds replica_0, replica_1... (voir services/replicas.py)
+app.config['SQLALCHEMY_BINDS'] = {
+    f'replica_{i}': normalize_database_url(url) for i, url in enumerate(replicas.replica_urls())
+}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Cookies de session cross-site (nécessaire si front et back sont sur des domaines différents)
@@ -42,12 +42,9 @@ app.config['SESSION_COOKIE_SAMESITE'] = 'None'
 app.config['SESSION_COOKIE_SECURE'] = True
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 
-# Options moteur SQLAlchemy: SSL requis + pré-ping pour éviter timeouts Render
-if app.config['SQLALCHEMY_DATABASE_URI'] and app.config['SQLALCHEMY_DATABASE_URI'].startswith("postgresql"):
-    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-        "pool_pre_ping": True,  # évite les timeouts Render / connexions dormantes
-        "connect_args": {"sslmode": "require"}  # sécurise la connexion PostgreSQL
-    }
+# Options moteur SQLAlchemy (Postgres): SSL requis, pool dimensionné d'après le modèle de workers,
+# recyclage périodique plutôt qu'un ping à chaque emprunt, mode PgBouncer (voir services/db_pool.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_pool.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 
 # CORS précis pour origines autorisées (credentials cross-site)
 # Exemple d'ENV: FRONTEND_ORIGINS="https://nonotalk-frontend.onrender.com,http://localhost:5173"
@@ -64,11 +61,31 @@ app.register_blueprint(chat_bp, url_prefix='/api/chat')
 app.register_blueprint(tts_bp, url_prefix='/api')
 app.register_blueprint(static_bp, url_prefix='/api')
 app.register_blueprint(invite_bp, url_prefix='/api')
+app.register_blueprint(metrics_bp, url_prefix='/api')
+app.register_blueprint(crisis_bp, url_prefix='/api/crisis')
 
 # Initialisation de la base de données
+# Le schéma n'est plus créé à l'import (une fois par worker): `python init_db.py` au déploiement,
+# ou automatiquement avec `python src/main.py` en développement
 db.init_app(app)
 with app.app_context():
-    db.create_all()
+    for engine in db.engines.values():
+        startup.dispose_pool_after_fork(engine)
+# Lectures des routes @read_replica vers un réplica à jour, sauf juste après une écriture de l'utilisateur
+replicas.init_app(app, db)
+# Moteur de recherche plein texte de chaque base, déterminé ici plutôt que dans une requête à budget
+search.init_app(app, db)
+
+# Logs JSON non bloquants (file + thread d'écriture), X-Request-ID par requête (voir services/logs.py)
+logs.init_app(app)
+# Métriques: latence par route, requêtes en cours (voir /api/metrics)
+metrics.init_app(app)
+# Pool de connexions par moteur: attente, débordement, invalidations
+db_pool.init_app(app, db)
+# Requêtes SQL par requête HTTP: Server-Timing, requêtes lentes, budgets / N+1
+query_stats.init_app(app, db)
+# Profilage échantillonné à la demande (en-tête X-Profile ou PROFILE_SAMPLE_RATE)
+profiler.init_app(app)
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -91,6 +108,24 @@ def health_check():
     """Point de santé de l'API"""
     return {'status': 'ok', 'message': 'NonoTalk API is running'}, 200
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Prêt à recevoir du trafic: base joignable et worker pas en cours d'arrêt (/api/health reste statique)"""
+    if startup.draining():
+        return {'status': 'draining', 'active_generations': len(active_generations())}, 503
+    try:
+        db.session.execute(text('SELECT 1'))
+    except Exception as e:
+        db.session.rollback()
+        return {'status': 'unavailable', 'error': type(e).__name__}, 503
+    return {'status': 'ready', 'active_generations': len(active_generations())}, 200
+
+# gunicorn --preload: tout importer dans le maître et geler le tas avant le fork des workers
+if startup.preload_enabled():
+    startup.prepare_preload()
+
 if __name__ == '__main__':
+    with app.app_context():
+        ensure_schema()
     # threaded=True pour éviter tout blocage et améliorer le flush SSE en dev
     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
@@ -0,0 +1,30 @@
+"""
+Session SQLAlchemy qui route les lectures des routes `@read_replica` vers un
+réplica (voir src/services/replicas.py). Les écritures restent sur le primaire.
+"""
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+from src.services import replicas
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase):
+            engine = replicas.read_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    replicas.note_write()
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _after_bulk_write(orm_execute_state):
+    # UPDATE / DELETE ensemblistes (session.execute(update(...))): pas de flush, mais une écriture
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        replicas.note_write()
@@ -0,0 +1,131 @@
+"""
+Création et mise à niveau légère du schéma.
+
+`db.create_all()` crée les tables manquantes mais n'ajoute jamais de colonne
+ni d'index à une table existante. `ensure_schema()` complète avec des ALTER
+TABLE ADD COLUMN pour les colonnes nouvelles (nullable ou avec une valeur par
+défaut), crée les index déclarés manquants et, sur Postgres, aligne l'action
+ON DELETE des clés étrangères, ce qui suffit aux évolutions additives sans
+outil de migration. Les structures propres à un dialecte
+(recherche plein texte) sont créées par les services concernés.
+"""
+from sqlalchemy import inspect, text
+
+from src.models.user import db
+
+
+def _column_default_sql(column, dialect):
+    default = column.default
+    if default is None or not default.is_scalar:
+        return None
+    value = default.arg
+    if isinstance(value, bool):
+        if dialect.name == 'postgresql':
+            return 'TRUE' if value else 'FALSE'
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def add_missing_columns():
+    """Ajouter les colonnes déclarées dans les modèles mais absentes en base; retourne leur liste."""
+    engine = db.engine
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(engine.dialect)}'
+                default_sql = _column_default_sql(column, engine.dialect)
+                if default_sql is not None:
+                    ddl += f' DEFAULT {default_sql}'
+                conn.execute(text(ddl))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def add_missing_indexes():
+    """Créer les index déclarés dans les modèles mais absents en base; retourne leur liste."""
+    engine = db.engine
+    inspector = inspect(engine)
+    created = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name and index.name not in existing:
+                    index.create(conn)
+                    created.append(index.name)
+    return created
+
+
+def sync_foreign_key_actions():
+    """Postgres: aligner ON DELETE des clés étrangères existantes sur les modèles; retourne la liste modifiée.
+
+    DROP + ADD ... NOT VALID sont validés ensemble (verrou exclusif bref, sans parcourir la table), puis
+    chaque VALIDATE CONSTRAINT tourne dans sa propre transaction: il ne prend qu'un verrou SHARE UPDATE
+    EXCLUSIVE, les écritures continuent pendant le contrôle des lignes existantes.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return []
+    inspector = inspect(engine)
+    changed = []
+    to_validate = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {
+                tuple(fk['constrained_columns']): fk for fk in inspector.get_foreign_keys(table.name)
+            }
+            for constraint in table.foreign_key_constraints:
+                wanted = (constraint.ondelete or '').upper() or None
+                columns = tuple(constraint.column_keys)
+                current = existing.get(columns)
+                if current is None:
+                    continue
+                if ((current['options'].get('ondelete') or '').upper() or None) == wanted:
+                    continue
+                name = current['name']
+                referred = constraint.referred_table.name
+                referred_columns = ', '.join(f'"{e.column.name}"' for e in constraint.elements)
+                local_columns = ', '.join(f'"{c}"' for c in columns)
+                on_delete = f' ON DELETE {wanted}' if wanted else ''
+                conn.execute(text(f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{name}"'))
+                conn.execute(text(
+                    f'ALTER TABLE "{table.name}" ADD CONSTRAINT "{name}" FOREIGN KEY ({local_columns}) '
+                    f'REFERENCES "{referred}" ({referred_columns}){on_delete} NOT VALID'
+                ))
+                to_validate.append((table.name, name))
+                changed.append(f'{table.name}.{name}')
+    for table_name, name in to_validate:
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE "{table_name}" VALIDATE CONSTRAINT "{name}"'))
+    return changed
+
+
+def ensure_schema():
+    """create_all + colonnes et index additifs manquants + ON DELETE des clés étrangères + recherche plein texte."""
+    from src.services.search import ensure_search_index
+
+    db.create_all()
+    added = add_missing_columns()
+    if added:
+        print(f"[backend] Colonnes ajoutées: {', '.join(added)}")
+    indexes = add_missing_indexes()
+    if indexes:
+        print(f"[backend] Index créés: {', '.join(indexes)}")
+    foreign_keys = sync_foreign_key_actions()
+    if foreign_keys:
+        print(f"[backend] Clés étrangères mises à jour: {', '.join(foreign_keys)}")
+    ensure_search_index(db.engine)
+    return added
@@ -1,10 +1,33 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from werkzeug.security import generate_password_hash, check_password_hash
+from src.models.routing import RoutingSession
 
-db = SQLAlchemy()
+# Session qui sait router les lectures vers un réplica (routes @read_replica)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite n'applique les clés étrangères (et leurs ON DELETE CASCADE) que si la connexion les active;
+    # ici pour tous les moteurs: application, réplicas et scripts (init_db.py, archive_messages.py...)
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 class User(db.Model):
+    # Listing d'administration: tri keyset (colonne, id) et filtres (voir routes/user.py)
+    __table_args__ = (
+        db.Index('ix_user_created_at', 'created_at', 'id'),
+        db.Index('ix_user_last_login', 'last_login', 'id'),
+        db.Index('ix_user_quota_remaining', 'quota_remaining'),
+        db.Index('ix_user_filleuls_count', 'filleuls_count'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=True)
@@ -15,10 +38,15 @@ class User(db.Model):
     filleuls_count = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime, default=datetime.utcnow)
+    # Suppression demandée: compte inutilisable, données effacées par lots (voir services/deletion.py)
+    deleted_at = db.Column(db.DateTime, nullable=True)
 
-    # Relations
-    conversations = db.relationship('Conversation', backref='user', lazy=True, cascade='all, delete-orphan')
-    crisis_alerts = db.relationship('CrisisAlert', backref='user', lazy=True, cascade='all, delete-orphan')
+    # Relations (passive_deletes: la base supprime les lignes liées via ON DELETE CASCADE,
+    # l'ORM ne les charge pas pour les effacer une à une)
+    conversations = db.relationship('Conversation', backref='user', lazy=True, cascade='all, delete-orphan',
+                                    passive_deletes=True)
+    crisis_alerts = db.relationship('CrisisAlert', backref='user', lazy=True, cascade='all, delete-orphan',
+                                    passive_deletes=True)
 
     def set_pin(self, pin):
         """Hash and set the PIN"""
@@ -56,37 +84,53 @@ class User(db.Model):
         }
 
 class Conversation(db.Model):
+    # Liste des conversations d'un utilisateur, et portée de la recherche
+    __table_args__ = (db.Index('ix_conversation_user_updated', 'user_id', 'updated_at'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     title = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Messages déplacés en stockage froid (voir services/archive.py), restaurés à la réouverture
+    archived_at = db.Column(db.DateTime, nullable=True)
+    # Suppression demandée: masquée des listes et fermée aux envois pendant l'effacement par lots
+    deleted_at = db.Column(db.DateTime, nullable=True)
 
     # Relations
-    messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
+    messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan',
+                               passive_deletes=True)
 
     def __repr__(self):
         return f'<Conversation {self.id}>'
 
-    def to_dict(self):
+    def to_dict(self, message_count=None):
+        # message_count pré-calculé par l'appelant (évite de charger self.messages, source de N+1)
+        if message_count is None:
+            message_count = Message.query.filter_by(conversation_id=self.id).count()
         return {
             'id': self.id,
             'user_id': self.user_id,
             'title': self.title,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'message_count': len(self.messages)
+            'message_count': message_count
         }
 
 class Message(db.Model):
+    # Historique d'une conversation, dans l'ordre
+    __table_args__ = (db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     is_user = db.Column(db.Boolean, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     emotion_detected = db.Column(db.String(50), nullable=True)
     image_path = db.Column(db.String(255), nullable=True)
     audio_path = db.Column(db.String(255), nullable=True)
+    # Réponse IA interrompue par l'utilisateur ("stop generating")
+    truncated = db.Column(db.Boolean, nullable=False, default=False)
 
     def __repr__(self):
         return f'<Message {self.id}>'
@@ -100,15 +144,58 @@ class Message(db.Model):
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
             'emotion_detected': self.emotion_detected,
             'image_path': self.image_path,
-            'audio_path': self.audio_path
+            'audio_path': self.audio_path,
+            'truncated': bool(self.truncated)
         }
 
+class ArchivedConversation(db.Model):
+    """Messages d'une conversation inactive, compressés hors de la table message."""
+    __tablename__ = 'archived_conversation'
+
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=True)
+    last_timestamp = db.Column(db.DateTime, nullable=True)
+    codec = db.Column(db.String(16), nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivedConversation {self.conversation_id}>'
+
+class DailyEmotionStat(db.Model):
+    """Messages d'un utilisateur pour un jour (UTC) et une émotion ('' = aucune), tenu à jour à l'écriture."""
+    __tablename__ = 'daily_emotion_stat'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    emotion = db.Column(db.String(50), primary_key=True, default='')
+    user_messages = db.Column(db.Integer, nullable=False, default=0)
+    assistant_messages = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DailyEmotionStat {self.user_id}:{self.day}:{self.emotion}>'
+
 class CrisisAlert(db.Model):
+    # Index partiels: seules les alertes non résolues y figurent (file de triage, voir routes/crisis.py)
+    __table_args__ = (
+        db.Index('ix_crisis_alert_unresolved', 'id',
+                 postgresql_where=db.text('resolved = false'), sqlite_where=db.text('resolved = 0')),
+        db.Index('ix_crisis_alert_user_unresolved', 'user_id',
+                 postgresql_where=db.text('resolved = false'), sqlite_where=db.text('resolved = 0')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     message_content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     resolved = db.Column(db.Boolean, default=False)
+    # 'keywords' (mots-clés) ou 'classifier' (voir services/safety.py)
+    source = db.Column(db.String(20), default='keywords')
+    # Triage par les intervenants
+    assigned_to = db.Column(db.String(120), nullable=True)
+    assigned_at = db.Column(db.DateTime, nullable=True)
+    resolved_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f'<CrisisAlert {self.id}>'
@@ -119,19 +206,29 @@ class CrisisAlert(db.Model):
             'user_id': self.user_id,
             'message_content': self.message_content,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'resolved': self.resolved
+            'resolved': self.resolved,
+            'source': self.source,
+            'assigned_to': self.assigned_to,
+            'assigned_at': self.assigned_at.isoformat() if self.assigned_at else None,
+            'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None
         }
 
 class Invitation(db.Model):
+    # Recherche des invitations en attente par email à l'inscription (voir routes/auth.py)
+    __table_args__ = (
+        db.Index('ix_invitation_email_pending', 'email',
+                 postgresql_where=db.text('accepted = false'), sqlite_where=db.text('accepted = 0')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    inviter_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    inviter_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     email = db.Column(db.String(120), nullable=False)
     accepted = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     accepted_at = db.Column(db.DateTime, nullable=True)
 
     # Relation vers le parrain (inviter)
-    inviter = db.relationship('User', backref=db.backref('invitations_sent', lazy=True))
+    inviter = db.relationship('User', backref=db.backref('invitations_sent', lazy=True, passive_deletes=True))
 
     def __repr__(self):
         return f'<Invitation {self.id} -> {self.email}>'
@@ -145,3 +242,63 @@ class Invitation(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'accepted_at': self.accepted_at.isoformat() if self.accepted_at else None
         }
+
+class IdempotencyKey(db.Model):
+    """Clé Idempotency-Key d'un envoi de message: un retry client ne relance jamais le LLM."""
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='uq_idempotency_user_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    key = db.Column(db.String(128), nullable=False)
+    endpoint = db.Column(db.String(32), nullable=False)
+    conversation_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # pending | done
+    generation_id = db.Column(db.String(32), nullable=True)
+    status_code = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.user_id}:{self.key}>'
+
+
+class DeletionJob(db.Model):
+    """Suppression par lots d'un compte ou d'une conversation, avec sa progression."""
+    __tablename__ = 'deletion_job'
+    __table_args__ = (db.Index('ix_deletion_job_target', 'kind', 'target_id'),)
+
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)  # user | conversation
+    target_id = db.Column(db.Integer, nullable=False)
+    # Utilisateur à l'origine de la demande, seul à pouvoir suivre le job (None: administrateur).
+    # Sans clé étrangère: la ligne survit au compte supprimé
+    requested_by = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # pending | running | done | failed
+    total_messages = db.Column(db.Integer, nullable=False, default=0)
+    deleted_messages = db.Column(db.Integer, nullable=False, default=0)
+    deleted_files = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Battement de cœur du thread: un job "running" figé a perdu son worker et peut être repris
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<DeletionJob {self.id} {self.kind}:{self.target_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'target_id': self.target_id,
+            'status': self.status,
+            'total_messages': self.total_messages,
+            'deleted_messages': self.deleted_messages,
+            'deleted_files': self.deleted_files,
+            'progress': round(self.deleted_messages / self.total_messages, 4) if self.total_messages else
+            (1.0 if self.status == 'done' else 0.0),
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, Response, request, jsonify, session, stream_with_context
 from src.models.user import db, User, Invitation
 from datetime import datetime
+from sqlalchemy import false, func, literal, null, or_, select, text, union_all, update
 from sqlalchemy.exc import IntegrityError
+from src.services.replicas import read_replica
+from src.services.export import export_filename, export_records, ndjson_chunks
 import os
 
 auth_bp = Blueprint('auth', __name__)
@@ -19,7 +22,8 @@ def login():
 
 
         user = User.query.filter_by(username=username).first()
-        if not user or not user.check_pin(pin):
+        # Compte en cours de suppression: plus de connexion
+        if not user or user.deleted_at is not None or not user.check_pin(pin):
             return jsonify({'error': 'Identifiants invalides'}), 401
 
         # Mise à jour de la dernière connexion
@@ -38,9 +42,50 @@ def login():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+REFERRAL_BONUS = 5
+
+
+def _find_sponsor(email, parrain_email):
+    """(invitation_id, sponsor_id) en une requête: invitation en attente d'abord, sinon parrain_email; ou None."""
+    by_invitation = (
+        select(literal(0).label('priority'), Invitation.id.label('invitation_id'), User.id.label('sponsor_id'))
+        .join(User, User.id == Invitation.inviter_id)
+        .where(Invitation.email == email.lower(), Invitation.accepted == false(), User.deleted_at.is_(None))
+        .order_by(Invitation.created_at, Invitation.id)
+        .limit(1)
+    )
+    query = by_invitation.subquery().select()
+    if parrain_email:
+        by_email = (
+            select(literal(1).label('priority'), null().label('invitation_id'), User.id.label('sponsor_id'))
+            .where(User.email == parrain_email, User.deleted_at.is_(None))
+        )
+        query = union_all(by_invitation.subquery().select(), by_email).subquery().select()
+    row = db.session.execute(query.order_by(text('priority')).limit(1)).first()
+    return (row.invitation_id, row.sponsor_id) if row else None
+
+
+def _conflict_error(username, email):
+    """Message d'erreur après violation d'unicité: relu en base, pas déduit du texte de l'exception."""
+    taken = db.session.execute(
+        select(User.username == username, User.email == email).where(or_(User.username == username, User.email == email))
+    ).all()
+    if any(row[0] for row in taken):
+        return "Ce nom d'utilisateur existe déjà"
+    if any(row[1] for row in taken):
+        return "Cet email est déjà utilisé"
+    return "Erreur d'intégrité des données"
+
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
-    """Inscription d'un nouvel utilisateur"""
+    """Inscription d'un nouvel utilisateur
+
+    Insertion directe: les contraintes d'unicité (username, email) font la vérification, sans
+    SELECT préalable. Le parrain est trouvé en une requête (invitation + parrain joints, sinon
+    parrain_email) et les bonus sont appliqués par des UPDATE atomiques dans la même transaction:
+    une rafale d'inscriptions sur le même parrain ne perd aucun incrément.
+    """
     try:
         data = request.get_json()
         username = data.get('username')
@@ -56,67 +101,62 @@ def register():
             return jsonify({'error': 'Le champ email est obligatoire'}), 400
         email = str(email).strip()
 
-        # Vérifier si l'utilisateur existe déjà
-        if User.query.filter_by(username=username).first():
-            return jsonify({'error': 'Ce nom d\'utilisateur existe déjà'}), 400
-
-        if email and User.query.filter_by(email=email).first():
-            return jsonify({'error': 'Cet email est déjà utilisé'}), 400
+        sponsor = _find_sponsor(email, parrain_email)
+        bonus_quota = REFERRAL_BONUS if sponsor else 0
 
-        # Créer le nouvel utilisateur
+        # Créer le nouvel utilisateur, bonus de filleul compris (10 de base + 5)
         new_user = User(
             username=username,
             email=email,
-            parrain_email=parrain_email
+            parrain_email=parrain_email,
+            quota_remaining=10 + bonus_quota,
+            total_quota=10 + bonus_quota,
+            filleuls_count=0,
         )
         new_user.set_pin(pin)
-
-        # Gestion du parrainage
-        bonus_quota = 0
-        # Priorité à une invitation existante basée sur l'email du nouvel utilisateur
-        invitation = Invitation.query.filter_by(email=email, accepted=False).first()
-        if invitation:
-            parrain = User.query.get(invitation.inviter_id)
-            if parrain:
-                # +5 pour le parrain et le filleul
-                parrain.add_quota(5)
-                parrain.filleuls_count += 1
-                new_user.add_quota(5)  # +5 en plus des 10 de base
-                bonus_quota = 5
-                invitation.accepted = True
-                invitation.accepted_at = datetime.utcnow()
-        elif parrain_email:
-            parrain = User.query.filter_by(email=parrain_email).first()
-            if parrain:
-                # +5 pour le parrain et le filleul
-                parrain.add_quota(5)
-                parrain.filleuls_count += 1
-                new_user.add_quota(5)  # +5 en plus des 10 de base
-                bonus_quota = 5
-
         db.session.add(new_user)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': _conflict_error(username, email)}), 400
+
+        if sponsor:
+            invitation_id, sponsor_id = sponsor
+            if invitation_id is not None:
+                db.session.execute(
+                    update(Invitation.__table__)
+                    .where(Invitation.id == invitation_id, Invitation.accepted == false())
+                    .values(accepted=True, accepted_at=datetime.utcnow())
+                )
+            # +5 pour le parrain: incrément en base, pas de lecture-modification-écriture
+            db.session.execute(
+                update(User.__table__)
+                .where(User.id == sponsor_id)
+                .values(quota_remaining=User.quota_remaining + REFERRAL_BONUS,
+                        total_quota=User.total_quota + REFERRAL_BONUS,
+                        filleuls_count=func.coalesce(User.filleuls_count, 0) + 1)
+            )
+        # Lu avant le commit: pas de rechargement de l'objet expiré
+        user_payload = new_user.to_dict()
         try:
             db.session.commit()
-        except IntegrityError as e:
+        except IntegrityError:
             db.session.rollback()
-            err_msg = str(e).lower()
-            if 'user.username' in err_msg or 'username' in err_msg:
-                return jsonify({'error': "Ce nom d'utilisateur existe déjà"}), 400
-            if 'user.email' in err_msg or 'email' in err_msg:
-                return jsonify({'error': "Cet email est déjà utilisé"}), 400
-            return jsonify({'error': "Erreur d'intégrité des données"}), 400
+            return jsonify({'error': _conflict_error(username, email)}), 400
 
         # Session automatique après inscription
-        session['user_id'] = new_user.id
-        session['username'] = new_user.username
+        session['user_id'] = user_payload['id']
+        session['username'] = username
 
         return jsonify({
             'message': 'Inscription réussie',
-            'user': new_user.to_dict(),
+            'user': user_payload,
             'bonus_quota': bonus_quota
         }), 201
 
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/logout', methods=['POST'])
@@ -126,6 +166,7 @@ def logout():
     return jsonify({'message': 'Déconnexion réussie'}), 200
 
 @auth_bp.route('/me', methods=['GET'])
+@read_replica
 def get_current_user():
     """Récupérer les informations de l'utilisateur connecté"""
     user_id = session.get('user_id')
@@ -138,7 +179,35 @@ def get_current_user():
 
     return jsonify({'user': user.to_dict()}), 200
 
+@auth_bp.route('/export', methods=['GET'])
+@read_replica
+def export_data():
+    """Exporter toutes les données de l'utilisateur en NDJSON, en flux (?compress=gzip pour un .ndjson.gz)"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    compress = request.args.get('compress', '').lower()
+    if compress not in ('', 'gzip'):
+        return jsonify({'error': "compress doit valoir 'gzip'"}), 400
+    compress = compress == 'gzip'
+
+    username = db.session.query(User.username).filter_by(id=user_id).scalar()
+    if username is None:
+        return jsonify({'error': 'Utilisateur non trouvé'}), 404
+
+    # Le contexte de requête (session SQL, réplica choisi) reste ouvert pendant tout le flux
+    response = Response(
+        stream_with_context(ndjson_chunks(export_records(user_id), compress=compress)),
+        mimetype='application/gzip' if compress else 'application/x-ndjson',
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(username, compress)}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @auth_bp.route('/check-quota', methods=['GET'])
+@read_replica
 def check_quota():
     """Vérifier le quota restant de l'utilisateur"""
     user_id = session.get('user_id')
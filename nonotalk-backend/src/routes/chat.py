@@ -1,62 +1,98 @@
-from flask import Blueprint, request, jsonify, session, Response, stream_with_context
-from src.models.user import db, User, Conversation, Message, CrisisAlert
+from flask import Blueprint, request, jsonify, session, Response, current_app
+from src.models.user import db, User, ArchivedConversation, Conversation, Message, CrisisAlert, IdempotencyKey
+from src.services.generations import (
+    create_generation, discard_generation, get_generation, new_generation_id, run_generation
+)
+from src.services.idempotency import (
+    claim_key, complete_key, find_key, key_from_request, release_key, stored_payload
+)
+from src.services.sse import coalesced_frames, encode_frame
+from src.services import metrics
+from src.services.query_stats import outside_budget, query_budget
+from src.services.replicas import read_replica, use_primary
+from src.services.archive import restore_conversation
+from src.services.deletion import request_deletion
+from src.services.search import InvalidCursor, search_messages
+from src.services.rollups import trends
+from src.services.safety import EMERGENCY_MESSAGE, SafetyCheck, detect_crisis, record_alert
+from src.services.logs import get_logger
+from src.services.serialization import json_response, not_modified, rows_to_dicts, weak_etag
 from datetime import datetime
+from sqlalchemy import false, func, select
+from sqlalchemy.exc import InvalidRequestError
+import base64
 import os
-import openai
 import re
 import threading
 import time
 
 chat_bp = Blueprint('chat', __name__)
 
-# Configuration OpenAI
-from openai import OpenAI
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'sk-fake-key')
-OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
-client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE)
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-
-# Warmup OpenAI model/connection to reduce first-token latency
-_warmup_started = False
-
-def _warm_openai_once():
-    try:
-        model_name = os.getenv('OPENAI_CHAT_MODEL', 'gpt-4.1-mini')
-        # Minimal prompt to establish TLS and prime model
-        client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "system", "content": "ping"}],
-            max_tokens=1,
-            temperature=0
-        )
-    except Exception as e:
-        print(f"[backend] OpenAI warmup failed: {e}")
-
-def start_openai_warmup():
-    global _warmup_started
-    if _warmup_started:
-        return
-    _warmup_started = True
-    try:
-        t = threading.Thread(target=_warm_openai_once, daemon=True)
-        t.start()
-    except Exception as e:
-        print(f"[backend] Warmup thread start failed: {e}")
-
-# Trigger warmup at import time
-start_openai_warmup()
-
-# Mots-clés de crise
-CRISIS_KEYWORDS = os.getenv('CRISIS_KEYWORDS', 'suicide,envie d\'en finir,je veux mourir,plus envie de vivre').split(',')
-
-def detect_crisis(message_content):
-    """Détecter les mots-clés de crise dans un message"""
-    message_lower = message_content.lower()
-    for keyword in CRISIS_KEYWORDS:
-        if keyword.strip().lower() in message_lower:
-            return True
-    return False
+log = get_logger('chat')
+# Un évènement par envoi: échantillonnable séparément (LOG_SAMPLING=nonotalk.chat.request=0.1)
+request_log = get_logger('chat.request')
+
+SEARCH_MAX_LIMIT = 50
+SEARCH_MAX_QUERY_LENGTH = 200
+TRENDS_MAX_DAYS = 366
+
+# Historique servi colonne par colonne (mêmes clés que to_dict(), sans objets ORM)
+CONVERSATION_COLUMNS = (
+    Conversation.id, Conversation.user_id, Conversation.title, Conversation.created_at, Conversation.updated_at,
+)
+CONVERSATION_KEYS = ('id', 'user_id', 'title', 'created_at', 'updated_at', 'message_count')
+MESSAGE_COLUMNS = (
+    Message.id, Message.conversation_id, Message.content, Message.is_user, Message.timestamp,
+    Message.emotion_detected, Message.image_path, Message.audio_path, Message.truncated,
+)
+MESSAGE_KEYS = (
+    'id', 'conversation_id', 'content', 'is_user', 'timestamp',
+    'emotion_detected', 'image_path', 'audio_path', 'truncated',
+)
+
+# Configuration OpenAI (client httpx partagé avec tts.py, voir services/openai_pool.py)
+from src.services.openai_pool import (
+    OPENAI_API_KEY, OPENAI_API_BASE, get_http_client, get_openai_client
+)
+
+# LangChain est importé au premier appel de /send (~1 s et plusieurs dizaines de Mo par worker),
+# puis le modèle est réutilisé; recréé après un fork comme le pool httpx
+_llm_lock = threading.Lock()
+_llm_state = {'pid': None, 'llm': None}
+
+
+def _chat_llm():
+    pid = os.getpid()
+    if _llm_state['pid'] == pid:
+        return _llm_state['llm']
+    with _llm_lock:
+        if _llm_state['pid'] != pid:
+            from langchain_openai import ChatOpenAI
+            _llm_state['llm'] = ChatOpenAI(
+                model=os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini'),
+                openai_api_key=OPENAI_API_KEY,
+                base_url=OPENAI_API_BASE,
+                http_client=get_http_client(),
+                temperature=0.7,
+                max_tokens=150,
+            )
+            _llm_state['pid'] = pid
+    return _llm_state['llm']
+
+# Réponses en streaming
+STREAM_MAX_TOKENS = 180
+# Quota d'une réponse arrêtée par l'utilisateur: 'always' | 'partial' (si du texte a été produit) | 'never'
+CANCEL_QUOTA_POLICY = os.getenv('CANCEL_QUOTA_POLICY', 'partial').strip().lower()
+CANCEL_WAIT_SECONDS = 5
+# Attente max d'un retry /send pendant que l'envoi d'origine est encore en cours dans ce worker
+IDEMPOTENT_WAIT_SECONDS = 60
+
+def _crisis_payload():
+    return {
+        'crisis_detected': True,
+        'emergency_message': EMERGENCY_MESSAGE,
+        'message': 'Mots-clés de crise détectés'
+    }
 
 def get_gpt_response(message, conversation_history=None, emotion=None):
     """Obtenir une réponse de GPT-4 avec mémoire (LangChain), fallback OpenAI client."""
@@ -104,6 +140,8 @@ Nono garde toujours la mémoire des échanges précédents pour maintenir une co
 
         # 1) Tentative avec LangChain (mémoire par conversation)
         try:
+            from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
             lc_messages = [SystemMessage(content=system_prompt)]
             if conversation_history:
                 # Charger plus d'historique pour une meilleure mémoire (sans rien supprimer en base)
@@ -114,14 +152,10 @@ Nono garde toujours la mémoire des échanges précédents pour maintenir une co
                         lc_messages.append(AIMessage(content=msg.content))
             lc_messages.append(HumanMessage(content=message))
 
-            llm = ChatOpenAI(
-                model=os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini'),
-                openai_api_key=OPENAI_API_KEY,
-                base_url=OPENAI_API_BASE,
-                temperature=0.7,
-                max_tokens=150,
-            )
-            result = llm.invoke(lc_messages)
+            llm = _chat_llm()
+            with metrics.UPSTREAM_GENERATION_SECONDS.labels('send', 'done').time():
+                result = llm.invoke(lc_messages)
+            metrics.record_usage('send', (getattr(result, 'response_metadata', None) or {}).get('token_usage'))
             return (result.content or "").strip()
         except Exception:
             # 2) Fallback vers le client OpenAI natif si LangChain n'est pas dispo
@@ -132,29 +166,51 @@ Nono garde toujours la mémoire des échanges précédents pour maintenir une co
                     messages.append({"role": role, "content": msg.content})
             messages.append({"role": "user", "content": message})
 
-            response = client.chat.completions.create(
-                model=os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini'),
-                messages=messages,
-                max_tokens=150,
-                temperature=0.7
-            )
+            with metrics.UPSTREAM_GENERATION_SECONDS.labels('send', 'done').time():
+                response = get_openai_client().chat.completions.create(
+                    model=os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini'),
+                    messages=messages,
+                    max_tokens=150,
+                    temperature=0.7
+                )
+            metrics.record_usage('send', response.usage)
             return response.choices[0].message.content.strip()
 
     except Exception as e:
         return f"Désolé, je rencontre un problème technique. Peux-tu réessayer ? (Erreur: {str(e)})"
 
 @chat_bp.route('/conversations', methods=['GET'])
+@query_budget(2)
+@read_replica
 def get_conversations():
-    """Récupérer toutes les conversations de l'utilisateur"""
+    """Récupérer toutes les conversations de l'utilisateur (304 si rien n'a changé depuis l'ETag du client)"""
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({'error': 'Non connecté'}), 401
 
-    conversations = Conversation.query.filter_by(user_id=user_id).order_by(Conversation.updated_at.desc()).all()
-    
-    return jsonify({
-        'conversations': [conv.to_dict() for conv in conversations]
-    }), 200
+    # Validateur lu sur l'index (user_id, updated_at): tout nouveau message met à jour updated_at
+    count, last_update, last_id = db.session.execute(
+        select(func.count(Conversation.id), func.max(Conversation.updated_at), func.max(Conversation.id))
+        .where(Conversation.user_id == user_id, Conversation.deleted_at.is_(None))
+    ).one()
+    etag = weak_etag('conversations', user_id, count, last_update, last_id)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    # Colonnes seulement; nombre de messages par sous-requête corrélée (index conversation_id),
+    # plus ceux d'une conversation archivée
+    message_count = select(func.count(Message.id)).where(
+        Message.conversation_id == Conversation.id
+    ).correlate(Conversation).scalar_subquery()
+    rows = db.session.execute(
+        select(*CONVERSATION_COLUMNS, message_count + func.coalesce(ArchivedConversation.message_count, 0))
+        .outerjoin(ArchivedConversation, ArchivedConversation.conversation_id == Conversation.id)
+        .where(Conversation.user_id == user_id, Conversation.deleted_at.is_(None))
+        .order_by(Conversation.updated_at.desc())
+    ).all()
+
+    return json_response({'conversations': rows_to_dicts(CONVERSATION_KEYS, rows)}, etag=etag)
 
 @chat_bp.route('/conversations', methods=['POST'])
 def create_conversation():
@@ -179,40 +235,127 @@ def create_conversation():
         'conversation': conversation.to_dict()
     }), 201
 
+@chat_bp.route('/conversations/<int:conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    """Supprimer une conversation: 202 tout de suite, messages et fichiers effacés par lots en arrière-plan"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    # Conversation déjà en cours de suppression comprise: la demande renvoie le job existant
+    owned = db.session.query(Conversation.id).filter_by(id=conversation_id, user_id=user_id).first()
+    if not owned:
+        return jsonify({'error': 'Conversation non trouvée'}), 404
+
+    job = request_deletion(current_app._get_current_object(), 'conversation', conversation_id, requested_by=user_id)
+    return jsonify({'job': job.to_dict()}), 202, {'Location': f'/api/deletions/{job.id}'}
+
 @chat_bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
+@query_budget(2)
+@read_replica
 def get_messages(conversation_id):
-    """Récupérer les messages d'une conversation (supporte ?limit=10 pour les N derniers)."""
+    """Récupérer les messages d'une conversation (supporte ?limit=10 pour les N derniers; 304 si inchangés)."""
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({'error': 'Non connecté'}), 401
 
-    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
-    if not conversation:
+    # Propriété de la conversation + validateur (updated_at, dernier message) en une requête
+    last_message_id = select(Message.id).where(
+        Message.conversation_id == Conversation.id
+    ).order_by(Message.timestamp.desc(), Message.id.desc()).limit(1).correlate(Conversation).scalar_subquery()
+    validator_query = select(Conversation.updated_at, last_message_id, Conversation.archived_at).where(
+        Conversation.id == conversation_id, Conversation.user_id == user_id, Conversation.deleted_at.is_(None)
+    )
+    validator = db.session.execute(validator_query).first()
+    if validator is None:
         return jsonify({'error': 'Conversation non trouvée'}), 404
+    if validator.archived_at is not None:
+        # Conversation en stockage froid: restaurée à la première ouverture (hors budget, une fois)
+        with outside_budget():
+            _restore_archived(conversation_id)
+            validator = db.session.execute(validator_query).first()
 
     limit = request.args.get('limit', type=int)
-    base_query = Message.query.filter_by(conversation_id=conversation_id)
+    etag = weak_etag('messages', conversation_id, validator[0], validator[1], limit)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
 
+    base_query = select(*MESSAGE_COLUMNS).where(Message.conversation_id == conversation_id)
     if limit:
         # Prendre les N plus récents puis remettre en ordre chronologique
-        recent = base_query.order_by(Message.timestamp.desc()).limit(limit).all()
-        messages = list(reversed(recent))
+        recent = db.session.execute(base_query.order_by(Message.timestamp.desc()).limit(limit)).all()
+        rows = list(reversed(recent))
     else:
-        messages = base_query.order_by(Message.timestamp.asc()).all()
+        rows = db.session.execute(base_query.order_by(Message.timestamp.asc())).all()
 
-    return jsonify({
-        'messages': [msg.to_dict() for msg in messages]
-    }), 200
+    return json_response({'messages': rows_to_dicts(MESSAGE_KEYS, rows)}, etag=etag)
+
+def _restore_archived(conversation_id):
+    """Ramener les messages archivés dans la table chaude; la suite de la requête lit le primaire.
+
+    Travail ponctuel exclu du budget de requêtes de la route appelante.
+    """
+    with outside_budget():
+        restored = restore_conversation(conversation_id)
+        db.session.commit()
+    use_primary()
+    if restored:
+        log.info('conversation restaurée', extra={'conversation_id': conversation_id, 'messages': restored})
+
+@chat_bp.route('/search', methods=['GET'])
+@query_budget(1)
+@read_replica
+def search():
+    """Rechercher dans tous les messages de l'utilisateur (?q=...&limit=20&cursor=...&order=rank|recent)"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'error': 'Paramètre q requis'}), 400
+    if len(q) > SEARCH_MAX_QUERY_LENGTH:
+        return jsonify({'error': 'Recherche trop longue'}), 400
+    order = request.args.get('order', 'rank')
+    if order not in ('rank', 'recent'):
+        return jsonify({'error': "order doit valoir 'rank' ou 'recent'"}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), SEARCH_MAX_LIMIT))
+
+    try:
+        results, next_cursor = search_messages(user_id, q, limit=limit, cursor=request.args.get('cursor'), order=order)
+    except InvalidCursor:
+        return jsonify({'error': 'Curseur invalide'}), 400
+
+    return jsonify({'results': results, 'next_cursor': next_cursor}), 200
+
+@chat_bp.route('/trends', methods=['GET'])
+@query_budget(1)
+@read_replica
+def get_trends():
+    """Volume de messages et émotions détectées par jour (?days=30), lus dans les agrégats quotidiens"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    days = max(1, min(request.args.get('days', 30, type=int), TRENDS_MAX_DAYS))
+    return jsonify(trends(user_id, days=days)), 200
 
 @chat_bp.route('/conversations/<int:conversation_id>/send', methods=['POST'])
 def send_message(conversation_id):
     """Envoyer un message dans une conversation"""
-    print(f"[backend] send_message called: conv_id={conversation_id}, session_user={session.get('user_id')}")
     user_id = session.get('user_id')
+    request_log.info('send_message', extra={'conversation_id': conversation_id, 'user_id': user_id})
     if not user_id:
-        print("[backend] 401 Non connecté")
         return jsonify({'error': 'Non connecté'}), 401
 
+    # Retry d'un envoi déjà traité (ou en cours): pas de second appel LLM
+    idem_key = key_from_request()
+    if idem_key:
+        idem_record = find_key(user_id, idem_key)
+        if idem_record:
+            return _replay_idempotent(idem_record, 'send', conversation_id)
+
     # Vérifier le quota
     user = User.query.get(user_id)
     if not user or user.quota_remaining <= 0:
@@ -222,9 +365,12 @@ def send_message(conversation_id):
         }), 403
 
     # Vérifier la conversation
-    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id, deleted_at=None).first()
     if not conversation:
         return jsonify({'error': 'Conversation non trouvée'}), 404
+    if conversation.archived_at is not None:
+        # L'historique sert de contexte au modèle: le restaurer avant de répondre
+        _restore_archived(conversation_id)
 
     data = request.get_json()
     message_content = data.get('message', '').strip()
@@ -233,28 +379,29 @@ def send_message(conversation_id):
     if not message_content:
         return jsonify({'error': 'Message vide'}), 400
 
-    # Détecter les mots-clés de crise
-    if detect_crisis(message_content):
-        # Enregistrer l'alerte de crise
-        crisis_alert = CrisisAlert(
-            user_id=user_id,
-            message_content=message_content
-        )
-        db.session.add(crisis_alert)
-        db.session.commit()
+    # Réserver la clé d'idempotence; la génération enregistrée permet aux retries concurrents de l'attendre
+    idem_record = gen = None
+    if idem_key:
+        gen = create_generation(user_id, conversation_id)
+        idem_record, created = claim_key(user_id, idem_key, 'send', conversation_id, gen.id)
+        if not created:
+            discard_generation(gen)
+            return _replay_idempotent(idem_record, 'send', conversation_id)
 
-        # Retourner le message d'urgence
-        emergency_message = """🆘 Je suis là pour t'écouter, mais si tu es en danger, contacte immédiatement :
-📞 112
-☎️ SOS Suicide : 01 45 39 40 00 (gratuit, 24h/24)"""
+    try:
+        # Détecter les mots-clés de crise
+        if detect_crisis(message_content):
+            # Enregistrer l'alerte de crise et retourner le message d'urgence
+            record_alert(user_id, message_content, 'keywords', 'send')
+            payload = _crisis_payload()
+            if idem_record:
+                complete_key(idem_record, 200, payload)
+            db.session.commit()
+            return jsonify(payload), 200
 
-        return jsonify({
-            'crisis_detected': True,
-            'emergency_message': emergency_message,
-            'message': 'Mots-clés de crise détectés'
-        }), 200
+        # Classifieur lancé en parallèle de l'appel au modèle
+        safety = SafetyCheck(message_content)
 
-    try:
         # Sauvegarder le message utilisateur
         user_message = Message(
             conversation_id=conversation_id,
@@ -270,6 +417,16 @@ def send_message(conversation_id):
         # Obtenir la réponse de l'IA
         ai_response = get_gpt_response(message_content, conversation_history, emotion)
 
+        if safety.wait():
+            # Tour signalé: même réponse que les mots-clés, rien d'autre n'est enregistré
+            db.session.rollback()
+            record_alert(user_id, message_content, 'classifier', 'send')
+            payload = _crisis_payload()
+            if idem_record:
+                complete_key(idem_record, 200, payload)
+            db.session.commit()
+            return jsonify(payload), 200
+
         # Sauvegarder la réponse de l'IA
         ai_message = Message(
             conversation_id=conversation_id,
@@ -287,29 +444,47 @@ def send_message(conversation_id):
             # Générer un titre basé sur le premier message
             conversation.title = message_content[:50] + ('...' if len(message_content) > 50 else '')
 
-        db.session.commit()
-
-        return jsonify({
+        db.session.flush()
+        payload = {
             'user_message': user_message.to_dict(),
             'ai_message': ai_message.to_dict(),
             'quota_remaining': user.quota_remaining
-        }), 200
+        }
+        if idem_record:
+            complete_key(idem_record, 200, payload)
+        db.session.commit()
+
+        return jsonify(payload), 200
 
     except Exception as e:
         db.session.rollback()
+        if idem_record:
+            release_key(idem_record.id)
         return jsonify({'error': f'Erreur lors de l\'envoi: {str(e)}'}), 500
+    finally:
+        if gen:
+            gen.finish()
 
 @chat_bp.route('/conversations/<int:conversation_id>/send-stream', methods=['POST'])
 def send_message_stream(conversation_id):
-    """Envoyer un message en mode streaming (SSE-like) pour démarrer la réponse plus tôt côté front."""
-    import json
-    from flask import stream_with_context
+    """Envoyer un message en mode streaming (SSE-like) pour démarrer la réponse plus tôt côté front.
 
-    print(f"[backend] send_message_stream called: conv_id={conversation_id}, session_user={session.get('user_id')}")
+    La génération tourne dans un thread indépendant de la connexion (voir services/generations.py):
+    si le client décroche, la réponse est quand même enregistrée, et il peut la reprendre via
+    GET /generations/<generation_id>/events avec l'en-tête Last-Event-ID.
+    """
     user_id = session.get('user_id')
+    request_log.info('send_message_stream', extra={'conversation_id': conversation_id, 'user_id': user_id})
     if not user_id:
         return jsonify({'error': 'Non connecté'}), 401
 
+    # Retry d'un envoi déjà traité (rejoué) ou en cours (rattaché à la génération)
+    idem_key = key_from_request()
+    if idem_key:
+        idem_record = find_key(user_id, idem_key)
+        if idem_record:
+            return _replay_idempotent(idem_record, 'send-stream', conversation_id)
+
     # Vérifier le quota
     user = User.query.get(user_id)
     if not user or user.quota_remaining <= 0:
@@ -319,9 +494,12 @@ def send_message_stream(conversation_id):
         }), 403
 
     # Vérifier la conversation
-    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id, deleted_at=None).first()
     if not conversation:
         return jsonify({'error': 'Conversation non trouvée'}), 404
+    if conversation.archived_at is not None:
+        # L'historique sert de contexte au modèle: le restaurer avant de répondre
+        _restore_archived(conversation_id)
 
     data = request.get_json()
     message_content = (data.get('message') or '').strip()
@@ -330,16 +508,6 @@ def send_message_stream(conversation_id):
     if not message_content:
         return jsonify({'error': 'Message vide'}), 400
 
-    # Sauvegarder immédiatement le message utilisateur
-    user_message = Message(
-        conversation_id=conversation_id,
-        content=message_content,
-        is_user=True,
-        emotion_detected=emotion
-    )
-    db.session.add(user_message)
-    db.session.flush()  # id dispo sans commit
-
     # Préparer le contexte (DB-level limit pour réduire la latence)
     recent = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp.desc()).limit(8).all()
     conversation_history = list(reversed(recent))
@@ -365,92 +533,347 @@ Tu parles toujours avec douceur, respect et sérieux, en gardant une approche ps
     if emotion:
         system_prompt += f"\n\nÉmotion détectée dans la voix: {emotion}. Adapte ton ton en conséquence."
 
-    def event(data_obj):
-        return f"data: {json.dumps(data_obj, ensure_ascii=False)}\n\n"
+    # Construire l'historique pour OpenAI (données simples: le thread de génération n'a pas cette session)
+    messages = [{"role": "system", "content": system_prompt}]
+    for msg in conversation_history[-8:]:
+        role = "user" if msg.is_user else "assistant"
+        messages.append({"role": role, "content": msg.content})
+    messages.append({"role": "user", "content": message_content})
+
+    generation_id = new_generation_id()
+    idem_record_id = None
+    if idem_key:
+        idem_record, created = claim_key(user_id, idem_key, 'send-stream', conversation_id, generation_id)
+        if not created:
+            return _replay_idempotent(idem_record, 'send-stream', conversation_id)
+        idem_record_id = idem_record.id
+
+    # Jusqu'à la remise au thread de génération, tout échec libère la clé: sinon 409 pour chaque retry jusqu'au TTL
+    gen = None
+    try:
+        # Mots-clés en ligne; sinon classifieur lancé tout de suite, en parallèle du stream (TTFT inchangé)
+        keyword_crisis = detect_crisis(message_content)
+        safety = None if keyword_crisis else SafetyCheck(message_content)
 
-    @stream_with_context
-    def generate():
-        full_text = ""
+        # Sauvegarder immédiatement le message utilisateur (commit: la génération vit hors de cette requête)
+        user_message = Message(
+            conversation_id=conversation_id,
+            content=message_content,
+            is_user=True,
+            emotion_detected=emotion
+        )
+        db.session.add(user_message)
+        # Le message est visible tout de suite: invalider les ETag de l'historique sans attendre la réponse
+        conversation.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        gen = create_generation(user_id, conversation_id, generation_id)
+        gen.publish({"type": "start", "generation_id": gen.id})
+        if keyword_crisis:
+            # Pas d'appel au modèle: message d'urgence immédiat
+            try:
+                _finish_with_emergency(gen, user_id, conversation_id, message_content, user_message.to_dict(),
+                                       idem_record_id, 'keywords')
+            except Exception as e:
+                db.session.rollback()
+                if idem_record_id:
+                    release_key(idem_record_id)
+                gen.publish({"type": "error", "error": str(e)})
+            finally:
+                gen.finish()
+            return _sse_response(gen, 0)
+        run_generation(current_app._get_current_object(), gen, _generate_stream_reply,
+                       user_id, conversation_id, message_content, messages, user_message.to_dict(), idem_record_id,
+                       safety)
+    except Exception as e:
+        db.session.rollback()
+        if idem_record_id:
+            release_key(idem_record_id)
+        if gen:
+            discard_generation(gen)
+        log.exception('échec du démarrage du stream', extra={'conversation_id': conversation_id})
+        return jsonify({'error': f'Erreur lors de l\'envoi: {str(e)}'}), 500
+
+    return _sse_response(gen, 0)
+
+@chat_bp.route('/generations/<generation_id>/events', methods=['GET'])
+def resume_generation_stream(generation_id):
+    """Reprendre un stream interrompu: rejoue les évènements après Last-Event-ID puis suit la génération."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    gen = get_generation(generation_id)
+    if not gen or gen.user_id != user_id:
+        return jsonify({'error': 'Génération non trouvée'}), 404
+
+    last_event_id = _last_event_id()
+    if last_event_id is None:
+        return jsonify({'error': 'Last-Event-ID invalide'}), 400
+
+    return _sse_response(gen, last_event_id)
+
+def _last_event_id():
+    # EventSource renvoie Last-Event-ID en en-tête; ?last_event_id= pour les clients fetch
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _idempotent_conflict():
+    # Traitement en cours ailleurs (ou clé libérée à l'instant): le client réessaiera
+    resp = jsonify({'error': 'Requête déjà en cours de traitement'})
+    resp.status_code = 409
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+def _replay_idempotent(record, endpoint, conversation_id):
+    """Réponse à un retry portant une Idempotency-Key déjà vue: réponse stockée, ou rattachement à la génération."""
+    if record is None:
+        return _idempotent_conflict()
+    if record.endpoint != endpoint or record.conversation_id != conversation_id:
+        return jsonify({'error': 'Idempotency-Key déjà utilisée pour une autre requête'}), 422
+
+    gen = get_generation(record.generation_id) if record.generation_id else None
+    if record.status != 'done' and gen and endpoint == 'send':
+        # Envoi synchrone encore en cours dans ce worker: attendre son résultat
+        gen.wait_finished(IDEMPOTENT_WAIT_SECONDS)
         try:
-            start_ts = time.time()
-            # Construire l'historique pour OpenAI
-            messages = [{"role": "system", "content": system_prompt}]
-            if conversation_history:
-                for msg in conversation_history[-8:]:
-                    role = "user" if msg.is_user else "assistant"
-                    messages.append({"role": role, "content": msg.content})
-            messages.append({"role": "user", "content": message_content})
-
-            # Envoyer un évènement de démarrage (flush immédiat)
-            yield event({"type": "start"})
-            # Padding pour forcer le flush sur certains proxys/clients
-            yield ":" + (" " * 2048) + "\n\n"
-
-            # Démarrer le stream OpenAI
-            model_name = os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini')
-            stream = client.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                max_tokens=180,
-                temperature=0.7,
-                stream=True,
-            )
-            first_piece_sent = False
+            db.session.refresh(record)
+        except InvalidRequestError:
+            # Clé libérée après un échec: le prochain retry relancera l'envoi
+            record.status = 'pending'
+
+    if endpoint == 'send-stream' and gen:
+        # En cours ou récemment terminé: rejouer le tampon exact (reprise via Last-Event-ID)
+        resp = _sse_response(gen, _last_event_id() or 0)
+    elif record.status == 'done' and endpoint == 'send-stream':
+        payload = stored_payload(record)
+        events = [
+            {"type": "start", "generation_id": record.generation_id},
+            {"type": "delta", "content": payload.get('text', '')},
+            payload,
+        ]
+        resp = Response(''.join(encode_frame(evt, seq) for seq, evt in enumerate(events, start=1)),
+                        mimetype='text/event-stream')
+        resp.headers['Cache-Control'] = 'no-cache, no-transform'
+        resp.headers['Content-Type'] = 'text/event-stream; charset=utf-8'
+    elif record.status == 'done':
+        resp = jsonify(stored_payload(record))
+        resp.status_code = record.status_code or 200
+    else:
+        # Traitement en cours dans un autre worker
+        return _idempotent_conflict()
+
+    resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+def _sse_response(gen, last_event_id):
+    # Deltas regroupés par fenêtre + heartbeats (voir services/sse.py)
+    resp = Response(coalesced_frames(gen, last_event_id), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache, no-transform'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.headers['Connection'] = 'keep-alive'
+    resp.headers['Content-Type'] = 'text/event-stream; charset=utf-8'
+    return resp
 
+def _charge_quota_on_cancel(partial_text):
+    """Politique de quota pour une réponse interrompue (CANCEL_QUOTA_POLICY)."""
+    if CANCEL_QUOTA_POLICY == 'always':
+        return True
+    if CANCEL_QUOTA_POLICY == 'never':
+        return False
+    # 'partial': on ne compte l'échange que si une partie de la réponse a été produite
+    return bool(partial_text.strip())
+
+def _touch_conversation(conversation_id, message_content):
+    conversation = Conversation.query.get(conversation_id)
+    conversation.updated_at = datetime.utcnow()
+    if not conversation.title or conversation.title == 'Nouvelle conversation':
+        conversation.title = message_content[:50] + ('...' if len(message_content) > 50 else '')
+
+
+def _finish_with_emergency(gen, user_id, conversation_id, message_content, user_message_dict, idem_record_id,
+                           source):
+    """Remplacer la réponse par le message d'urgence: alerte, réponse enregistrée, pas de quota consommé."""
+    gen.publish({"type": "crisis", "emergency_message": EMERGENCY_MESSAGE})
+    record_alert(user_id, message_content, source, 'send-stream')
+    ai_message = Message(conversation_id=conversation_id, content=EMERGENCY_MESSAGE, is_user=False)
+    db.session.add(ai_message)
+    _touch_conversation(conversation_id, message_content)
+    db.session.flush()
+    gen.result = ai_message.to_dict()
+    done_event = {
+        "type": "done",
+        "text": EMERGENCY_MESSAGE,
+        "truncated": False,
+        "crisis_detected": True,
+        "emergency_message": EMERGENCY_MESSAGE,
+        "user_message": user_message_dict,
+        "ai_message": gen.result,
+        "quota_remaining": User.query.get(user_id).quota_remaining
+    }
+    if idem_record_id:
+        complete_key(IdempotencyKey.query.get(idem_record_id), 200, done_event)
+    db.session.commit()
+    gen.publish(done_event)
+
+
+def _generate_stream_reply(gen, user_id, conversation_id, message_content, messages, user_message_dict,
+                           idem_record_id=None, safety=None):
+    """Corps du thread de génération: stream OpenAI -> tampon, puis enregistrement unique de la réponse.
+
+    `safety` (services/safety.py) classe le tour pendant le stream: s'il le signale, le stream
+    s'arrête et la réponse est remplacée par le message d'urgence.
+    """
+    full_text = ""
+    pieces = 0
+    flagged = False
+    try:
+        start_ts = time.time()
+
+        # Démarrer le stream OpenAI
+        model_name = os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini')
+        stream = get_openai_client().chat.completions.create(
+            model=model_name,
+            messages=messages,
+            max_tokens=STREAM_MAX_TOKENS,
+            temperature=0.7,
+            stream=True,
+            # Dernier chunk avec l'usage (tokens in/out) pour les métriques
+            stream_options={"include_usage": True},
+        )
+        # Exposé pour que cancel() puisse fermer la connexion amont depuis un autre thread
+        gen.upstream = stream
+        first_piece_sent = False
+
+        try:
             for chunk in stream:
+                if gen.cancelled:
+                    break
+                if safety is not None and safety.flagged_now():
+                    flagged = True
+                    break
                 try:
+                    if getattr(chunk, "usage", None):
+                        metrics.record_usage('send-stream', chunk.usage)
                     choice = (chunk.choices or [None])[0]
                     delta = getattr(choice, "delta", None)
                     piece = getattr(delta, "content", None) if delta else None
                     if piece:
                         if not first_piece_sent:
-                            try:
-                                yield event({"type": "first_delta_ms", "ms": int((time.time() - start_ts) * 1000)})
-                            except Exception:
-                                pass
+                            ttft = time.time() - start_ts
+                            metrics.UPSTREAM_TTFT_SECONDS.labels('send-stream').observe(ttft)
+                            gen.publish({"type": "first_delta_ms", "ms": int(ttft * 1000)})
                             first_piece_sent = True
                         full_text += piece
-                        yield event({"type": "delta", "content": piece})
+                        pieces += 1
+                        gen.publish({"type": "delta", "content": piece})
                 except Exception as iter_err:
-                    print("[backend] stream iteration error:", iter_err)
-
-            # Fin du stream -> persister la réponse, MAJ quota
+                    log.warning('erreur de lecture du stream: %s', iter_err)
+        except Exception:
+            # Lecture interrompue par stream.close() lors d'une annulation: attendu
+            if not gen.cancelled:
+                raise
+        finally:
+            stream.close()
+
+        # Verdict attendu avant tout enregistrement (borné par SAFETY_CLASSIFIER_TIMEOUT)
+        if not flagged and safety is not None:
+            flagged = bool(safety.wait())
+        if flagged:
+            metrics.UPSTREAM_GENERATION_SECONDS.labels('send-stream', 'crisis').observe(time.time() - start_ts)
+            _finish_with_emergency(gen, user_id, conversation_id, message_content, user_message_dict,
+                                   idem_record_id, 'classifier')
+            return
+
+        truncated = gen.cancelled
+        metrics.UPSTREAM_GENERATION_SECONDS.labels('send-stream', 'cancelled' if truncated else 'done').observe(
+            time.time() - start_ts
+        )
+        cancel_stats = None
+        if truncated:
+            cancel_stats = {
+                "cancel_latency_ms": int((time.time() - gen.cancel_requested_at) * 1000),
+                # Approximation: un delta de stream ~ un token
+                "tokens_generated": pieces,
+                "tokens_saved": max(0, STREAM_MAX_TOKENS - pieces),
+            }
+            gen.cancel_stats = cancel_stats
+            metrics.GENERATION_CANCEL_SECONDS.observe(cancel_stats["cancel_latency_ms"] / 1000)
+            metrics.GENERATION_TOKENS_SAVED.inc(cancel_stats["tokens_saved"])
+            log.info('génération annulée', extra=cancel_stats)
+
+        # Fin du stream -> persister la réponse, MAJ quota (une seule fois, quoi qu'il arrive côté client)
+        ai_message = None
+        if full_text.strip() or not truncated:
             ai_message = Message(
                 conversation_id=conversation_id,
                 content=full_text.strip(),
-                is_user=False
+                is_user=False,
+                truncated=truncated
             )
             db.session.add(ai_message)
 
-            # Utiliser un quota
+        # Utiliser un quota
+        user = User.query.get(user_id)
+        if not truncated or _charge_quota_on_cancel(full_text):
             user.use_quota()
 
-            # MAJ conversation
-            conversation.updated_at = datetime.utcnow()
-            if not conversation.title or conversation.title == 'Nouvelle conversation':
-                conversation.title = message_content[:50] + ('...' if len(message_content) > 50 else '')
+        # MAJ conversation
+        _touch_conversation(conversation_id, message_content)
+
+        db.session.flush()
+        gen.result = ai_message.to_dict() if ai_message else None
+        done_event = {
+            "type": "done",
+            "text": full_text.strip(),
+            "truncated": truncated,
+            "user_message": user_message_dict,
+            "ai_message": gen.result,
+            "quota_remaining": user.quota_remaining
+        }
+        # Même transaction que la réponse: un retry voit soit 'pending', soit la réponse complète
+        if idem_record_id:
+            complete_key(IdempotencyKey.query.get(idem_record_id), 200, done_event)
+        db.session.commit()
 
-            db.session.commit()
+        if truncated:
+            gen.publish({"type": "cancelled", **cancel_stats})
 
-            # Evènement final avec metadata
-            yield event({
-                "type": "done",
-                "text": full_text.strip(),
-                "user_message": user_message.to_dict(),
-                "ai_message": ai_message.to_dict(),
-                "quota_remaining": user.quota_remaining
-            })
+        # Evènement final avec metadata
+        gen.publish(done_event)
 
-        except Exception as e:
-            db.session.rollback()
-            yield event({"type": "error", "error": str(e)})
+    except Exception as e:
+        log.exception('échec de la génération', extra={'conversation_id': conversation_id})
+        db.session.rollback()
+        if idem_record_id:
+            release_key(idem_record_id)
+        gen.publish({"type": "error", "error": str(e)})
 
-    resp = Response(generate(), mimetype='text/event-stream')
-    resp.headers['Cache-Control'] = 'no-cache, no-transform'
-    resp.headers['X-Accel-Buffering'] = 'no'
-    resp.headers['Connection'] = 'keep-alive'
-    resp.headers['Content-Type'] = 'text/event-stream; charset=utf-8'
-    return resp
+@chat_bp.route('/generations/<generation_id>/cancel', methods=['POST'])
+def cancel_generation(generation_id):
+    """Arrêter une réponse en cours ("stop generating"): le texte partiel est enregistré comme tronqué."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    gen = get_generation(generation_id)
+    if not gen or gen.user_id != user_id:
+        return jsonify({'error': 'Génération non trouvée'}), 404
+
+    if not gen.cancel():
+        return jsonify({'error': 'Génération déjà terminée'}), 409
+
+    # Le worker enregistre le partiel très vite une fois le stream fermé
+    gen.wait_finished(CANCEL_WAIT_SECONDS)
+    return jsonify({
+        'message': 'Génération arrêtée',
+        'generation_id': gen.id,
+        'ai_message': gen.result,
+        'stats': gen.cancel_stats
+    }), 200
 
 @chat_bp.route('/conversations/<int:conversation_id>/upload-image', methods=['POST'])
 def upload_image(conversation_id):
@@ -468,7 +891,7 @@ def upload_image(conversation_id):
         }), 403
 
     # Vérifier la conversation
-    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
+    conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id, deleted_at=None).first()
     if not conversation:
         return jsonify({'error': 'Conversation non trouvée'}), 404
 
@@ -480,6 +903,13 @@ def upload_image(conversation_id):
         if image_file.filename == '':
             return jsonify({'error': 'Aucune image sélectionnée'}), 400
 
+        # Classifieur lancé sur l'image pendant l'enregistrement du tour
+        image_bytes = image_file.read()
+        image_file.stream.seek(0)
+        safety = SafetyCheck(image_url=f"data:{image_file.mimetype or 'image/jpeg'};base64,"
+                                       f"{base64.b64encode(image_bytes).decode('ascii')}")
+        del image_bytes
+
         # Sauvegarder l'image temporairement
         upload_dir = os.path.join(os.path.dirname(__file__), '..', 'static', 'uploads')
         os.makedirs(upload_dir, exist_ok=True)
@@ -510,6 +940,12 @@ Ta réponse doit être brève (2 à 3 phrases) et empreinte d’humanité.
         # Pour le moment, réponse générique (à remplacer par GPT Vision)
         ai_response = "Merci pour cette image. Elle semble refléter un état intérieur particulier. Qu’est-ce qui t’a poussé à la choisir ou à la partager aujourd’hui ?"
 
+        crisis = bool(safety.wait())
+        if crisis:
+            # Image signalée: message d'urgence à la place de la réponse, pas de quota consommé
+            ai_response = EMERGENCY_MESSAGE
+            record_alert(user_id, f"[Image partagée] uploads/{filename}", 'classifier', 'upload-image')
+
         # Sauvegarder la réponse de l'IA
         ai_message = Message(
             conversation_id=conversation_id,
@@ -519,18 +955,22 @@ Ta réponse doit être brève (2 à 3 phrases) et empreinte d’humanité.
         db.session.add(ai_message)
 
         # Utiliser un quota
-        user.use_quota()
+        if not crisis:
+            user.use_quota()
 
         # Mettre à jour la conversation
         conversation.updated_at = datetime.utcnow()
 
         db.session.commit()
 
-        return jsonify({
+        payload = {
             'image_message': image_message.to_dict(),
             'ai_message': ai_message.to_dict(),
             'quota_remaining': user.quota_remaining
-        }), 200
+        }
+        if crisis:
+            payload.update(crisis_detected=True, emergency_message=EMERGENCY_MESSAGE)
+        return jsonify(payload), 200
 
     except Exception as e:
         db.session.rollback()
@@ -544,7 +984,9 @@ def acknowledge_crisis():
         return jsonify({'error': 'Non connecté'}), 401
 
     # Marquer les alertes de crise comme résolues
-    CrisisAlert.query.filter_by(user_id=user_id, resolved=False).update({'resolved': True})
+    CrisisAlert.query.filter(CrisisAlert.user_id == user_id, CrisisAlert.resolved == false()).update(
+        {'resolved': True, 'resolved_at': datetime.utcnow()}, synchronize_session=False
+    )
     db.session.commit()
 
     return jsonify({'message': 'Crise acknowledgée'}), 200
@@ -0,0 +1,196 @@
+"""
+File de triage des alertes de crise, pour les intervenants (jeton ADMIN_TOKEN).
+
+- GET  /api/crisis/alerts          alertes non résolues, curseur keyset sur l'id;
+                                   ?wait=N: long-poll, répond dès qu'une alerte arrive
+- GET  /api/crisis/alerts/stream   même flux en SSE (Last-Event-ID = dernier id reçu)
+- POST /api/crisis/alerts/resolve  résolution en masse (ids ou user_id), un seul UPDATE
+- POST /api/crisis/alerts/assign   attribution en masse, un seul UPDATE
+
+Les lectures passent par l'index partiel des alertes non résolues; l'attente
+est partagée par tous les clients du worker (services/crisis_feed.py).
+"""
+import base64
+import json
+import os
+import time
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy import false, select, update
+
+from src.models.user import db, CrisisAlert, User
+from src.services.admin import admin_required
+from src.services.crisis_feed import get_feed
+from src.services.serialization import dumps, json_response, rows_to_dicts
+from src.services.sse import HEARTBEAT_FRAME, OPEN_FRAME
+
+crisis_bp = Blueprint('crisis', __name__)
+
+CRISIS_FEED_DEFAULT_LIMIT = 100
+CRISIS_FEED_MAX_LIMIT = 500
+CRISIS_LONGPOLL_MAX_SECONDS = float(os.getenv('CRISIS_LONGPOLL_MAX_SECONDS', '25'))
+CRISIS_STREAM_HEARTBEAT_SECONDS = float(os.getenv('CRISIS_STREAM_HEARTBEAT_SECONDS', '15'))
+CRISIS_BULK_MAX_IDS = 1000
+
+ALERT_COLUMNS = (
+    CrisisAlert.id, CrisisAlert.user_id, User.username, User.email, CrisisAlert.message_content,
+    CrisisAlert.timestamp, CrisisAlert.source, CrisisAlert.assigned_to, CrisisAlert.assigned_at,
+)
+ALERT_KEYS = (
+    'id', 'user_id', 'username', 'email', 'message_content', 'timestamp', 'source', 'assigned_to', 'assigned_at',
+)
+
+
+def _encode_cursor(alert_id):
+    return base64.urlsafe_b64encode(json.dumps([alert_id]).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        (alert_id,) = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return int(alert_id)
+    except (TypeError, ValueError):
+        raise ValueError(cursor)
+
+
+def _unresolved_after(after_id, limit, assigned_to=None, unassigned=False):
+    query = (
+        select(*ALERT_COLUMNS)
+        .join(User, User.id == CrisisAlert.user_id)
+        .where(CrisisAlert.resolved == false(), CrisisAlert.id > after_id)
+        .order_by(CrisisAlert.id)
+        .limit(limit)
+    )
+    if assigned_to:
+        query = query.where(CrisisAlert.assigned_to == assigned_to)
+    elif unassigned:
+        query = query.where(CrisisAlert.assigned_to.is_(None))
+    try:
+        return rows_to_dicts(ALERT_KEYS, db.session.execute(query))
+    finally:
+        # Connexion rendue au pool avant toute attente
+        db.session.close()
+
+
+@crisis_bp.route('/alerts', methods=['GET'])
+@admin_required
+def list_alerts():
+    """Alertes non résolues d'id > curseur, dans l'ordre d'arrivée.
+
+    ?cursor=...&limit=100&assigned_to=<intervenant>|unassigned=1
+    ?wait=20: si rien n'est disponible, attendre jusqu'à 20 s (CRISIS_LONGPOLL_MAX_SECONDS) qu'une alerte arrive.
+    next_cursor est toujours renvoyé: le client le repasse tel quel à l'appel suivant.
+    """
+    try:
+        after_id = _decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Curseur invalide'}), 400
+    limit = max(1, min(request.args.get('limit', CRISIS_FEED_DEFAULT_LIMIT, type=int), CRISIS_FEED_MAX_LIMIT))
+    wait = max(0.0, min(request.args.get('wait', 0, type=float), CRISIS_LONGPOLL_MAX_SECONDS))
+    filters = {'assigned_to': request.args.get('assigned_to'), 'unassigned': request.args.get('unassigned') == '1'}
+
+    alerts = _unresolved_after(after_id, limit, **filters)
+    if not alerts and wait:
+        feed = get_feed(current_app._get_current_object())
+        deadline = time.monotonic() + wait
+        seen = after_id
+        # Réveil dès qu'une alerte plus récente existe; si elle ne passe pas les filtres, on attend la suivante
+        while not alerts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not feed.wait_for_new(seen, remaining):
+                break
+            seen = feed.latest_id
+            alerts = _unresolved_after(after_id, limit, **filters)
+    next_cursor = _encode_cursor(alerts[-1]['id'] if alerts else after_id)
+    return json_response({'alerts': alerts, 'next_cursor': next_cursor})
+
+
+@crisis_bp.route('/alerts/stream', methods=['GET'])
+@admin_required
+def stream_alerts():
+    """Flux SSE des alertes non résolues; reprise après coupure avec Last-Event-ID (ou ?last_event_id=)."""
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        after_id = int(value)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Last-Event-ID invalide'}), 400
+    feed = get_feed(current_app._get_current_object())
+
+    def frames():
+        cursor = after_id
+        yield OPEN_FRAME
+        while True:
+            # Relevé avant la requête: une alerte notifiée pendant la requête réveille l'attente qui suit
+            seen = feed.latest_id
+            alerts = _unresolved_after(cursor, CRISIS_FEED_MAX_LIMIT)
+            if alerts:
+                cursor = alerts[-1]['id']
+                # Dates sérialisées comme dans les réponses JSON (dumps), id: pour Last-Event-ID
+                yield ''.join(f"data: {dumps({'type': 'alert', **alert}).decode()}\nid: {alert['id']}\n\n"
+                              for alert in alerts)
+                continue
+            if not feed.wait_for_new(max(cursor, seen), CRISIS_STREAM_HEARTBEAT_SECONDS):
+                yield HEARTBEAT_FRAME
+
+    resp = Response(stream_with_context(frames()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache, no-transform'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    resp.headers['Content-Type'] = 'text/event-stream; charset=utf-8'
+    return resp
+
+
+def _bulk_target(data):
+    """Condition WHERE d'une opération en masse: {"ids": [...]} ou {"user_id": n}; ValueError si invalide."""
+    ids = data.get('ids')
+    user_id = data.get('user_id')
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or len(ids) > CRISIS_BULK_MAX_IDS:
+            raise ValueError(f'ids: liste de 1 à {CRISIS_BULK_MAX_IDS} identifiants attendue')
+        try:
+            return CrisisAlert.id.in_([int(i) for i in ids])
+        except (TypeError, ValueError):
+            raise ValueError('ids: entiers attendus')
+    if isinstance(user_id, int):
+        return CrisisAlert.user_id == user_id
+    raise ValueError('ids ou user_id requis')
+
+
+@crisis_bp.route('/alerts/resolve', methods=['POST'])
+@admin_required
+def resolve_alerts():
+    data = request.get_json(silent=True) or {}
+    try:
+        target = _bulk_target(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    resolved = db.session.execute(
+        update(CrisisAlert.__table__)
+        .where(target, CrisisAlert.resolved == false())
+        .values(resolved=True, resolved_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return jsonify({'resolved': resolved}), 200
+
+
+@crisis_bp.route('/alerts/assign', methods=['POST'])
+@admin_required
+def assign_alerts():
+    data = request.get_json(silent=True) or {}
+    assignee = data.get('assignee')
+    if assignee is not None and (not isinstance(assignee, str) or not assignee.strip() or len(assignee) > 120):
+        return jsonify({'error': 'assignee: nom de 1 à 120 caractères (ou null pour désattribuer)'}), 400
+    try:
+        target = _bulk_target(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    assignee = assignee.strip() if assignee else None
+    assigned = db.session.execute(
+        update(CrisisAlert.__table__)
+        .where(target, CrisisAlert.resolved == false())
+        .values(assigned_to=assignee, assigned_at=datetime.utcnow() if assignee else None)
+    ).rowcount
+    db.session.commit()
+    return jsonify({'assigned': assigned}), 200
@@ -6,9 +6,12 @@ import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr
-import traceback
+import time
+from src.services import metrics
+from src.services.logs import get_logger
 
 invite_bp = Blueprint('invite', __name__)
+log = get_logger('invite')
 
 def build_invitation_html(base_url: str, signup_url: str, inviter_name: str) -> str:
     logo_url = f"{base_url.rstrip('/')}/logonono.png"
@@ -67,6 +70,8 @@ def send_invitation_email(to_email: str, inviter_name: str) -> bool:
         msg.attach(MIMEText(html, 'html', 'utf-8'))
 
         server = None
+        send_start = time.perf_counter()
+        outcome = 'error'
         try:
             # Déterminer le mode sécurisé si non fourni
             secure = smtp_secure
@@ -78,7 +83,8 @@ def send_invitation_email(to_email: str, inviter_name: str) -> bool:
                 else:
                     secure = 'starttls'
 
-            print(f"[invite] SMTP connecting to {smtp_host}:{smtp_port} secure={secure} user={(smtp_user[:3] + '***') if smtp_user else '(none)'} from={smtp_from}")
+            log.info('connexion SMTP', extra={'host': smtp_host, 'port': smtp_port, 'secure': secure,
+                                              'authenticated': bool(smtp_user)})
             if secure == 'ssl':
                 server = smtplib.SMTP_SSL(smtp_host, smtp_port, timeout=20)
             else:
@@ -93,19 +99,20 @@ def send_invitation_email(to_email: str, inviter_name: str) -> bool:
             if smtp_user and smtp_pass:
                 server.login(smtp_user, smtp_pass)
             else:
-                print("[invite] Attention: SMTP_USER ou SMTP_PASSWORD manquant - tentative sans authentification")
+                log.warning('SMTP_USER ou SMTP_PASSWORD manquant: tentative sans authentification')
 
             server.sendmail(smtp_from, [to_email], msg.as_string())
+            outcome = 'ok'
             return True
         finally:
+            metrics.SMTP_SEND_SECONDS.labels(outcome).observe(time.perf_counter() - send_start)
             try:
                 if server:
                     server.quit()
             except Exception:
                 pass
-    except Exception as e:
-        print(f"[invite] Erreur envoi email à {to_email}: {e.__class__.__name__}: {e}")
-        traceback.print_exc()
+    except Exception:
+        log.exception("échec de l'envoi d'une invitation", extra={'to_email': to_email})
         return False
 
 @invite_bp.route('/invite', methods=['POST'])
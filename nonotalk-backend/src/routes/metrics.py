@@ -0,0 +1,19 @@
+from flask import Blueprint, Response, request, jsonify
+import hmac
+import os
+
+from src.services.metrics import render
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Si défini, le scrape doit présenter "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Métriques Prometheus, agrégées sur tous les workers gunicorn (voir services/metrics.py)"""
+    if METRICS_TOKEN:
+        provided = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(provided.encode('utf-8'), METRICS_TOKEN.encode('utf-8')):
+            return jsonify({'error': 'Non autorisé'}), 401
+    return Response(render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -1,6 +1,5 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, current_app, request, jsonify, send_file, session
 import os
-from openai import OpenAI
 from datetime import datetime
 import io
 import tempfile
@@ -8,10 +7,14 @@ import time
 
 tts_bp = Blueprint('tts', __name__)
 
-# Configuration OpenAI
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'sk-fake-key')
-OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
-client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE)
+# Configuration OpenAI (client httpx partagé avec chat.py, voir services/openai_pool.py)
+from src.services.openai_pool import OPENAI_API_KEY, get_openai_client
+from src.services import metrics
+from src.services.logs import get_logger
+from src.models.user import db
+from src.services.safety import EMERGENCY_MESSAGE, SafetyCheck, detect_crisis, record_alert, record_alert_when_flagged
+
+log = get_logger('tts')
 
 @tts_bp.route('/text-to-speech', methods=['POST'])
 def text_to_speech():
@@ -39,6 +42,7 @@ def text_to_speech():
         """
 
         # Simulation - créer un fichier audio factice
+        tts_start = time.perf_counter()
         audio_dir = os.path.join(os.path.dirname(__file__), '..', 'static', 'audio')
         os.makedirs(audio_dir, exist_ok=True)
         
@@ -48,6 +52,7 @@ def text_to_speech():
         # Créer un fichier audio vide pour la simulation
         with open(audio_path, 'wb') as f:
             f.write(b'')  # Fichier vide pour la simulation
+        metrics.TTS_SECONDS.labels('simulated').observe(time.perf_counter() - tts_start)
 
         return jsonify({
             'audio_url': f'/api/audio/{filename}',
@@ -91,26 +96,42 @@ def speech_to_text():
             # Donner un nom de fichier pour compatibilité SDK
             buf.name = audio_file.filename or 'audio.webm'
             if OPENAI_API_KEY and OPENAI_API_KEY != 'sk-fake-key':
+                stt_start = time.perf_counter()
                 try:
                     stt_model = os.getenv('OPENAI_STT_MODEL', 'whisper-1')
-                    resp = client.audio.transcriptions.create(
+                    resp = get_openai_client().audio.transcriptions.create(
                         model=stt_model,
                         file=buf
                     )
                     transcript_text = getattr(resp, 'text', None) or (resp.get('text') if isinstance(resp, dict) else None)
+                    metrics.STT_SECONDS.labels('ok').observe(time.perf_counter() - stt_start)
                 except Exception as stt_err:
-                    print(f"[backend] STT error: {stt_err}")
+                    metrics.STT_SECONDS.labels('error').observe(time.perf_counter() - stt_start)
+                    log.warning('échec STT: %s', stt_err)
                     transcript_text = None
         except Exception as read_err:
-            print(f"[backend] STT read error: {read_err}")
+            log.warning('lecture audio STT impossible: %s', read_err)
             transcript_text = None
 
-        if not transcript_text:
+        payload = {}
+        user_id = session.get('user_id')
+        if transcript_text:
+            # Mots-clés en ligne; classifieur en arrière-plan (la transcription n'attend pas son verdict)
+            if detect_crisis(transcript_text):
+                if user_id:
+                    record_alert(user_id, transcript_text, 'keywords', 'speech-to-text')
+                    db.session.commit()
+                payload = {'crisis_detected': True, 'emergency_message': EMERGENCY_MESSAGE}
+            elif user_id:
+                record_alert_when_flagged(current_app._get_current_object(), SafetyCheck(transcript_text),
+                                          user_id, transcript_text, 'speech-to-text')
+        else:
             transcript_text = "Transcription simulée du message vocal"
 
         return jsonify({
             'transcript': transcript_text,
-            'message': 'Transcription réussie (simulation)'
+            'message': 'Transcription réussie (simulation)',
+            **payload
         }), 200
 
     except Exception as e:
@@ -1,14 +1,167 @@
-from flask import Blueprint, jsonify, request
-from src.models.user import User, db
+import base64
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, jsonify, request, session, stream_with_context
+from sqlalchemy import select, tuple_
+from src.models.user import DeletionJob, User, db
+from src.services.admin import admin_required, is_admin_request
+from src.services.deletion import request_deletion
+from src.services.export import ndjson_chunks
+from src.services.query_stats import query_budget
+from src.services.replicas import read_replica
+from src.services.serialization import json_response
 
 user_bp = Blueprint('user', __name__)
 
+USERS_DEFAULT_LIMIT = 50
+USERS_MAX_LIMIT = 500
+# Projection autorisée (jamais pin_hash)
+USER_FIELDS = {
+    column.key: column for column in (
+        User.id, User.username, User.email, User.quota_remaining, User.total_quota, User.parrain_email,
+        User.filleuls_count, User.created_at, User.last_login, User.deleted_at,
+    )
+}
+USER_DEFAULT_FIELDS = (
+    'id', 'username', 'email', 'quota_remaining', 'total_quota', 'filleuls_count', 'created_at', 'last_login',
+)
+USER_SORTS = {'id': User.id, 'created_at': User.created_at, 'last_login': User.last_login}
+
+
+def _parse_datetime(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name}: date ISO 8601 attendue')
+
+
+def _parse_int(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name}: entier attendu')
+
+
+def _user_listing_query(args):
+    """(colonnes, conditions, tri, décroissant) d'après les paramètres; ValueError si invalides."""
+    fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip()] or list(USER_DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in USER_FIELDS]
+    if unknown:
+        raise ValueError(f"Champs inconnus: {', '.join(unknown)}")
+    sort = args.get('sort', 'id')
+    if sort not in USER_SORTS:
+        raise ValueError(f"sort doit valoir {', '.join(USER_SORTS)}")
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError("order doit valoir 'asc' ou 'desc'")
+
+    conditions = []
+    if args.get('include_deleted') not in ('1', 'true'):
+        conditions.append(User.deleted_at.is_(None))
+    for name, column, operator in (('created_after', User.created_at, '>='),
+                                   ('created_before', User.created_at, '<'),
+                                   ('last_login_after', User.last_login, '>='),
+                                   ('last_login_before', User.last_login, '<')):
+        value = _parse_datetime(args, name)
+        if value is not None:
+            conditions.append(column >= value if operator == '>=' else column < value)
+    exhausted = args.get('quota_exhausted')
+    if exhausted in ('1', 'true'):
+        conditions.append(User.quota_remaining <= 0)
+    elif exhausted in ('0', 'false'):
+        conditions.append(User.quota_remaining > 0)
+    min_referrals = _parse_int(args, 'min_referrals')
+    if min_referrals is not None:
+        conditions.append(User.filleuls_count >= min_referrals)
+    max_referrals = _parse_int(args, 'max_referrals')
+    if max_referrals is not None:
+        conditions.append(User.filleuls_count <= max_referrals)
+    return [USER_FIELDS[f] for f in fields], conditions, sort, order == 'desc'
+
+
+def _encode_user_cursor(sort, value, user_id):
+    values = [user_id] if sort == 'id' else [value.isoformat(), user_id]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def _decode_user_cursor(cursor, sort):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if sort == 'id':
+            (user_id,) = values
+            return [int(user_id)]
+        value, user_id = values
+        return [datetime.fromisoformat(value), int(user_id)]
+    except (TypeError, ValueError):
+        raise ValueError(cursor)
+
 @user_bp.route('/users', methods=['GET'])
+@admin_required
+@query_budget(1)
+@read_replica
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    """Lister les comptes (administration): pagination keyset, projection, filtres, ou flux NDJSON.
+
+    ?limit=50&cursor=...&sort=id|created_at|last_login&order=desc|asc&fields=id,username,...
+    Filtres: created_after / created_before / last_login_after / last_login_before (ISO 8601),
+    quota_exhausted=1|0, min_referrals / max_referrals, include_deleted=1.
+    ?format=ndjson: tous les résultats en flux, mémoire constante (ni limit ni cursor).
+    Le tri par last_login exclut les comptes sans dernière connexion.
+    """
+    try:
+        columns, conditions, sort, descending = _user_listing_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sort_column = USER_SORTS[sort]
+    keys = [c.key for c in columns]
+    order_by = (sort_column.desc(), User.id.desc()) if descending else (sort_column.asc(), User.id.asc())
+    query = select(*columns).where(*conditions)
+    if sort != 'id':
+        # Keyset sur (colonne, id): pas de NULL dans la clé de tri
+        query = query.where(sort_column.is_not(None))
+    query = query.order_by(*order_by)
+
+    if request.args.get('format') == 'ndjson':
+        def records():
+            for row in db.session.execute(query, execution_options={'yield_per': 1000}):
+                yield dict(zip(keys, row))
+        response = Response(stream_with_context(ndjson_chunks(records())), mimetype='application/x-ndjson')
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    limit = max(1, min(request.args.get('limit', USERS_DEFAULT_LIMIT, type=int), USERS_MAX_LIMIT))
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = _decode_user_cursor(cursor, sort)
+        except ValueError:
+            return jsonify({'error': 'Curseur invalide'}), 400
+        if sort == 'id':
+            query = query.where(User.id < after[0] if descending else User.id > after[0])
+        else:
+            position = tuple_(sort_column, User.id)
+            query = query.where(position < tuple_(*after) if descending else position > tuple_(*after))
+
+    # Colonnes de tri toujours lues, même si la projection ne les contient pas
+    rows = db.session.execute(query.add_columns(sort_column, User.id).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_user_cursor(sort, last[-2], last[-1])
+    users = [dict(zip(keys, row[:len(keys)])) for row in rows]
+    return json_response({'users': users, 'next_cursor': next_cursor, 'limit': limit})
 
 @user_bp.route('/users', methods=['POST'])
+@admin_required
 def create_user():
     
     data = request.json
@@ -18,11 +171,13 @@ def create_user():
     return jsonify(user.to_dict()), 201
 
 @user_bp.route('/users/<int:user_id>', methods=['GET'])
+@admin_required
 def get_user(user_id):
     user = User.query.get_or_404(user_id)
     return jsonify(user.to_dict())
 
 @user_bp.route('/users/<int:user_id>', methods=['PUT'])
+@admin_required
 def update_user(user_id):
     user = User.query.get_or_404(user_id)
     data = request.json
@@ -33,7 +188,29 @@ def update_user(user_id):
 
 @user_bp.route('/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
-    user = User.query.get_or_404(user_id)
-    db.session.delete(user)
-    db.session.commit()
-    return '', 204
+    """Supprimer un compte (administrateur, ou l'utilisateur connecté pour le sien): 202 tout de suite,
+    données effacées par lots en arrière-plan"""
+    admin = is_admin_request()
+    session_user_id = session.get('user_id')
+    if not admin and not session_user_id:
+        return jsonify({'error': 'Non connecté'}), 401
+    if not admin and session_user_id != user_id:
+        return jsonify({'error': 'Accès refusé'}), 403
+    job = request_deletion(current_app._get_current_object(), 'user', user_id,
+                           requested_by=None if admin else session_user_id)
+    if job is None:
+        return jsonify({'error': 'Utilisateur non trouvé'}), 404
+    return jsonify({'job': job.to_dict()}), 202, {'Location': f'/api/deletions/{job.id}'}
+
+@user_bp.route('/deletions/<job_id>', methods=['GET'])
+def get_deletion(job_id):
+    """Progression d'une suppression (administrateur, ou l'utilisateur qui l'a demandée)"""
+    admin = is_admin_request()
+    session_user_id = session.get('user_id')
+    if not admin and not session_user_id:
+        return jsonify({'error': 'Non connecté'}), 401
+    job = db.session.get(DeletionJob, job_id)
+    # Job d'un autre utilisateur: même réponse qu'un job inexistant
+    if job is None or (not admin and job.requested_by != session_user_id):
+        return jsonify({'error': 'Suppression non trouvée'}), 404
+    return jsonify({'job': job.to_dict()}), 200
@@ -0,0 +1,42 @@
+"""
+Authentification des routes d'administration.
+
+Jeton partagé ADMIN_TOKEN, présenté dans `Authorization: Bearer <jeton>` et
+comparé en temps constant (hmac.compare_digest). Sans ADMIN_TOKEN, les routes
+d'administration sont désactivées (403), jamais ouvertes.
+"""
+import hmac
+import os
+from functools import wraps
+
+from flask import jsonify, request
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+
+def _presented_token():
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return token.strip() or None
+
+
+def is_admin_request():
+    token = _presented_token()
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(
+        token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')
+    )
+
+
+def admin_required(view):
+    """Réserver une route aux porteurs du jeton d'administration."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': "Administration désactivée (ADMIN_TOKEN non défini)"}), 403
+        if not is_admin_request():
+            return jsonify({'error': 'Jeton administrateur requis'}), 401, {'WWW-Authenticate': 'Bearer'}
+        return view(*args, **kwargs)
+    wrapper.admin_required = True
+    return wrapper
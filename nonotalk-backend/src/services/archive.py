@@ -0,0 +1,256 @@
+"""
+Archivage chaud / froid des messages.
+
+Une conversation sans activité depuis ARCHIVE_IDLE_DAYS jours voit ses
+messages quitter la table `message` pour une seule ligne compressée de
+`archived_conversation`: colonnes et lignes en JSON, compressées avec zlib
+(ARCHIVE_COMPRESSION_LEVEL). La table chaude, ses index (historique,
+recherche plein texte) et donc le cache de la base ne portent plus que les
+conversations vivantes.
+
+La restauration est paresseuse: get_messages (ou un nouvel envoi) sur une
+conversation archivée réinsère ses messages avec leurs identifiants d'origine.
+La ligne d'archive est réclamée par DELETE ... RETURNING: deux requêtes
+simultanées ne restaurent jamais deux fois. L'archivage ne touche pas aux
+agrégats quotidiens (services/rollups.py), et leur recalcul (`rebuild()`,
+backfill_rollups.py) relit les archives: l'historique des tendances est
+conservé. Les messages archivés ne sont plus trouvés par la recherche tant
+qu'ils ne sont pas restaurés.
+
+Partitionnement Postgres: `partition_ddl()` produit le script de conversion
+de `message` en table partitionnée par mois sur `timestamp`. Il réécrit la
+table et doit être relu puis lancé pendant une maintenance, d'où son
+impression par archive_messages.py plutôt qu'une exécution automatique.
+Une fois la table partitionnée, `ensure_future_partitions()` crée les mois à
+venir (appelé à chaque archivage).
+"""
+import json
+import os
+import zlib
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import DateTime, delete, func, select, text, update
+
+from src.models.user import db, ArchivedConversation, Conversation, Message
+from src.services.search import SEARCH_VECTOR_TRIGGER_SQL
+from src.services.serialization import dumps
+
+ARCHIVE_IDLE_DAYS = int(os.getenv('ARCHIVE_IDLE_DAYS', '180'))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv('ARCHIVE_COMPRESSION_LEVEL', '9'))
+ARCHIVE_PARTITION_MONTHS_AHEAD = int(os.getenv('ARCHIVE_PARTITION_MONTHS_AHEAD', '3'))
+CODEC = 'zlib-json-v1'
+
+MESSAGE_COLUMNS = tuple(Message.__table__.columns)
+_DATETIME_KEYS = {c.key for c in MESSAGE_COLUMNS if isinstance(c.type, DateTime)}
+
+
+def encode_messages(rows):
+    payload = {'columns': [c.key for c in MESSAGE_COLUMNS], 'rows': [list(row) for row in rows]}
+    return zlib.compress(dumps(payload), ARCHIVE_COMPRESSION_LEVEL)
+
+
+def decode_messages(codec, payload):
+    """Lignes de l'archive sous forme de dictionnaires prêts pour un INSERT."""
+    if codec != CODEC:
+        raise ValueError(f'codec d\'archive inconnu: {codec}')
+    data = json.loads(zlib.decompress(payload))
+    columns = data['columns']
+    records = []
+    for row in data['rows']:
+        record = dict(zip(columns, row))
+        for key in _DATETIME_KEYS.intersection(record):
+            if record[key] is not None:
+                record[key] = datetime.fromisoformat(record[key])
+        records.append(record)
+    return records
+
+
+def archive_conversation(conversation_id, cutoff):
+    """Archiver une conversation inactive depuis `cutoff`; retourne le nombre de messages déplacés (None si ignorée)."""
+    conversation = Conversation.__table__
+    with db.engine.begin() as conn:
+        # Réserver la conversation (verrou de ligne sur Postgres) seulement si elle est toujours inactive;
+        # updated_at est réécrit à l'identique pour ne pas déclencher son onupdate
+        claimed = conn.execute(
+            update(conversation)
+            .where(conversation.c.id == conversation_id, conversation.c.archived_at.is_(None),
+                   conversation.c.updated_at < cutoff)
+            .values(archived_at=datetime.utcnow(), updated_at=conversation.c.updated_at)
+        ).rowcount
+        if not claimed:
+            return None
+        rows = conn.execute(
+            select(*MESSAGE_COLUMNS).where(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp, Message.id)
+        ).all()
+        if not rows:
+            conn.execute(
+                update(conversation).where(conversation.c.id == conversation_id)
+                .values(archived_at=None, updated_at=conversation.c.updated_at)
+            )
+            return 0
+        conn.execute(ArchivedConversation.__table__.insert().values(
+            conversation_id=conversation_id,
+            message_count=len(rows),
+            first_timestamp=rows[0].timestamp,
+            last_timestamp=rows[-1].timestamp,
+            codec=CODEC,
+            payload=encode_messages(rows),
+            archived_at=datetime.utcnow(),
+        ))
+        # Seulement les messages lus: un message arrivé entre-temps reste dans la table chaude
+        conn.execute(delete(Message.__table__).where(Message.id.in_([row.id for row in rows])))
+    return len(rows)
+
+
+def archive_idle(idle_days=ARCHIVE_IDLE_DAYS, limit=None, dry_run=False):
+    """Archiver les conversations inactives. Retourne (conversations, messages) archivés (ou candidats si dry_run)."""
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    query = select(Conversation.id).where(
+        Conversation.archived_at.is_(None), Conversation.updated_at < cutoff
+    ).order_by(Conversation.updated_at)
+    if limit:
+        query = query.limit(limit)
+    with db.engine.connect() as conn:
+        candidates = conn.execute(query).scalars().all()
+        if dry_run:
+            messages = conn.execute(
+                select(func.count(Message.id)).where(Message.conversation_id.in_(candidates))
+            ).scalar() if candidates else 0
+            return len(candidates), messages
+    conversations = messages = 0
+    for conversation_id in candidates:
+        moved = archive_conversation(conversation_id, cutoff)
+        if moved:
+            conversations += 1
+            messages += moved
+    ensure_future_partitions()
+    return conversations, messages
+
+
+def restore_conversation(conversation_id):
+    """Réintégrer les messages archivés dans la session courante (commit par l'appelant). Retourne leur nombre."""
+    claimed = db.session.execute(
+        delete(ArchivedConversation.__table__)
+        .where(ArchivedConversation.conversation_id == conversation_id)
+        .returning(ArchivedConversation.codec, ArchivedConversation.payload)
+    ).first()
+    conversation = Conversation.__table__
+    db.session.execute(
+        update(conversation).where(conversation.c.id == conversation_id)
+        .values(archived_at=None, updated_at=conversation.c.updated_at)
+    )
+    if claimed is None:
+        # Déjà restaurée par une requête concurrente
+        return 0
+    records = decode_messages(claimed.codec, claimed.payload)
+    if records:
+        db.session.execute(Message.__table__.insert(), records)
+    return len(records)
+
+
+def archive_stats():
+    with db.engine.connect() as conn:
+        archived, messages, size = conn.execute(select(
+            func.count(ArchivedConversation.conversation_id),
+            func.coalesce(func.sum(ArchivedConversation.message_count), 0),
+            func.coalesce(func.sum(func.length(ArchivedConversation.payload)), 0),
+        )).one()
+        hot = conn.execute(select(func.count(Message.id))).scalar()
+    return {'archived_conversations': archived, 'archived_messages': messages,
+            'archived_bytes': size, 'hot_messages': hot}
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(day):
+    return date(day.year + (day.month == 12), day.month % 12 + 1, 1)
+
+
+def _partition_sql(start):
+    end = _next_month(start)
+    return (f"CREATE TABLE IF NOT EXISTS message_{start:%Y_%m} PARTITION OF message "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}');")
+
+
+def _foreign_keys_sql():
+    """Clés étrangères de `message` telles que déclarées dans le modèle (ON DELETE compris)."""
+    lines = []
+    for constraint in Message.__table__.foreign_key_constraints:
+        local_columns = ', '.join(constraint.column_keys)
+        referred_columns = ', '.join(e.column.name for e in constraint.elements)
+        on_delete = f' ON DELETE {constraint.ondelete.upper()}' if constraint.ondelete else ''
+        lines.append(f'ALTER TABLE message ADD FOREIGN KEY ({local_columns}) '
+                     f'REFERENCES "{constraint.referred_table.name}" ({referred_columns}){on_delete};')
+    return lines
+
+
+def partition_ddl(first_month, months_ahead=ARCHIVE_PARTITION_MONTHS_AHEAD, today=None):
+    """Script SQL (Postgres) de conversion de `message` en table partitionnée par mois."""
+    today = today or datetime.utcnow().date()
+    months = []
+    month = _month_start(first_month)
+    last = _month_start(today)
+    for _ in range(months_ahead):
+        last = _next_month(last)
+    while month <= last:
+        months.append(month)
+        month = _next_month(month)
+    lines = [
+        '-- Conversion de message en table partitionnée par mois (timestamp).',
+        '-- Réécrit toute la table: à lancer pendant une maintenance, application arrêtée.',
+        'BEGIN;',
+        'ALTER TABLE message RENAME TO message_unpartitioned;',
+        'CREATE TABLE message (LIKE message_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp);',
+        # La clé primaire d'une table partitionnée doit contenir la clé de partition
+        'ALTER TABLE message ALTER COLUMN timestamp SET NOT NULL;',
+        'ALTER TABLE message ADD PRIMARY KEY (id, timestamp);',
+    ]
+    lines += _foreign_keys_sql()
+    lines += [_partition_sql(m) for m in months]
+    lines += [
+        'CREATE TABLE IF NOT EXISTS message_default PARTITION OF message DEFAULT;',
+        # search_vector ordinaire tenue par trigger (voir services/search.py), recalculée à la copie
+        'ALTER TABLE message ADD COLUMN IF NOT EXISTS search_vector tsvector;',
+    ]
+    lines += [f'{statement};' for statement in SEARCH_VECTOR_TRIGGER_SQL if not statement.startswith('DROP')]
+    lines += [
+        'INSERT INTO message (id, conversation_id, content, is_user, timestamp, emotion_detected, '
+        'image_path, audio_path, truncated) '
+        'SELECT id, conversation_id, content, is_user, coalesce(timestamp, now()), emotion_detected, '
+        'image_path, audio_path, truncated FROM message_unpartitioned;',
+        'ALTER SEQUENCE message_id_seq OWNED BY message.id;',
+        "ALTER TABLE message ALTER COLUMN id SET DEFAULT nextval('message_id_seq');",
+        'DROP TABLE message_unpartitioned;',
+        # Mêmes noms que les index déclarés dans les modèles (libérés par le DROP)
+        'CREATE INDEX ix_message_conversation_timestamp ON message (conversation_id, timestamp);',
+        'CREATE INDEX ix_message_search ON message USING GIN (search_vector);',
+        'COMMIT;',
+        'ANALYZE message;',
+    ]
+    return '\n'.join(lines)
+
+
+def is_partitioned(engine):
+    if engine.dialect.name != 'postgresql':
+        return False
+    with engine.connect() as conn:
+        return bool(conn.execute(text(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'message'::regclass"
+        )).first())
+
+
+def ensure_future_partitions(months_ahead=ARCHIVE_PARTITION_MONTHS_AHEAD):
+    """Créer les partitions mensuelles à venir si `message` est partitionnée (sinon rien)."""
+    if not is_partitioned(db.engine):
+        return []
+    month = _month_start(datetime.utcnow().date())
+    created = []
+    with db.engine.begin() as conn:
+        for _ in range(months_ahead + 1):
+            conn.execute(text(_partition_sql(month)))
+            created.append(f'message_{month:%Y_%m}')
+            month = _next_month(month)
+    return created
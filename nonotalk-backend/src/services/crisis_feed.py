@@ -0,0 +1,116 @@
+"""
+Notification des nouvelles alertes de crise aux intervenants (long-poll / SSE).
+
+Chaque client en attente ne relance pas sa propre requête: un seul thread par
+worker lit `max(id)` des alertes non résolues toutes les
+CRISIS_FEED_POLL_SECONDS secondes (lecture de l'index partiel
+ix_crisis_alert_unresolved, quelques pages au plus) et réveille les clients
+dont le curseur est dépassé. Le thread ne tourne que tant qu'un client
+attend; la charge en base ne dépend donc pas du nombre d'intervenants
+connectés. Une alerte enregistrée par ce worker (services/safety.py) réveille
+les clients dès son commit, sans attendre le prochain tour.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event, false, func, select
+
+from src.models.routing import RoutingSession
+from src.models.user import db, CrisisAlert
+from src.services.logs import get_logger
+
+CRISIS_FEED_POLL_SECONDS = float(os.getenv('CRISIS_FEED_POLL_SECONDS', '0.5'))
+
+log = get_logger('crisis_feed')
+
+
+class AlertFeed:
+    """Dernier identifiant d'alerte non résolue connu du worker, partagé par tous les clients en attente."""
+
+    def __init__(self, app, poll_seconds=CRISIS_FEED_POLL_SECONDS):
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self.latest_id = 0
+        self.waiters = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _refresh(self):
+        with self.app.app_context():
+            try:
+                latest = db.session.execute(
+                    select(func.max(CrisisAlert.id)).where(CrisisAlert.resolved == false())
+                ).scalar() or 0
+            finally:
+                db.session.remove()
+        self.notify(latest)
+
+    def notify(self, latest_id):
+        with self._cond:
+            if latest_id > self.latest_id:
+                self.latest_id = latest_id
+                self._cond.notify_all()
+
+    def _poll(self):
+        while True:
+            with self._cond:
+                if not self.waiters:
+                    self._thread = None
+                    return
+            try:
+                self._refresh()
+            except Exception as e:
+                log.warning('lecture des alertes impossible: %s: %s', type(e).__name__, e)
+            time.sleep(self.poll_seconds)
+
+    def wait_for_new(self, after_id, timeout):
+        """Attendre au plus `timeout` s une alerte d'identifiant > after_id; True si elle existe (probablement)."""
+        with self._cond:
+            if self.latest_id > after_id:
+                return True
+            self.waiters += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, name='crisis-feed', daemon=True)
+                self._thread.start()
+            try:
+                return self._cond.wait_for(lambda: self.latest_id > after_id, timeout)
+            finally:
+                self.waiters -= 1
+
+
+# Un flux par worker, recréé après un fork
+_feed_lock = threading.Lock()
+_feed_state = {'pid': None, 'feed': None}
+
+
+def get_feed(app):
+    pid = os.getpid()
+    if _feed_state['pid'] == pid:
+        return _feed_state['feed']
+    with _feed_lock:
+        if _feed_state['pid'] != pid:
+            _feed_state['feed'] = AlertFeed(app)
+            _feed_state['pid'] = pid
+    return _feed_state['feed']
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_new_alerts(session, flush_context):
+    ids = [obj.id for obj in session.new if isinstance(obj, CrisisAlert) and obj.id]
+    if ids:
+        session.info['crisis_alert_ids'] = session.info.get('crisis_alert_ids', []) + ids
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _notify_new_alerts(session):
+    """Réveiller les clients de ce worker dès le commit d'une alerte."""
+    ids = session.info.pop('crisis_alert_ids', None)
+    feed = _feed_state['feed'] if _feed_state['pid'] == os.getpid() else None
+    if ids and feed is not None:
+        feed.notify(max(ids))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_new_alerts(session):
+    session.info.pop('crisis_alert_ids', None)
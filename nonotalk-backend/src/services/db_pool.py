@@ -0,0 +1,163 @@
+"""
+Dimensionnement et télémétrie du pool de connexions SQLAlchemy.
+
+La taille du pool est déduite du modèle de workers (exporté par
+gunicorn.conf.py: WEB_CONCURRENCY, GUNICORN_THREADS, GUNICORN_WORKER_CLASS)
+et du nombre de connexions que la base accepte (DB_MAX_CONNECTIONS moins
+DB_RESERVED_CONNECTIONS pour les scripts et l'administration):
+
+- gthread: un thread n'a besoin d'une connexion que le temps de ses requêtes
+  SQL (un stream SSE n'en tient pas pendant la génération), d'où un pool
+  permanent d'environ DB_POOL_ACTIVE_RATIO x threads et un débordement
+  jusqu'au nombre de threads, le tout plafonné par le budget du worker;
+- sync: une connexion par worker suffit.
+
+DB_POOL_SIZE / DB_MAX_OVERFLOW forcent les valeurs. Les connexions sont
+recyclées après DB_POOL_RECYCLE secondes au lieu d'un ping à chaque emprunt
+(DB_POOL_PRE_PING=1 pour le réactiver). DB_PGBOUNCER=1 désactive les
+requêtes préparées côté serveur de psycopg, incompatibles avec le mode
+"transaction" de PgBouncer.
+
+Télémétrie par moteur (primary, replica_0...): attente pour obtenir une
+connexion, délais dépassés, débordement en cours, invalidations.
+"""
+import math
+import os
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+from src.services import metrics
+
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', '100'))
+DB_RESERVED_CONNECTIONS = int(os.getenv('DB_RESERVED_CONNECTIONS', '10'))
+DB_POOL_ACTIVE_RATIO = float(os.getenv('DB_POOL_ACTIVE_RATIO', '0.5'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '300'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+
+
+def _flag(name):
+    return os.getenv(name, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def pool_sizing():
+    """(pool_size, max_overflow) pour un worker, d'après le modèle de workers."""
+    workers = max(1, int(os.getenv('WEB_CONCURRENCY', '1')))
+    worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread').strip().lower()
+    if worker_class == 'sync':
+        concurrency = 1
+    elif worker_class == 'gevent':
+        concurrency = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+    else:
+        # gthread, auto, ou serveur de développement threadé
+        concurrency = int(os.getenv('GUNICORN_THREADS', '16'))
+    budget = max(1, (DB_MAX_CONNECTIONS - DB_RESERVED_CONNECTIONS) // workers)
+    pool_size = max(1, min(math.ceil(concurrency * DB_POOL_ACTIVE_RATIO), budget))
+    max_overflow = max(0, min(concurrency, budget) - pool_size)
+    if os.getenv('DB_POOL_SIZE'):
+        pool_size = int(os.getenv('DB_POOL_SIZE'))
+    if os.getenv('DB_MAX_OVERFLOW'):
+        max_overflow = int(os.getenv('DB_MAX_OVERFLOW'))
+    return pool_size, max_overflow
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool qui mesure l'attente pour obtenir une connexion."""
+
+    engine_name = 'primary'
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            metrics.DB_POOL_TIMEOUTS.labels(self.engine_name).inc()
+            raise
+        finally:
+            metrics.DB_POOL_CHECKOUT_WAIT_SECONDS.labels(self.engine_name).observe(time.perf_counter() - start)
+
+    def recreate(self):
+        # engine.dispose() (après un fork) recrée le pool: garder le nom pour les métriques
+        pool = super().recreate()
+        pool.engine_name = self.engine_name
+        return pool
+
+
+def normalize_database_url(db_url):
+    """Normalise et force le driver psycopg (psycopg3) pour compatibilité Render/Python 3.13"""
+    if not db_url:
+        return db_url
+    # Render fournit parfois 'postgres://', que SQLAlchemy déconseille
+    if db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+    # Remplacer +psycopg2 par +psycopg pour psycopg3
+    if db_url.startswith("postgresql+psycopg2://"):
+        db_url = db_url.replace("postgresql+psycopg2://", "postgresql+psycopg://", 1)
+    # Si aucun driver n'est précisé, on impose psycopg (psycopg3)
+    if db_url.startswith("postgresql://") and "+psycopg" not in db_url and "+psycopg2" not in db_url and "+pg8000" not in db_url:
+        db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return db_url
+
+
+def connect_args(database_url):
+    """Arguments de connexion Postgres (SSL, PgBouncer), communs à l'application et aux scripts."""
+    if not database_url or not database_url.startswith('postgresql'):
+        return {}
+    args = {}
+    if 'sslmode=' not in database_url:
+        args['sslmode'] = os.getenv('PGSSLMODE', 'require')  # sécurise la connexion PostgreSQL
+    if _flag('DB_PGBOUNCER'):
+        # PgBouncer en mode transaction: une requête préparée n'existe que sur une connexion serveur
+        args['prepare_threshold'] = None
+    return args
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS pour l'URL donnée (vide hors Postgres)."""
+    if not database_url or not database_url.startswith('postgresql'):
+        return {}
+    pool_size, max_overflow = pool_sizing()
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        # Recyclage avant les coupures d'inactivité de Render / PgBouncer, sans aller-retour à chaque emprunt
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': _flag('DB_POOL_PRE_PING'),
+        'pool_use_lifo': True,
+        'connect_args': connect_args(database_url),
+    }
+
+
+def instrument(engine, name):
+    """Compteurs et jauges du pool d'un moteur."""
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.engine_name = name
+
+    @event.listens_for(engine, 'checkout')
+    def _pool_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.DB_POOL_CHECKOUTS.labels(name).inc()
+
+    @event.listens_for(engine, 'invalidate')
+    def _pool_invalidate(dbapi_connection, connection_record, exception):
+        metrics.DB_POOL_INVALIDATIONS.labels(name, 'hard').inc()
+
+    @event.listens_for(engine, 'soft_invalidate')
+    def _pool_soft_invalidate(dbapi_connection, connection_record, exception):
+        metrics.DB_POOL_INVALIDATIONS.labels(name, 'soft').inc()
+
+    # engine.pool est relu à chaque scrape: le pool est recréé après un fork
+    if hasattr(engine.pool, 'checkedout'):
+        metrics.DB_POOL_CHECKED_OUT.labels(name).set_function(lambda: engine.pool.checkedout())
+    if hasattr(engine.pool, 'overflow'):
+        metrics.DB_POOL_OVERFLOW.labels(name).set_function(lambda: max(0, engine.pool.overflow()))
+        metrics.DB_POOL_SIZE.labels(name).set_function(lambda: engine.pool.size())
+
+
+def init_app(app, db):
+    with app.app_context():
+        engines = dict(db.engines)
+    for key, engine in engines.items():
+        instrument(engine, key or 'primary')
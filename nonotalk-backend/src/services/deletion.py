@@ -0,0 +1,211 @@
+"""
+Suppression d'un compte ou d'une conversation par lots, en arrière-plan.
+
+`db.session.delete(user)` chargeait toutes les conversations et tous les
+messages en mémoire pour les supprimer un par un dans une seule longue
+transaction. Ici la route crée un `DeletionJob` et répond 202 tout de suite;
+un thread du worker supprime ensuite les messages par lots de
+DELETION_BATCH_SIZE, une transaction courte par lot (pause de
+DELETION_BATCH_PAUSE secondes entre deux), puis les lignes restantes. Les
+fichiers référencés par image_path / audio_path (messages chauds et archivés)
+sont effacés après le commit de leur lot.
+
+La progression est enregistrée dans le job (GET /api/deletions/<id>). Un job
+dont le battement de cœur (updated_at) date de plus de DELETION_STALE_SECONDS
+a perdu son worker (redéploiement): une nouvelle demande sur la même cible le
+reprend là où il en était. Les clés étrangères portent ON DELETE CASCADE
+(voir src/models/user.py): ce qui resterait est supprimé par la base.
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+
+from src.models.user import (
+    db, ArchivedConversation, Conversation, CrisisAlert, DailyEmotionStat, DeletionJob, IdempotencyKey,
+    Invitation, Message, User,
+)
+from src.services.archive import decode_messages
+from src.services.logs import get_logger
+
+DELETION_BATCH_SIZE = int(os.getenv('DELETION_BATCH_SIZE', '1000'))
+DELETION_BATCH_PAUSE = float(os.getenv('DELETION_BATCH_PAUSE', '0.05'))
+DELETION_STALE_SECONDS = float(os.getenv('DELETION_STALE_SECONDS', '60'))
+
+log = get_logger('deletion')
+
+STATIC_ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'static'))
+
+
+def _conversation_ids(kind, target_id):
+    if kind == 'conversation':
+        return select(Conversation.id).where(Conversation.id == target_id)
+    return select(Conversation.id).where(Conversation.user_id == target_id)
+
+
+def _count_messages(kind, target_id):
+    scope = _conversation_ids(kind, target_id)
+    hot = db.session.execute(
+        select(func.count(Message.id)).where(Message.conversation_id.in_(scope))
+    ).scalar()
+    archived = db.session.execute(
+        select(func.coalesce(func.sum(ArchivedConversation.message_count), 0))
+        .where(ArchivedConversation.conversation_id.in_(scope))
+    ).scalar()
+    return hot + archived
+
+
+def _active_job(kind, target_id):
+    return DeletionJob.query.filter(
+        DeletionJob.kind == kind, DeletionJob.target_id == target_id,
+        DeletionJob.status.in_(('pending', 'running')),
+    ).order_by(DeletionJob.created_at.desc()).first()
+
+
+def request_deletion(app, kind, target_id, requested_by=None):
+    """Créer (ou reprendre) le job de suppression et le lancer; retourne le job, ou None si la cible n'existe pas.
+
+    requested_by: utilisateur à l'origine de la demande (None pour un administrateur).
+    """
+    job = _active_job(kind, target_id)
+    if job is not None:
+        heartbeat = job.updated_at or job.created_at
+        if datetime.utcnow() - heartbeat < timedelta(seconds=DELETION_STALE_SECONDS):
+            return job
+        # Worker disparu en cours de route: reprise
+        job.status = 'pending'
+    else:
+        if kind == 'user':
+            target = db.session.get(User, target_id)
+            if target is None:
+                return None
+            # Compte inutilisable dès maintenant (connexion refusée)
+            target.deleted_at = target.deleted_at or datetime.utcnow()
+        else:
+            target = db.session.get(Conversation, target_id)
+            if target is None:
+                return None
+            # Conversation masquée dès maintenant (listes, lecture, envois)
+            target.deleted_at = target.deleted_at or datetime.utcnow()
+        job = DeletionJob(id=uuid.uuid4().hex, kind=kind, target_id=target_id, requested_by=requested_by,
+                          total_messages=_count_messages(kind, target_id))
+        db.session.add(job)
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+    start_job(app, job.id)
+    return job
+
+
+def start_job(app, job_id):
+    thread = threading.Thread(target=run_job, args=(app, job_id), name=f'deletion-{job_id[:8]}', daemon=True)
+    thread.start()
+    return thread
+
+
+def _progress(job_id, **values):
+    values['updated_at'] = datetime.utcnow()
+    db.session.execute(update(DeletionJob.__table__).where(DeletionJob.id == job_id).values(**values))
+
+
+def delete_files(paths):
+    """Effacer les fichiers de src/static référencés par des messages; retourne le nombre supprimé."""
+    deleted = 0
+    for relative in paths:
+        if not relative:
+            continue
+        path = os.path.realpath(os.path.join(STATIC_ROOT, relative))
+        # Jamais hors de src/static (chemin enregistré altéré)
+        if not path.startswith(STATIC_ROOT + os.sep):
+            continue
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning("impossible d'effacer %s: %s", relative, e)
+    return deleted
+
+
+def _delete_message_batches(job_id, kind, target_id):
+    scope = _conversation_ids(kind, target_id)
+    while True:
+        batch = db.session.execute(
+            select(Message.id, Message.image_path, Message.audio_path)
+            .where(Message.conversation_id.in_(scope))
+            .order_by(Message.id)
+            .limit(DELETION_BATCH_SIZE)
+        ).all()
+        if not batch:
+            return
+        db.session.execute(delete(Message.__table__).where(Message.id.in_([row.id for row in batch])))
+        _progress(job_id, deleted_messages=DeletionJob.deleted_messages + len(batch))
+        db.session.commit()
+        files = delete_files([p for row in batch for p in (row.image_path, row.audio_path)])
+        if files:
+            _progress(job_id, deleted_files=DeletionJob.deleted_files + files)
+            db.session.commit()
+        time.sleep(DELETION_BATCH_PAUSE)
+
+
+def _delete_archives(job_id, kind, target_id):
+    scope = _conversation_ids(kind, target_id)
+    archived_ids = db.session.execute(
+        select(ArchivedConversation.conversation_id).where(ArchivedConversation.conversation_id.in_(scope))
+    ).scalars().all()
+    for conversation_id in archived_ids:
+        archived = db.session.execute(
+            delete(ArchivedConversation.__table__)
+            .where(ArchivedConversation.conversation_id == conversation_id)
+            .returning(ArchivedConversation.codec, ArchivedConversation.payload, ArchivedConversation.message_count)
+        ).first()
+        if archived is None:
+            continue
+        records = decode_messages(archived.codec, archived.payload)
+        _progress(job_id, deleted_messages=DeletionJob.deleted_messages + archived.message_count)
+        db.session.commit()
+        files = delete_files([r.get(k) for r in records for k in ('image_path', 'audio_path')])
+        if files:
+            _progress(job_id, deleted_files=DeletionJob.deleted_files + files)
+            db.session.commit()
+
+
+def run_job(app, job_id):
+    with app.app_context():
+        job = db.session.get(DeletionJob, job_id)
+        if job is None or job.status in ('done', 'failed'):
+            return
+        kind, target_id = job.kind, job.target_id
+        started = time.perf_counter()
+        try:
+            _progress(job_id, status='running')
+            db.session.commit()
+            _delete_message_batches(job_id, kind, target_id)
+            _delete_archives(job_id, kind, target_id)
+            # Lignes restantes: peu nombreuses, une transaction
+            if kind == 'conversation':
+                db.session.execute(delete(Conversation.__table__).where(Conversation.id == target_id))
+            else:
+                for model, column in ((CrisisAlert, CrisisAlert.user_id), (Invitation, Invitation.inviter_id),
+                                      (IdempotencyKey, IdempotencyKey.user_id),
+                                      (DailyEmotionStat, DailyEmotionStat.user_id),
+                                      (Conversation, Conversation.user_id)):
+                    db.session.execute(delete(model.__table__).where(column == target_id))
+                db.session.execute(delete(User.__table__).where(User.id == target_id))
+            _progress(job_id, status='done', finished_at=datetime.utcnow())
+            db.session.commit()
+            job = db.session.get(DeletionJob, job_id)
+            log.info('suppression terminée', extra={
+                'job_id': job_id, 'kind': kind, 'target_id': target_id, 'messages': job.deleted_messages,
+                'files': job.deleted_files, 'seconds': round(time.perf_counter() - started, 1),
+            })
+        except Exception as e:
+            db.session.rollback()
+            _progress(job_id, status='failed', error=f'{type(e).__name__}: {e}', finished_at=datetime.utcnow())
+            db.session.commit()
+            log.exception('échec du job de suppression', extra={'job_id': job_id})
+        finally:
+            db.session.remove()
@@ -0,0 +1,138 @@
+"""
+Export des données d'un utilisateur (portabilité) en NDJSON.
+
+Une ligne JSON par enregistrement: en-tête, profil, conversations, messages
+(archivés compris, voir services/archive.py), invitations envoyées, alertes,
+puis une ligne de fin avec le nombre d'enregistrements de chaque type (un
+export tronqué se repère à son absence).
+
+Rien n'est chargé en entier: chaque table est lue colonne par colonne avec
+`yield_per` (curseur côté serveur sur Postgres, EXPORT_BATCH_SIZE lignes à la
+fois), et les lignes sont regroupées en morceaux d'environ EXPORT_CHUNK_BYTES,
+éventuellement compressés en gzip au fil de l'eau. La mémoire reste constante
+quelle que soit la taille de l'historique, et le premier morceau part tout de
+suite.
+
+Utilisé par GET /api/auth/export et par export_user.py.
+"""
+import os
+import zlib
+from datetime import datetime
+
+from sqlalchemy import select
+
+from src.models.user import db, User, ArchivedConversation, Conversation, Message, Invitation, CrisisAlert
+from src.services.archive import decode_messages
+from src.services.serialization import dumps
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', str(64 * 1024)))
+EXPORT_FORMAT = 'nonotalk-export'
+EXPORT_VERSION = 1
+
+# Le hash du PIN n'est jamais exporté
+USER_COLUMNS = (
+    User.id, User.username, User.email, User.quota_remaining, User.total_quota,
+    User.parrain_email, User.filleuls_count, User.created_at, User.last_login,
+)
+
+
+def _sections(user_id):
+    message_columns = (
+        Message.id, Message.conversation_id, Message.content, Message.is_user, Message.timestamp,
+        Message.emotion_detected, Message.image_path, Message.audio_path, Message.truncated,
+    )
+    return (
+        ('conversation',
+         select(Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at)
+         .where(Conversation.user_id == user_id).order_by(Conversation.id)),
+        ('message',
+         select(*message_columns).join(Conversation, Conversation.id == Message.conversation_id)
+         .where(Conversation.user_id == user_id)
+         .order_by(Message.conversation_id, Message.timestamp, Message.id)),
+        ('invitation',
+         select(Invitation.id, Invitation.email, Invitation.accepted, Invitation.created_at, Invitation.accepted_at)
+         .where(Invitation.inviter_id == user_id).order_by(Invitation.id)),
+        ('crisis_alert',
+         select(CrisisAlert.id, CrisisAlert.message_content, CrisisAlert.timestamp, CrisisAlert.resolved)
+         .where(CrisisAlert.user_id == user_id).order_by(CrisisAlert.id)),
+    )
+
+
+def _archived_messages(user_id, keys):
+    archives = db.session.execute(
+        select(ArchivedConversation.codec, ArchivedConversation.payload)
+        .join(Conversation, Conversation.id == ArchivedConversation.conversation_id)
+        .where(Conversation.user_id == user_id)
+        .order_by(ArchivedConversation.conversation_id),
+        execution_options={'yield_per': 1},
+    )
+    for codec, payload in archives:
+        for record in decode_messages(codec, payload):
+            yield {key: record.get(key) for key in keys}
+
+
+def export_records(user_id):
+    """Enregistrements {'type': ..., 'data': {...}} de l'utilisateur, lus par lots. Rien si l'utilisateur n'existe pas."""
+    user = db.session.execute(select(*USER_COLUMNS).where(User.id == user_id)).first()
+    if user is None:
+        return
+    yield {
+        'type': 'export',
+        'data': {
+            'format': EXPORT_FORMAT,
+            'version': EXPORT_VERSION,
+            'user_id': user_id,
+            'generated_at': datetime.utcnow(),
+        },
+    }
+    yield {'type': 'user', 'data': dict(zip((c.key for c in USER_COLUMNS), user))}
+
+    counts = {'user': 1}
+    for record_type, stmt in _sections(user_id):
+        keys = list(stmt.selected_columns.keys())
+        count = 0
+        result = db.session.execute(stmt, execution_options={'yield_per': EXPORT_BATCH_SIZE})
+        for row in result:
+            count += 1
+            yield {'type': record_type, 'data': dict(zip(keys, row))}
+        if record_type == 'message':
+            # Conversations en stockage froid: décompressées une à une
+            for record in _archived_messages(user_id, keys):
+                count += 1
+                yield {'type': record_type, 'data': record}
+        counts[record_type] = count
+    yield {'type': 'end', 'data': {'counts': counts}}
+
+
+def ndjson_chunks(records, compress=False):
+    """Encoder les enregistrements en NDJSON par morceaux (bytes), gzip si `compress`."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    first = True
+    for record in records:
+        line = dumps(record) + b'\n'
+        buffer.append(line)
+        size += len(line)
+        # Premier morceau envoyé dès l'en-tête: le client voit le téléchargement démarrer
+        if first or size >= EXPORT_CHUNK_BYTES:
+            chunk = b''.join(buffer)
+            buffer, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if first:
+                    chunk += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+            if chunk:
+                yield chunk
+    chunk = b''.join(buffer)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_filename(username, compress=False):
+    safe = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in (username or 'export'))
+    return f"nonotalk-{safe}-{datetime.utcnow():%Y%m%d}.ndjson" + ('.gz' if compress else '')
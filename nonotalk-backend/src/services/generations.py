@@ -0,0 +1,199 @@
+"""
+Générations IA indépendantes de la connexion HTTP.
+
+Chaque réponse en streaming tourne dans son propre thread et publie des
+évènements numérotés dans un tampon circulaire borné. Les clients SSE ne font
+que lire ce tampon (voir services/sse.py): une déconnexion n'interrompt plus la génération, et un
+client qui se reconnecte avec `Last-Event-ID` rejoue les évènements manqués.
+
+Le registre est en mémoire, donc local au worker: une reconnexion doit
+retomber sur le même processus (sinon 404, et le message final reste
+récupérable via l'historique puisqu'il est toujours enregistré).
+"""
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from src.services import metrics
+from src.services.logs import generation_id_var, get_logger, request_id_var
+from src.services.profiler import current_profile
+
+BUFFER_SIZE = int(os.getenv('GENERATION_BUFFER_SIZE', '512'))
+# Durée de conservation d'une génération terminée (pour les reconnexions tardives)
+FINISHED_TTL = float(os.getenv('GENERATION_TTL', '300'))
+
+log = get_logger('generations')
+
+
+def new_generation_id():
+    return uuid.uuid4().hex
+
+
+class Generation:
+    """Une génération en cours ou terminée, avec son tampon d'évènements."""
+
+    def __init__(self, user_id, conversation_id, buffer_size=BUFFER_SIZE, generation_id=None):
+        self.id = generation_id or new_generation_id()
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.created_at = time.time()
+        self.finished_at = None
+        # (seq, payload, longueur du texte cumulé après cet évènement)
+        self._events = deque(maxlen=buffer_size)
+        self._next_seq = 1
+        self._cond = threading.Condition()
+        self.text = ''
+        # Annulation ("stop generating"): le worker ferme le stream amont dès qu'il la voit
+        self.cancel_event = threading.Event()
+        self.cancel_requested_at = None
+        self.upstream = None
+        self.cancel_stats = None
+        # Message IA enregistré (dict) une fois la génération terminée
+        self.result = None
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def last_seq(self):
+        return self._next_seq - 1
+
+    def publish(self, payload):
+        """Ajouter un évènement; retourne son numéro de séquence."""
+        with self._cond:
+            if payload.get('type') == 'delta':
+                self.text += payload.get('content') or ''
+            seq = self._next_seq
+            self._next_seq += 1
+            self._events.append((seq, payload, len(self.text)))
+            self._cond.notify_all()
+            return seq
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """Demander l'arrêt; ferme aussi le stream amont pour débloquer une lecture en cours."""
+        if self.finished or self.cancel_event.is_set():
+            return False
+        self.cancel_requested_at = time.time()
+        self.cancel_event.set()
+        upstream = self.upstream
+        if upstream is not None:
+            try:
+                upstream.close()
+            except Exception:
+                pass
+        return True
+
+    def wait_finished(self, timeout):
+        with self._cond:
+            if not self.finished:
+                self._cond.wait_for(lambda: self.finished, timeout)
+            return self.finished
+
+    def finish(self):
+        with self._cond:
+            if self.finished_at is None:
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def read_after(self, last_seq, timeout=None):
+        """
+        Évènements de numéro > last_seq, en attendant au plus `timeout` s s'il n'y en a pas.
+        Si une partie a déjà été évincée du tampon, un évènement `snapshot` portant
+        le texte cumulé jusque-là est inséré en tête pour que le client puisse se resynchroniser.
+        """
+        with self._cond:
+            if self._next_seq - 1 <= last_seq and not self.finished and timeout:
+                self._cond.wait(timeout)
+            events = [(seq, payload) for seq, payload, _ in self._events if seq > last_seq]
+            if self._events and self._events[0][0] > last_seq + 1:
+                first_seq, first_payload, text_len = self._events[0]
+                if first_payload.get('type') == 'delta':
+                    text_len -= len(first_payload.get('content') or '')
+                events.insert(0, (first_seq - 1, {'type': 'snapshot', 'content': self.text[:text_len]}))
+            return events, self.finished
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _evict_expired(now):
+    expired = [gid for gid, gen in _registry.items()
+               if gen.finished_at is not None and now - gen.finished_at > FINISHED_TTL]
+    for gid in expired:
+        del _registry[gid]
+
+
+def create_generation(user_id, conversation_id, generation_id=None):
+    gen = Generation(user_id, conversation_id, generation_id=generation_id)
+    with _registry_lock:
+        _evict_expired(time.time())
+        _registry[gen.id] = gen
+    return gen
+
+
+def discard_generation(gen):
+    """Retirer une génération qui ne sera jamais lancée."""
+    gen.finish()
+    with _registry_lock:
+        _registry.pop(gen.id, None)
+
+
+def get_generation(generation_id):
+    with _registry_lock:
+        return _registry.get(generation_id)
+
+
+def active_generations():
+    with _registry_lock:
+        return [gen for gen in _registry.values() if not gen.finished]
+
+
+def drain_generations(timeout):
+    """Attendre la fin des générations en cours (arrêt gracieux du worker); retourne le nombre restant."""
+    deadline = time.monotonic() + timeout
+    for gen in active_generations():
+        gen.wait_finished(max(0.0, deadline - time.monotonic()))
+    return len(active_generations())
+
+
+metrics.GENERATIONS_ACTIVE.set_function(lambda: len(active_generations()))
+
+
+def run_generation(app, gen, target, *args):
+    """Exécuter `target(gen, *args)` dans un thread avec son propre contexte applicatif."""
+    # Si la requête est profilée, le thread de génération l'est aussi jusqu'à sa fin
+    profile = current_profile()
+    attached = threading.Event()
+    # Les logs du thread portent la requête d'origine et la génération
+    request_id = request_id_var.get()
+
+    def runner():
+        if profile is not None:
+            attached.wait()
+        try:
+            generation_id_var.set(gen.id)
+            request_id_var.set(request_id)
+            with app.app_context():
+                target(gen, *args)
+        except Exception as e:
+            log.exception('génération interrompue par une erreur')
+            gen.publish({'type': 'error', 'error': str(e)})
+        finally:
+            gen.finish()
+            if profile is not None:
+                profile.detach()
+
+    thread = threading.Thread(target=runner, name=f'generation-{gen.id[:8]}', daemon=True)
+    thread.start()
+    if profile is not None:
+        profile.attach(thread.ident)
+        attached.set()
+    return thread
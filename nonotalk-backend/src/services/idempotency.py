@@ -0,0 +1,98 @@
+"""
+Clés d'idempotence (en-tête Idempotency-Key) pour les envois de messages.
+
+La contrainte unique (user_id, key) sert de verrou: le premier envoi insère
+la clé en `pending`, les retries la retrouvent. Une fois la réponse
+enregistrée, la clé passe à `done` avec le corps de réponse, dans la même
+transaction que le message IA. Les clés expirent après IDEMPOTENCY_TTL secondes.
+"""
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from flask import request
+from sqlalchemy.exc import IntegrityError
+
+from src.models.user import db, IdempotencyKey
+
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))
+MAX_KEY_LENGTH = 128
+# Fraction des insertions qui purgent aussi les clés expirées (index sur expires_at)
+PURGE_PROBABILITY = 0.02
+
+
+def key_from_request():
+    """Clé de la requête courante, ou None si absente ou trop longue."""
+    key = (request.headers.get('Idempotency-Key') or '').strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None
+    return key
+
+
+def find_key(user_id, key):
+    return IdempotencyKey.query.filter(
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.key == key,
+        IdempotencyKey.expires_at > datetime.utcnow(),
+    ).first()
+
+
+def claim_key(user_id, key, endpoint, conversation_id, generation_id=None, attempts=2):
+    """
+    Insérer la clé en `pending`. Retourne (record, created): si un autre envoi
+    l'a déjà prise (course entre deux retries), created vaut False et record est
+    la clé existante, ou None si elle a disparu entre-temps à chaque essai
+    (libérée ou expirée): l'appelant répond alors 409.
+    """
+    for _ in range(attempts):
+        now = datetime.utcnow()
+        if random.random() < PURGE_PROBABILITY:
+            IdempotencyKey.query.filter(IdempotencyKey.expires_at <= now).delete(synchronize_session=False)
+        else:
+            IdempotencyKey.query.filter(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.expires_at <= now,
+            ).delete(synchronize_session=False)
+
+        record = IdempotencyKey(
+            user_id=user_id,
+            key=key,
+            endpoint=endpoint,
+            conversation_id=conversation_id,
+            generation_id=generation_id,
+            status='pending',
+            expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL),
+        )
+        db.session.add(record)
+        try:
+            db.session.commit()
+            return record, True
+        except IntegrityError:
+            db.session.rollback()
+        existing = find_key(user_id, key)
+        if existing is not None:
+            return existing, False
+        # Clé libérée (ou expirée) entre l'insertion et la relecture: nouvel essai
+    return None, False
+
+
+def complete_key(record, status_code, payload):
+    """Marquer la clé comme terminée (l'appelant commit avec le reste de la réponse)."""
+    record.status = 'done'
+    record.status_code = status_code
+    record.response_body = json.dumps(payload, ensure_ascii=False)
+
+
+def release_key(record_id):
+    """Libérer une clé après un échec, pour qu'un retry puisse réessayer."""
+    try:
+        IdempotencyKey.query.filter_by(id=record_id).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+
+
+def stored_payload(record):
+    return json.loads(record.response_body) if record.response_body else None
@@ -0,0 +1,266 @@
+"""
+Journalisation structurée (JSON lines) sans écriture sur le thread de la requête.
+
+Les print() des routes écrivaient sur stdout de manière synchrone: quand le
+collecteur de logs de Render ralentit, chaque requête attendait le pipe.
+Ici les routes appellent un logger `nonotalk.*`; le QueueHandler ne fait que
+déposer l'enregistrement dans une file bornée (LOG_QUEUE_SIZE) et un thread
+QueueListener formate puis écrit. File pleine: l'enregistrement est abandonné
+et compté (nonotalk_log_records_dropped_total) plutôt que de bloquer.
+
+- Une ligne JSON par évènement: ts, level, logger, msg, request_id,
+  generation_id, puis les champs passés dans `extra=`. LOG_FORMAT=text pour
+  une sortie lisible en développement.
+- Corrélation: request_id (en-tête X-Request-ID entrant, sinon généré, et
+  renvoyé dans la réponse) et generation_id (threads de génération, voir
+  services/generations.py) sont ajoutés à chaque enregistrement.
+- Échantillonnage par logger: LOG_SAMPLING="nonotalk.chat.request=0.1,..."
+  garde 10 % des évènements INFO/DEBUG de ce logger (et de ses enfants);
+  WARNING et au-delà sont toujours gardés.
+- Masquage (LOG_REDACT=1 par défaut): les champs de contenu (message,
+  transcript, content...) sont remplacés par leur longueur, les adresses
+  email par [email], y compris dans le texte et les tracebacks.
+
+Le thread d'écriture est démarré à la demande dans chaque processus (jamais
+dans le maître gunicorn avant le fork, voir services/startup.py).
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, request
+
+from src.services import metrics
+from src.services.serialization import dumps
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').strip().lower()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_REDACT = os.getenv('LOG_REDACT', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')
+
+# Champs `extra=` jamais écrits en clair
+REDACTED_FIELDS = frozenset((
+    'content', 'message_content', 'message', 'transcript', 'text', 'prompt', 'email', 'to_email',
+))
+EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+
+# Attributs standards d'un LogRecord: le reste vient de `extra=`
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id', 'generation_id'}
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+generation_id_var = contextvars.ContextVar('generation_id', default=None)
+
+LOG_RECORDS_DROPPED = metrics.counter(
+    'nonotalk_log_records_dropped_total', "Enregistrements de log abandonnés (file pleine)"
+)
+
+
+def get_logger(name):
+    return logging.getLogger(f'nonotalk.{name}')
+
+
+def parse_sampling(spec):
+    """"nonotalk.chat=0.1,nonotalk.db=0.5" -> {'nonotalk.chat': 0.1, ...}; entrées invalides ignorées."""
+    rates = {}
+    for item in spec.split(','):
+        name, _, rate = item.partition('=')
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Identifiants de corrélation + échantillonnage (sur le thread appelant, avant la file)."""
+
+    def __init__(self, sampling=None):
+        super().__init__()
+        self.sampling = sampling or {}
+        self._cache = {}
+
+    def _rate(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.sampling:
+                    rate = self.sampling[prefix]
+                    break
+                prefix = prefix.rpartition('.')[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and self.sampling:
+            rate = self._rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+        record.request_id = request_id_var.get()
+        record.generation_id = generation_id_var.get()
+        return True
+
+
+def _redact_value(key, value):
+    if key in REDACTED_FIELDS and value is not None:
+        return f'[redacted:{len(value) if isinstance(value, (str, bytes)) else type(value).__name__}]'
+    if isinstance(value, str):
+        return EMAIL_RE.sub('[email]', value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement (thread d'écriture)."""
+
+    def __init__(self, redact=LOG_REDACT):
+        super().__init__()
+        self.redact = redact
+
+    def fields(self, record):
+        message = record.getMessage()
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': EMAIL_RE.sub('[email]', message) if self.redact else message,
+        }
+        for key in ('request_id', 'generation_id'):
+            value = getattr(record, key, None)
+            if value:
+                data[key] = value
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = _redact_value(key, value) if self.redact else value
+        exc = record.exc_text or (self.formatException(record.exc_info) if record.exc_info else None)
+        if exc:
+            data['exc'] = EMAIL_RE.sub('[email]', exc) if self.redact else exc
+        return data
+
+    def format(self, record):
+        data = self.fields(record)
+        try:
+            return dumps(data).decode('utf-8')
+        except TypeError:
+            return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(JsonFormatter):
+    """Même contenu (masqué) que JsonFormatter, sur une ligne lisible."""
+
+    def format(self, record):
+        data = self.fields(record)
+        head = f"{data.pop('ts')} {data.pop('level'):<7} {data.pop('logger')}: {data.pop('msg')}"
+        exc = data.pop('exc', None)
+        line = head + ''.join(f' {k}={v}' for k, v in data.items())
+        return f'{line}\n{exc}' if exc else line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui démarre son QueueListener à la demande (par processus) et n'attend jamais."""
+
+    def __init__(self, target):
+        super().__init__(queue.Queue(LOG_QUEUE_SIZE))
+        self.target = target
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid != pid:
+                # Nouvelle file à chaque démarrage: après un fork, celle du parent peut avoir un verrou pris
+                self.queue = queue.Queue(LOG_QUEUE_SIZE)
+                self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = pid
+
+    def prepare(self, record):
+        # Le formatage (et le masquage) est fait par le thread d'écriture; seul le message est figé ici
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            # Traceback mis en texte tant que les frames existent; l'objet exception n'est pas gardé dans la file
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def stop(self):
+        """Vider la file et arrêter le thread d'écriture de ce processus."""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+_handler = None
+
+
+def configure(stream=None):
+    """Installer le pipeline sur le logger `nonotalk` (idempotent); retourne le handler."""
+    global _handler
+    if _handler is not None:
+        return _handler
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+    handler = NonBlockingQueueHandler(target)
+    handler.addFilter(ContextFilter(parse_sampling(LOG_SAMPLING)))
+    root = logging.getLogger('nonotalk')
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(handler)
+    root.propagate = False
+    if hasattr(os, 'register_at_fork'):
+        # Ne jamais forker avec le thread d'écriture en cours: il redémarre à la demande de chaque côté
+        os.register_at_fork(before=handler.stop)
+    atexit.register(handler.stop)
+    _handler = handler
+    return handler
+
+
+def init_app(app):
+    """request_id par requête (X-Request-ID entrant ou généré), renvoyé dans la réponse."""
+    configure()
+
+    @app.before_request
+    def _bind_request_id():
+        incoming = request.headers.get('X-Request-ID', '')
+        g.request_id = incoming[:64] if incoming and incoming.isprintable() else uuid.uuid4().hex
+        g.request_id_token = request_id_var.set(g.request_id)
+
+    @app.after_request
+    def _send_request_id(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        return response
+
+    @app.teardown_request
+    def _unbind_request_id(exc):
+        token = g.pop('request_id_token', None)
+        if token is not None:
+            try:
+                request_id_var.reset(token)
+            except ValueError:
+                request_id_var.set(None)
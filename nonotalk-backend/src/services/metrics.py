@@ -0,0 +1,521 @@
+"""
+Métriques applicatives au format texte Prometheus, exposées sur /api/metrics.
+
+Compteurs, jauges et histogrammes avec labels, sans dépendance externe.
+Chaque série (combinaison de labels) a son propre verrou, tenu seulement le
+temps d'une addition: pas de verrou global sur le chemin chaud.
+
+Plusieurs workers gunicorn: chaque processus a son registre, et un scrape
+n'atteint qu'un worker. Avec METRICS_MULTIPROC_DIR (posé par
+gunicorn.conf.py), chaque worker écrit un instantané de ses séries dans
+`<dir>/<pid>.json` toutes les METRICS_FLUSH_SECONDS secondes (et à sa
+sortie); /api/metrics agrège alors tous les workers: compteurs et
+histogrammes additionnés, workers arrêtés compris (pas de remise à zéro
+quand un worker redémarre), jauges additionnées sur les workers vivants
+(ou leur maximum, ex: retard des réplicas). Les autres workers sont vus avec
+au plus METRICS_FLUSH_SECONDS de retard. Sans ce répertoire (développement,
+un seul processus), valeurs du processus courant.
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (1, 5, 10, 25, 50, 100, 180, 250, 500, 1000, 2000, 4000)
+
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '').strip()
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.labelnames)
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._children_lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child()
+                    self._children[key] = child
+        return child
+
+    def _default(self):
+        # Métrique sans label: une seule série
+        return self.labels()
+
+    def snapshot(self):
+        """Valeurs courantes de chaque série: {labels: valeur}."""
+        return {key: self._value(child) for key, child in list(self._children.items())}
+
+    def merge(self, snapshots):
+        """Agréger les instantanés [(vivant, {labels: valeur})] des workers; compteurs: somme, morts compris."""
+        merged = {}
+        for _, series in snapshots:
+            for key, value in series.items():
+                merged[key] = merged[key] + value if key in merged else value
+        return merged
+
+    def collect(self, series=None):
+        series = self.snapshot() if series is None else series
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(series.items()):
+            lines.extend(self._sample_lines(key, value))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Compteur monotone; par convention le nom se termine par _total."""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def _value(self, child):
+        return child.value
+
+    def _reset(self, child):
+        child._lock = threading.Lock()
+        child.value = 0.0
+
+    def _sample_lines(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class _GaugeChild:
+    __slots__ = ('_lock', 'value', 'callback')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+        self.callback = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, callback):
+        """Valeur calculée au moment du scrape (ex: connexions du pool en cours d'utilisation)."""
+        self.callback = callback
+
+    def get(self):
+        if self.callback is not None:
+            try:
+                return float(self.callback())
+            except Exception:
+                return float('nan')
+        return self.value
+
+
+class Gauge(_Metric):
+    """Jauge; entre workers, somme des workers vivants (multiprocess_mode='max': leur maximum)."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), multiprocess_mode='sum'):
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+
+    def merge(self, snapshots):
+        combine = max if self.multiprocess_mode == 'max' else (lambda a, b: a + b)
+        merged = {}
+        for alive, series in snapshots:
+            if not alive:
+                continue
+            for key, value in series.items():
+                merged[key] = combine(merged[key], value) if key in merged else value
+        return merged
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def set_function(self, callback):
+        self._default().set_function(callback)
+
+    def _value(self, child):
+        return child.get()
+
+    def _reset(self, child):
+        pass
+
+    def _sample_lines(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class _HistogramChild:
+    __slots__ = ('_lock', '_upper_bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, upper_bounds):
+        self._lock = threading.Lock()
+        self._upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def _value(self, child):
+        with child._lock:
+            return [list(child.counts), child.sum, child.count]
+
+    def _reset(self, child):
+        child._lock = threading.Lock()
+        child.counts = [0] * len(child.counts)
+        child.sum = 0.0
+        child.count = 0
+
+    def merge(self, snapshots):
+        merged = {}
+        for _, series in snapshots:
+            for key, (counts, total, count) in series.items():
+                if key not in merged:
+                    merged[key] = [list(counts), total, count]
+                    continue
+                current = merged[key]
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+                current[2] += count
+        return merged
+
+    def _sample_lines(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, (le,))} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), multiprocess_mode='sum'):
+    return _register(Gauge(name, documentation, labelnames, multiprocess_mode))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def _snapshot_all():
+    with _registry_lock:
+        metrics = list(_registry)
+    return {metric.name: [[list(key), value] for key, value in metric.snapshot().items()] for metric in metrics}
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_MULTIPROC_DIR, f'{pid}.json')
+
+
+def write_snapshot():
+    """Écrire l'instantané du processus courant (remplacement atomique du fichier)."""
+    if not METRICS_MULTIPROC_DIR:
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=METRICS_MULTIPROC_DIR, prefix='.tmp-', suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'pid': os.getpid(), 'metrics': _snapshot_all()}, f, separators=(',', ':'))
+    os.replace(tmp, _snapshot_path(os.getpid()))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshots():
+    """Instantanés des autres workers: [(vivant, {métrique: {labels: valeur}})]."""
+    own = _snapshot_path(os.getpid())
+    snapshots = []
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, '*.json')):
+        if path == own:
+            continue
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        series = {name: {tuple(key): value for key, value in values} for name, values in data['metrics'].items()}
+        snapshots.append((_alive(data['pid']), series))
+    return snapshots
+
+
+_flusher = {'pid': None}
+_flusher_lock = threading.Lock()
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+def start_flusher():
+    """Démarrer (une fois par processus) l'écriture périodique de l'instantané."""
+    pid = os.getpid()
+    if not METRICS_MULTIPROC_DIR or _flusher['pid'] == pid:
+        return
+    with _flusher_lock:
+        if _flusher['pid'] == pid:
+            return
+        _flusher['pid'] = pid
+        write_snapshot()
+        threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True).start()
+        atexit.register(write_snapshot)
+
+
+def _reset_after_fork():
+    # Le worker repart de zéro: ce que le maître a compté avant le fork serait sinon additionné une fois par worker.
+    # Verrous recréés sans les prendre: un autre thread du maître pouvait les tenir au moment du fork
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    for metric in list(_registry):
+        metric._children_lock = threading.Lock()
+        for child in list(metric._children.values()):
+            metric._reset(child)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def render():
+    """Toutes les métriques au format d'exposition texte Prometheus 0.0.4 (tous les workers si multiprocessus)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    others = _read_snapshots() if METRICS_MULTIPROC_DIR else []
+    live = 1 + sum(1 for alive, _ in others if alive)
+    lines = [
+        '# HELP nonotalk_metrics_processes Processus agrégés dans ce scrape',
+        '# TYPE nonotalk_metrics_processes gauge',
+        f'nonotalk_metrics_processes{{state="live"}} {live}',
+        f'nonotalk_metrics_processes{{state="exited"}} {len(others) + 1 - live}',
+    ]
+    for metric in metrics:
+        if not others:
+            lines.extend(metric.collect())
+            continue
+        snapshots = [(True, metric.snapshot())] + [(alive, series.get(metric.name, {})) for alive, series in others]
+        lines.extend(metric.collect(metric.merge(snapshots)))
+    return '\n'.join(lines) + '\n'
+
+
+# --- Métriques de l'application ---
+
+HTTP_REQUESTS_IN_FLIGHT = gauge('nonotalk_http_requests_in_flight', "Requêtes HTTP en cours de traitement")
+GENERATIONS_ACTIVE = gauge('nonotalk_generations_active', "Générations en streaming en cours")
+HTTP_REQUEST_SECONDS = histogram(
+    'nonotalk_http_request_duration_seconds',
+    "Durée des requêtes HTTP jusqu'à l'envoi des en-têtes",
+    ('route', 'method', 'status'),
+)
+UPSTREAM_TTFT_SECONDS = histogram(
+    'nonotalk_upstream_ttft_seconds', "Temps jusqu'au premier token de l'API OpenAI", ('endpoint',),
+)
+UPSTREAM_GENERATION_SECONDS = histogram(
+    'nonotalk_upstream_generation_seconds', "Durée totale d'une génération OpenAI", ('endpoint', 'outcome'),
+)
+LLM_TOKENS = counter('nonotalk_llm_tokens_total', "Tokens facturés par l'API OpenAI", ('endpoint', 'direction'))
+LLM_TOKENS_PER_REPLY = histogram(
+    'nonotalk_llm_completion_tokens', "Tokens générés par réponse", ('endpoint',), buckets=TOKEN_BUCKETS,
+)
+GENERATION_CANCEL_SECONDS = histogram(
+    'nonotalk_generation_cancel_latency_seconds', "Délai entre la demande d'arrêt et l'arrêt du stream amont",
+)
+GENERATION_TOKENS_SAVED = counter(
+    'nonotalk_generation_tokens_saved_total', "Tokens non générés grâce aux annulations (estimation)",
+)
+DB_POOL_CHECKOUTS = counter(
+    'nonotalk_db_pool_checkouts_total', "Connexions empruntées au pool SQLAlchemy", ('engine',),
+)
+DB_POOL_CHECKED_OUT = gauge('nonotalk_db_pool_checked_out', "Connexions du pool actuellement empruntées", ('engine',))
+DB_POOL_SIZE = gauge('nonotalk_db_pool_size', "Taille permanente configurée du pool", ('engine',))
+DB_POOL_OVERFLOW = gauge('nonotalk_db_pool_overflow', "Connexions ouvertes au-delà de la taille du pool", ('engine',))
+DB_POOL_CHECKOUT_WAIT_SECONDS = histogram(
+    'nonotalk_db_pool_checkout_wait_seconds', "Attente pour obtenir une connexion du pool", ('engine',),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+DB_POOL_TIMEOUTS = counter(
+    'nonotalk_db_pool_timeouts_total', "Emprunts abandonnés après DB_POOL_TIMEOUT", ('engine',),
+)
+DB_POOL_INVALIDATIONS = counter(
+    'nonotalk_db_pool_invalidations_total', "Connexions invalidées (erreur de connexion, recyclage forcé)",
+    ('engine', 'kind'),
+)
+DB_QUERIES_PER_REQUEST = histogram(
+    'nonotalk_db_queries_per_request', "Requêtes SQL par requête HTTP", ('route',),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+DB_TIME_PER_REQUEST_SECONDS = histogram(
+    'nonotalk_db_time_per_request_seconds', "Temps passé en base par requête HTTP", ('route',),
+)
+DB_REPLICA_LAG_SECONDS = gauge(
+    'nonotalk_db_replica_lag_seconds', "Retard mesuré de chaque réplica (-1: injoignable)", ('replica',),
+    multiprocess_mode='max',
+)
+DB_READS = counter(
+    'nonotalk_db_reads_total', "Requêtes en lecture seule par cible (replica, sticky, fallback)", ('target',),
+)
+SMTP_SEND_SECONDS = histogram('nonotalk_smtp_send_seconds', "Durée d'envoi d'un email SMTP", ('outcome',))
+STT_SECONDS = histogram('nonotalk_stt_seconds', "Durée de transcription speech-to-text", ('outcome',))
+TTS_SECONDS = histogram('nonotalk_tts_seconds', "Durée de synthèse text-to-speech", ('outcome',))
+
+
+def record_usage(endpoint, usage):
+    """Comptabiliser un objet `usage` OpenAI (prompt_tokens / completion_tokens)."""
+    if usage is None:
+        return
+    prompt = getattr(usage, 'prompt_tokens', None)
+    completion = getattr(usage, 'completion_tokens', None)
+    if isinstance(usage, dict):
+        prompt = usage.get('prompt_tokens', usage.get('input_tokens'))
+        completion = usage.get('completion_tokens', usage.get('output_tokens'))
+    if prompt:
+        LLM_TOKENS.labels(endpoint, 'in').inc(prompt)
+    if completion:
+        LLM_TOKENS.labels(endpoint, 'out').inc(completion)
+        LLM_TOKENS_PER_REPLY.labels(endpoint).observe(completion)
+
+
+def init_app(app):
+    """Mesure de la durée et du nombre de requêtes HTTP en cours (le pool: voir services/db_pool.py)."""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start_timer():
+        # Premier passage dans ce worker: écriture périodique de son instantané (METRICS_MULTIPROC_DIR)
+        start_flusher()
+        g._metrics_start = time.perf_counter()
+        g._metrics_in_flight = True
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+
+    @app.teardown_request
+    def _metrics_end_request(exc):
+        if g.pop('_metrics_in_flight', False):
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+
+    @app.after_request
+    def _metrics_observe_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(
+                time.perf_counter() - start
+            )
+        return response
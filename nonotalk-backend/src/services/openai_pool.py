@@ -0,0 +1,152 @@
+"""
+Pool HTTP partagé vers l'API OpenAI.
+
+Un seul client httpx par processus (donc par worker gunicorn), partagé par
+chat.py et tts.py, avec des limites de pool explicites et HTTP/2 quand le
+paquet `h2` est installé. Un pinger léger (HEAD /models, jamais facturé)
+garde la connexion TLS chaude pendant les périodes creuses, à la place de
+l'ancienne complétion de warmup lancée à l'import.
+
+Rien n'est créé à l'import: le SDK OpenAI, les clients et le pinger naissent
+au premier usage dans chaque processus, ce qui permet `gunicorn --preload`.
+"""
+import os
+import threading
+import time
+
+import httpx
+
+from src.services.logs import get_logger
+
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'sk-fake-key')
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+
+# Limites du pool (par processus)
+POOL_MAX_CONNECTIONS = int(os.getenv('OPENAI_POOL_MAX_CONNECTIONS', '20'))
+POOL_MAX_KEEPALIVE = int(os.getenv('OPENAI_POOL_MAX_KEEPALIVE', '10'))
+# Doit rester supérieur à l'intervalle du pinger, sinon httpx ferme la connexion avant le ping
+POOL_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_POOL_KEEPALIVE_EXPIRY', '120'))
+CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', '60'))
+# 0 désactive le pinger
+KEEPALIVE_INTERVAL = float(os.getenv('OPENAI_KEEPALIVE_INTERVAL', '45'))
+
+log = get_logger('openai')
+
+
+def http2_available():
+    """HTTP/2 n'est utilisable que si le paquet optionnel `h2` est présent."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return os.getenv('OPENAI_HTTP2', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+_lock = threading.Lock()
+_state = {
+    'pid': None,
+    'http_client': None,
+    'openai_client': None,
+    'last_activity': 0.0,
+    'pinger': None,
+}
+
+
+def _touch(_request):
+    _state['last_activity'] = time.monotonic()
+
+
+def build_http_client(**overrides):
+    """Construire un client httpx réglé pour l'API OpenAI (utilisé aussi par les benchmarks)."""
+    options = {
+        'http2': http2_available(),
+        'limits': httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        'event_hooks': {'request': [_touch]},
+    }
+    options.update(overrides)
+    return httpx.Client(**options)
+
+
+def _ensure_clients():
+    # Après un fork (gunicorn --preload), les sockets héritées ne sont pas réutilisables
+    pid = os.getpid()
+    if _state['pid'] == pid and _state['http_client'] is not None:
+        return
+    with _lock:
+        if _state['pid'] == pid and _state['http_client'] is not None:
+            return
+        from openai import OpenAI
+
+        http_client = build_http_client()
+        _state['http_client'] = http_client
+        _state['openai_client'] = OpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_API_BASE,
+            http_client=http_client,
+        )
+        _state['pinger'] = None
+        _state['pid'] = pid
+    start_keepalive()
+
+
+def get_http_client():
+    """Client httpx partagé du processus courant."""
+    _ensure_clients()
+    return _state['http_client']
+
+
+def get_openai_client():
+    """Client OpenAI partagé du processus courant (s'appuie sur le pool httpx)."""
+    _ensure_clients()
+    return _state['openai_client']
+
+
+def ping_once():
+    """Requête quasi gratuite qui ouvre (ou garde ouverte) la connexion TLS vers l'API."""
+    try:
+        get_http_client().head(
+            f"{OPENAI_API_BASE.rstrip('/')}/models",
+            headers={'Authorization': f'Bearer {OPENAI_API_KEY}'},
+            timeout=CONNECT_TIMEOUT,
+        )
+        return True
+    except Exception as e:
+        log.warning('keep-alive OpenAI en échec: %s', e)
+        return False
+
+
+def _keepalive_loop(interval):
+    # Premier ping immédiat: établit la connexion TLS avant la première vraie requête
+    ping_once()
+    while True:
+        time.sleep(interval / 3)
+        if _state['pid'] != os.getpid():
+            return
+        if time.monotonic() - _state['last_activity'] >= interval:
+            ping_once()
+
+
+def start_keepalive():
+    """Démarrer le pinger de keep-alive (une fois par processus)."""
+    if KEEPALIVE_INTERVAL <= 0:
+        return
+    _ensure_clients()
+    with _lock:
+        pinger = _state['pinger']
+        if pinger is not None and pinger.is_alive():
+            return
+        try:
+            pinger = threading.Thread(
+                target=_keepalive_loop, args=(KEEPALIVE_INTERVAL,),
+                name='openai-keepalive', daemon=True,
+            )
+            pinger.start()
+            _state['pinger'] = pinger
+        except Exception as e:
+            log.warning('démarrage du keep-alive impossible: %s', e)
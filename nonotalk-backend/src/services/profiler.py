@@ -0,0 +1,222 @@
+"""
+Profileur échantillonneur à la demande pour des requêtes réelles.
+
+Activé par requête avec l'en-tête `X-Profile: <PROFILE_TOKEN>`, ou sur une
+fraction du trafic (PROFILE_SAMPLE_RATE, 0 par défaut). Un thread unique
+relève périodiquement la pile des threads profilés (sys._current_frames),
+sans trace ni hook: le coût est nul pour les requêtes non profilées.
+
+Chaque profil est écrit au format "collapsed stacks" (une ligne
+`frame;frame;frame N`), directement lisible par flamegraph.pl ou speedscope,
+dans un anneau borné de fichiers (PROFILE_DIR, PROFILE_RING_SIZE). Un
+fichier .json résume la répartition Flask / SQLAlchemy / hachage du PIN /
+I/O amont. Les threads de génération lancés par une requête profilée sont
+suivis jusqu'à la fin de la réponse.
+"""
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from src.services.logs import get_logger
+
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join('/tmp', 'nonotalk-profiles'))
+PROFILE_RING_SIZE = int(os.getenv('PROFILE_RING_SIZE', '50'))
+MAX_STACK_DEPTH = 128
+
+log = get_logger('profiler')
+
+# Du plus spécifique au plus général: la première catégorie trouvée en remontant depuis la feuille gagne
+_CATEGORIES = (
+    ('password_hashing', ('werkzeug/security', 'hashlib', '_hashlib')),
+    ('sqlalchemy', ('sqlalchemy', 'psycopg', 'sqlite3', 'flask_sqlalchemy')),
+    ('upstream_io', ('httpx', 'httpcore', 'openai', 'ssl.py', 'socket.py', 'smtplib', 'langchain')),
+    ('flask', ('flask', 'werkzeug', 'jinja2')),
+)
+_SAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f"{module}:{code.co_name}"
+
+
+def _classify(frames):
+    for frame in frames:
+        filename = frame.f_code.co_filename.replace('\\', '/')
+        for category, markers in _CATEGORIES:
+            if any(marker in filename for marker in markers):
+                return category
+    return 'app'
+
+
+class Profile:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.time()
+        self.stacks = Counter()
+        self.categories = Counter()
+        self.samples = 0
+        self._threads = set()
+        self._lock = threading.Lock()
+
+    def attach(self, thread_id=None):
+        with self._lock:
+            self._threads.add(thread_id or threading.get_ident())
+        _sampler.watch(self)
+
+    def detach(self, thread_id=None):
+        """Retirer un thread; le profil est écrit quand plus aucun thread n'est suivi."""
+        with self._lock:
+            self._threads.discard(thread_id or threading.get_ident())
+            done = not self._threads
+        if done:
+            _sampler.unwatch(self)
+            _write_profile(self)
+
+    def sample(self, frames_by_thread):
+        with self._lock:
+            threads = list(self._threads)
+        for tid in threads:
+            frame = frames_by_thread.get(tid)
+            if frame is None:
+                continue
+            leaf_first = []
+            while frame is not None and len(leaf_first) < MAX_STACK_DEPTH:
+                leaf_first.append(frame)
+                frame = frame.f_back
+            self.stacks[';'.join(_frame_label(f) for f in reversed(leaf_first))] += 1
+            self.categories[_classify(leaf_first)] += 1
+            self.samples += 1
+
+    def summary(self):
+        interval_ms = PROFILE_INTERVAL_MS
+        return {
+            'id': self.id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': int((time.time() - self.started_at) * 1000),
+            'interval_ms': interval_ms,
+            'samples': self.samples,
+            'categories_ms': {k: round(v * interval_ms, 1) for k, v in self.categories.most_common()},
+        }
+
+
+class _Sampler:
+    """Un seul thread d'échantillonnage par processus, actif seulement s'il y a des profils."""
+
+    def __init__(self):
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def watch(self, profile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def unwatch(self, profile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self):
+        interval = PROFILE_INTERVAL_MS / 1000.0
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+            if not profiles:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+            frames = sys._current_frames()
+            frames.pop(own_id, None)
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(interval)
+
+
+_sampler = _Sampler()
+
+
+def _write_profile(profile):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stem = f"{int(profile.started_at * 1000)}_{profile.id}_{_SAFE_NAME.sub('_', profile.name)[:60]}"
+        with open(os.path.join(PROFILE_DIR, stem + '.folded'), 'w', encoding='utf-8') as f:
+            for stack, count in profile.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(PROFILE_DIR, stem + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(profile.summary(), f, ensure_ascii=False, indent=2)
+        _trim_ring()
+    except OSError as e:
+        log.warning('écriture du profil impossible: %s', e)
+
+
+def _trim_ring():
+    stems = sorted({name.rsplit('.', 1)[0] for name in os.listdir(PROFILE_DIR)
+                    if name.endswith(('.folded', '.json'))})
+    for stem in stems[:-PROFILE_RING_SIZE] if len(stems) > PROFILE_RING_SIZE else []:
+        for ext in ('.folded', '.json'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, stem + ext))
+            except OSError:
+                pass
+
+
+def should_profile(request):
+    header = request.headers.get('X-Profile')
+    if header and PROFILE_TOKEN and hmac.compare_digest(header.encode('utf-8'), PROFILE_TOKEN.encode('utf-8')):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def current_profile():
+    """Profil de la requête en cours (None si non profilée ou hors requête)."""
+    from flask import g, has_app_context
+    if not has_app_context():
+        return None
+    return g.get('_profile')
+
+
+def init_app(app):
+    from flask import g, request
+
+    @app.before_request
+    def _profiler_start():
+        if should_profile(request):
+            rule = request.url_rule.rule if request.url_rule is not None else request.path
+            profile = Profile(f"{request.method} {rule}")
+            profile.attach()
+            g._profile = profile
+
+    @app.after_request
+    def _profiler_header(response):
+        profile = g.get('_profile')
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    @app.teardown_request
+    def _profiler_stop(exc):
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            profile.detach()
@@ -0,0 +1,171 @@
+"""
+Instrumentation des requêtes SQL par requête HTTP.
+
+Les évènements du moteur SQLAlchemy comptent les requêtes et le temps DB de
+chaque requête HTTP, exposés dans l'en-tête `Server-Timing`. Les requêtes
+lentes sont loguées avec leurs paramètres masqués (jamais le contenu des
+messages ni les emails).
+
+Une route peut déclarer son budget avec `@query_budget(n)`. Le dépassement
+du budget, ou la répétition d'une même forme de requête N fois (symptôme
+N+1), est logué; en mode test (app.config['TESTING'] ou
+QUERY_BUDGET_ENFORCE=1) il lève QueryBudgetExceeded. Un travail ponctuel
+hors du chemin courant (restauration d'une archive) s'exécute dans
+`outside_budget()`: ses requêtes comptent dans le temps DB et les métriques,
+pas dans le budget.
+"""
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+
+from src.services import metrics
+from src.services.logs import get_logger
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
+
+log = get_logger('db')
+
+_WHITESPACE = re.compile(r'\s+')
+# "IN (?, ?, ?)" / "IN (__[POSTCOMPILE_x])" -> une seule forme quelle que soit la taille de la liste
+_IN_LIST = re.compile(r'\bIN\s*\((?:[^()]*)\)', re.IGNORECASE)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Une route a dépassé son budget de requêtes ou répète la même requête (N+1)."""
+
+
+def query_budget(max_queries):
+    """Déclarer le nombre maximal de requêtes SQL attendu pour une route."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g._query_budget = max_queries
+            return view(*args, **kwargs)
+        wrapper.query_budget = max_queries
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def outside_budget():
+    """Exclure les requêtes du bloc du budget de la route et de la détection N+1."""
+    stats = current_stats()
+    if stats is None:
+        yield
+        return
+    stats.exempt_depth += 1
+    try:
+        yield
+    finally:
+        stats.exempt_depth -= 1
+
+
+def statement_shape(statement):
+    return _IN_LIST.sub('IN (?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+def redact_parameters(parameters):
+    """Ne garder que le type et la taille des paramètres."""
+    def redact(value):
+        if value is None:
+            return None
+        if isinstance(value, (bool, int, float)):
+            return type(value).__name__
+        return f'<{type(value).__name__}:{len(str(value))}>'
+
+    if isinstance(parameters, dict):
+        return {k: redact(v) for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f'<{len(parameters)} lignes>'
+        return [redact(v) for v in parameters]
+    return redact(parameters)
+
+
+class QueryStats:
+    __slots__ = ('count', 'exempt', 'exempt_depth', 'total_ms', 'shapes')
+
+    def __init__(self):
+        self.count = 0
+        self.exempt = 0
+        self.exempt_depth = 0
+        self.total_ms = 0.0
+        self.shapes = Counter()
+
+    def repeated_shapes(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+def current_stats():
+    if not has_app_context():
+        return None
+    return g.get('_query_stats')
+
+
+def _enforce():
+    return current_app.config.get('TESTING') or os.getenv('QUERY_BUDGET_ENFORCE', '').strip() in ('1', 'true', 'yes')
+
+
+def init_app(app, db):
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('_query_start')
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        stats = current_stats()
+        if stats is not None:
+            stats.total_ms += elapsed_ms
+            if stats.exempt_depth:
+                stats.exempt += 1
+            else:
+                stats.count += 1
+                stats.shapes[statement_shape(statement)] += 1
+        if elapsed_ms >= SLOW_QUERY_MS:
+            log.warning('requête lente', extra={'elapsed_ms': round(elapsed_ms, 1),
+                                                'statement': statement_shape(statement)[:500],
+                                                'params': redact_parameters(parameters)})
+
+    # Primaire et réplicas: une lecture routée vers un réplica compte aussi pour la requête
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def _query_stats_start():
+        g._query_stats = QueryStats()
+
+    @app.after_request
+    def _query_stats_report(response):
+        stats = g.pop('_query_stats', None)
+        if stats is None:
+            return response
+        queries = stats.count + stats.exempt
+        response.headers.add('Server-Timing', f'db;dur={stats.total_ms:.1f};desc="{queries} queries"')
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.DB_QUERIES_PER_REQUEST.labels(route).observe(queries)
+        metrics.DB_TIME_PER_REQUEST_SECONDS.labels(route).observe(stats.total_ms / 1000)
+
+        problems = []
+        budget = g.get('_query_budget')
+        if budget is not None and stats.count > budget:
+            problems.append(f'{stats.count} requêtes pour un budget de {budget}')
+        for shape, n in stats.repeated_shapes():
+            problems.append(f'requête répétée {n} fois (N+1 ?): {shape[:200]}')
+        if problems:
+            message = f"{request.method} {route}: " + '; '.join(problems)
+            if _enforce():
+                raise QueryBudgetExceeded(message)
+            log.warning('budget de requêtes dépassé: %s', message)
+        return response
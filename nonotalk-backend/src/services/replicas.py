@@ -0,0 +1,192 @@
+"""
+Routage des lectures vers des réplicas.
+
+Les réplicas sont déclarés par DATABASE_REPLICA_URLS (URLs séparées par des
+virgules) et deviennent des binds Flask-SQLAlchemy `replica_0`, `replica_1`...
+Une route en lecture seule se déclare avec `@read_replica`; la session
+(src/models/routing.py) envoie alors ses SELECT vers un réplica sain, tandis
+que les flush et INSERT/UPDATE/DELETE restent sur le primaire.
+
+Lecture de ses propres écritures: toute requête qui écrit pose `db_wrote_at`
+dans la session Flask (cookie, donc valable pour tous les workers); pendant
+READ_YOUR_WRITES_SECONDS, les lectures de cet utilisateur restent sur le
+primaire (ex: get_messages juste après send).
+
+Retard: un thread par processus mesure le retard de chaque réplica toutes les
+REPLICA_CHECK_SECONDS (Postgres: rejeu du WAL; autres bases: écart du dernier
+message écrit, ce qui permet de tester avec deux fichiers SQLite). Un réplica
+en retard de plus de REPLICA_MAX_LAG_SECONDS, ou injoignable, est ignoré.
+"""
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_app_context, has_request_context, session
+from sqlalchemy import func, select, text
+
+from src.services import metrics
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_CHECK_SECONDS = float(os.getenv('REPLICA_CHECK_SECONDS', '2'))
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '15'))
+
+_MISSING = object()
+
+
+def replica_urls():
+    return [u.strip() for u in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if u.strip()]
+
+
+def read_replica(view):
+    """Autoriser les lectures de la route sur un réplica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._read_replica = True
+        return view(*args, **kwargs)
+    wrapper.read_replica = True
+    return wrapper
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.lag = None  # inconnu tant que la première mesure n'est pas faite
+        self.error = None
+        self.checked_at = None
+
+    @property
+    def healthy(self):
+        return self.error is None and self.lag is not None and self.lag <= REPLICA_MAX_LAG_SECONDS
+
+
+_state = {'primary': None, 'replicas': [], 'pid': None, 'checker': None}
+_lock = threading.Lock()
+_round_robin = itertools.count()
+
+
+def _watermark(engine):
+    from src.models.user import Message
+
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(Message.timestamp))).scalar()
+
+
+def measure_lag(primary, replica_engine):
+    """Retard du réplica en secondes."""
+    if replica_engine.dialect.name == 'postgresql':
+        with replica_engine.connect() as conn:
+            in_recovery, caught_up, age = conn.execute(text(
+                "SELECT pg_is_in_recovery(), "
+                "pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn(), "
+                "EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+            )).one()
+        # Tout ce qui a été reçu est rejoué: à jour, même si le primaire n'écrit plus depuis longtemps
+        if not in_recovery or caught_up:
+            return 0.0
+        return float(age or 0.0)
+    primary_mark = _watermark(primary)
+    replica_mark = _watermark(replica_engine)
+    if primary_mark is None:
+        return 0.0
+    if replica_mark is None:
+        return float('inf')
+    return max(0.0, (primary_mark - replica_mark).total_seconds())
+
+
+def check_replicas():
+    primary = _state['primary']
+    for replica in _state['replicas']:
+        try:
+            replica.lag = measure_lag(primary, replica.engine)
+            replica.error = None
+        except Exception as e:
+            replica.error = f'{type(e).__name__}: {e}'
+        replica.checked_at = time.time()
+        metrics.DB_REPLICA_LAG_SECONDS.labels(replica.name).set(
+            replica.lag if replica.error is None and replica.lag is not None else -1
+        )
+
+
+def _checker_loop(pid):
+    while _state['pid'] == pid:
+        check_replicas()
+        time.sleep(REPLICA_CHECK_SECONDS)
+
+
+def _ensure_checker():
+    # Thread démarré au premier usage dans chaque processus (compatible gunicorn --preload)
+    pid = os.getpid()
+    if _state['pid'] == pid:
+        return
+    with _lock:
+        if _state['pid'] == pid:
+            return
+        for replica in _state['replicas']:
+            replica.lag, replica.error = None, None
+        _state['pid'] = pid
+        _state['checker'] = threading.Thread(target=_checker_loop, args=(pid,), name='replica-lag', daemon=True)
+        _state['checker'].start()
+
+
+def healthy_replicas():
+    return [r for r in _state['replicas'] if r.healthy]
+
+
+def _recent_write():
+    if not has_request_context():
+        return False
+    wrote_at = session.get('db_wrote_at')
+    return wrote_at is not None and time.time() - wrote_at < READ_YOUR_WRITES_SECONDS
+
+
+def read_engine():
+    """Moteur à utiliser pour une lecture, ou None pour le primaire. Choisi une fois par requête."""
+    if not _state['replicas'] or not has_app_context() or not g.get('_read_replica'):
+        return None
+    cached = g.get('_read_engine', _MISSING)
+    if cached is not _MISSING:
+        return cached
+    _ensure_checker()
+    engine = None
+    if _recent_write():
+        target = 'sticky'
+    else:
+        candidates = healthy_replicas()
+        if candidates:
+            engine = candidates[next(_round_robin) % len(candidates)].engine
+            target = 'replica'
+        else:
+            target = 'fallback'
+    metrics.DB_READS.labels(target).inc()
+    g._read_engine = engine
+    return engine
+
+
+def use_primary():
+    """Lire sur le primaire pour le reste de la requête (ex: après une écriture qu'elle doit relire)."""
+    if has_app_context():
+        g._read_engine = None
+
+
+def note_write():
+    """Appelé après chaque flush: la requête courante a écrit sur le primaire."""
+    if has_request_context():
+        g._db_wrote = True
+
+
+def init_app(app, db):
+    names = sorted(k for k in (app.config.get('SQLALCHEMY_BINDS') or {}) if k.startswith('replica_'))
+    if not names:
+        return
+    with app.app_context():
+        _state['primary'] = db.engine
+        _state['replicas'] = [Replica(name, db.engines[name]) for name in names]
+
+    @app.after_request
+    def _remember_write(response):
+        if g.pop('_db_wrote', False):
+            session['db_wrote_at'] = time.time()
+        return response
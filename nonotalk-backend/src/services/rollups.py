@@ -0,0 +1,200 @@
+"""
+Agrégats quotidiens des messages par utilisateur: volume et émotions.
+
+Une ligne de `daily_emotion_stat` par (utilisateur, jour UTC, émotion); ''
+regroupe les messages sans émotion détectée. Chaque flush qui insère des
+messages incrémente les lignes concernées dans la même transaction (UPSERT
+ON CONFLICT, sans lecture préalable ni verrou applicatif), si bien qu'un
+rollback annule aussi les compteurs. `rebuild()` recalcule les agrégats à
+partir des messages (données existantes, imports hors ORM): voir
+backfill_rollups.py. Les conversations archivées (services/archive.py) sont
+comptées depuis leur archive compressée.
+
+Les tendances (`trends()`) ne lisent que les agrégats: une requête dont le
+coût dépend du nombre de jours demandés, pas de l'historique.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import Integer, case, delete, event, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import bindparam
+
+from src.models.routing import RoutingSession
+from src.models.user import db, ArchivedConversation, Conversation, DailyEmotionStat, Message
+from src.services.archive import decode_messages
+
+_upserts = {}
+
+
+def normalize_emotion(emotion):
+    return (emotion or '').strip(' ')[:50]
+
+
+def _upsert_statement(dialect_name):
+    """INSERT ... SELECT user_id FROM conversation ... ON CONFLICT DO UPDATE (compteurs additionnés)."""
+    stmt = _upserts.get(dialect_name)
+    if stmt is not None:
+        return stmt
+    insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(dialect_name)
+    if insert is None:
+        return None
+    table = DailyEmotionStat.__table__
+    source = select(
+        Conversation.user_id,
+        bindparam('r_day'),
+        bindparam('r_emotion'),
+        bindparam('r_user_messages'),
+        bindparam('r_assistant_messages'),
+    ).where(Conversation.id == bindparam('r_conversation_id'))
+    stmt = insert(table).from_select(
+        ['user_id', 'day', 'emotion', 'user_messages', 'assistant_messages'], source
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day, table.c.emotion],
+        set_={
+            'user_messages': table.c.user_messages + stmt.excluded.user_messages,
+            'assistant_messages': table.c.assistant_messages + stmt.excluded.assistant_messages,
+        },
+    )
+    _upserts[dialect_name] = stmt
+    return stmt
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _record_new_messages(session, flush_context):
+    new_messages = [obj for obj in session.new if isinstance(obj, Message)]
+    if not new_messages:
+        return
+    counts = defaultdict(lambda: [0, 0])
+    for message in new_messages:
+        day = (message.timestamp or datetime.utcnow()).date()
+        key = (message.conversation_id, day, normalize_emotion(message.emotion_detected))
+        counts[key][0 if message.is_user else 1] += 1
+    # Toujours le primaire: la session est encore en cours de flush
+    connection = session.connection()
+    stmt = _upsert_statement(connection.dialect.name)
+    if stmt is None:
+        return
+    connection.execute(stmt, [
+        {
+            'r_conversation_id': conversation_id,
+            'r_day': day,
+            'r_emotion': emotion,
+            'r_user_messages': user_count,
+            'r_assistant_messages': assistant_count,
+        }
+        for (conversation_id, day, emotion), (user_count, assistant_count) in counts.items()
+    ])
+
+
+def _archived_counts(conn, user_ids=None, since=None):
+    """Compteurs par (conversation, jour, émotion) des messages archivés (services/archive.py)."""
+    query = select(ArchivedConversation.conversation_id, ArchivedConversation.codec, ArchivedConversation.payload)
+    if user_ids is not None:
+        query = query.join(Conversation, Conversation.id == ArchivedConversation.conversation_id).where(
+            Conversation.user_id.in_(user_ids)
+        )
+    if since is not None:
+        query = query.where(ArchivedConversation.last_timestamp >= datetime.combine(since, datetime.min.time()))
+    counts = defaultdict(lambda: [0, 0])
+    for conversation_id, codec, payload in conn.execution_options(yield_per=100).execute(query):
+        for record in decode_messages(codec, payload):
+            timestamp = record.get('timestamp')
+            if timestamp is None or (since is not None and timestamp.date() < since):
+                continue
+            key = (conversation_id, timestamp.date(), normalize_emotion(record.get('emotion_detected')))
+            counts[key][0 if record.get('is_user') else 1] += 1
+    return counts
+
+
+def rebuild(user_ids=None, since=None):
+    """Recalculer les agrégats (tous les utilisateurs ou `user_ids`, depuis `since` inclus). Retourne le nombre de lignes.
+
+    Les messages archivés ont quitté `message`: ils sont relus depuis leur archive, sans quoi un
+    recalcul effacerait l'historique des conversations archivées.
+    """
+    table = DailyEmotionStat.__table__
+    day = func.date(Message.timestamp)
+    emotion = func.trim(func.coalesce(Message.emotion_detected, ''))
+    aggregate = select(
+        Conversation.user_id,
+        day,
+        emotion,
+        func.sum(case((Message.is_user, 1), else_=0)).cast(Integer),
+        func.sum(case((Message.is_user, 0), else_=1)).cast(Integer),
+    ).join(Conversation, Conversation.id == Message.conversation_id)
+    purge = delete(table)
+    rows = select(func.count()).select_from(table)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        aggregate = aggregate.where(Conversation.user_id.in_(user_ids))
+        purge = purge.where(table.c.user_id.in_(user_ids))
+        rows = rows.where(table.c.user_id.in_(user_ids))
+    if since is not None:
+        aggregate = aggregate.where(Message.timestamp >= datetime.combine(since, datetime.min.time()))
+        purge = purge.where(table.c.day >= since)
+        rows = rows.where(table.c.day >= since)
+    aggregate = aggregate.group_by(Conversation.user_id, day, emotion)
+
+    with db.engine.begin() as conn:
+        conn.execute(purge)
+        conn.execute(table.insert().from_select(
+            ['user_id', 'day', 'emotion', 'user_messages', 'assistant_messages'], aggregate
+        ))
+        archived = _archived_counts(conn, user_ids, since)
+        stmt = _upsert_statement(conn.dialect.name)
+        if archived and stmt is not None:
+            conn.execute(stmt, [
+                {
+                    'r_conversation_id': conversation_id,
+                    'r_day': day,
+                    'r_emotion': emotion,
+                    'r_user_messages': user_count,
+                    'r_assistant_messages': assistant_count,
+                }
+                for (conversation_id, day, emotion), (user_count, assistant_count) in archived.items()
+            ])
+        return conn.execute(rows).scalar()
+
+
+def trends(user_id, days=30, today=None):
+    """Série quotidienne (jours sans message inclus) et totaux sur les `days` derniers jours."""
+    today = today or datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+    rows = db.session.execute(
+        select(
+            DailyEmotionStat.day, DailyEmotionStat.emotion,
+            DailyEmotionStat.user_messages, DailyEmotionStat.assistant_messages,
+        ).where(DailyEmotionStat.user_id == user_id, DailyEmotionStat.day >= start)
+    ).all()
+
+    per_day = defaultdict(lambda: {'user_messages': 0, 'assistant_messages': 0, 'emotions': Counter()})
+    totals = Counter()
+    for day, emotion, user_messages, assistant_messages in rows:
+        bucket = per_day[day]
+        bucket['user_messages'] += user_messages
+        bucket['assistant_messages'] += assistant_messages
+        if emotion:
+            bucket['emotions'][emotion] += user_messages
+            totals[emotion] += user_messages
+
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        bucket = per_day.get(day)
+        series.append({
+            'day': day.isoformat(),
+            'user_messages': bucket['user_messages'] if bucket else 0,
+            'assistant_messages': bucket['assistant_messages'] if bucket else 0,
+            'emotions': dict(bucket['emotions']) if bucket else {},
+        })
+    return {
+        'from': start.isoformat(),
+        'to': today.isoformat(),
+        'days': series,
+        'emotions': dict(totals.most_common()),
+        'dominant_emotion': totals.most_common(1)[0][0] if totals else None,
+        'active_days': sum(1 for bucket in per_day.values() if bucket['user_messages']),
+        'user_messages': sum(bucket['user_messages'] for bucket in per_day.values()),
+    }
@@ -0,0 +1,178 @@
+"""
+Détection de crise: mots-clés en ligne + classifieur en parallèle de la réponse.
+
+Deux étages pour chaque tour (texte envoyé, /send-stream, transcription
+speech-to-text, image):
+
+- les mots-clés (CRISIS_KEYWORDS) sont vérifiés en ligne, avant tout appel au
+  modèle: coût nul, réponse d'urgence immédiate;
+- le classifieur (endpoint de modération OpenAI, SAFETY_CLASSIFIER_MODEL,
+  catégories self-harm) est lancé dans un pool de threads au même moment que
+  la génération. Le stream part sans l'attendre (time-to-first-token
+  inchangé); le thread de génération consulte le résultat entre deux chunks
+  et, s'il signale le tour, bascule sur le message d'urgence. À la fin du
+  stream, le résultat est attendu au plus SAFETY_CLASSIFIER_TIMEOUT secondes
+  avant l'enregistrement: aucun tour n'échappe au classifieur tant qu'il
+  répond.
+
+SAFETY_CLASSIFIER_MODEL vide désactive le classifieur (mots-clés seuls), de
+même qu'une clé OpenAI absente. En cas d'erreur ou de délai dépassé, le tour
+passe (les mots-clés ont déjà été vérifiés) et la métrique
+nonotalk_safety_classifier_seconds{outcome="error"|"timeout"} le signale.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+
+from sqlalchemy import false
+
+from src.models.user import db, CrisisAlert
+from src.services import metrics
+from src.services.logs import get_logger
+from src.services.openai_pool import OPENAI_API_KEY, get_openai_client
+
+# Mots-clés de crise
+CRISIS_KEYWORDS = os.getenv('CRISIS_KEYWORDS', 'suicide,envie d\'en finir,je veux mourir,plus envie de vivre').split(',')
+SAFETY_CLASSIFIER_MODEL = os.getenv('SAFETY_CLASSIFIER_MODEL', 'omni-moderation-latest').strip()
+SAFETY_CLASSIFIER_TIMEOUT = float(os.getenv('SAFETY_CLASSIFIER_TIMEOUT', '3'))
+SAFETY_CLASSIFIER_WORKERS = int(os.getenv('SAFETY_CLASSIFIER_WORKERS', '4'))
+# Score self-harm au-delà duquel le tour est signalé même si la modération ne le marque pas
+SAFETY_SELF_HARM_THRESHOLD = float(os.getenv('SAFETY_SELF_HARM_THRESHOLD', '0.5'))
+# Une même alerte (même utilisateur, même contenu, non résolue) n'est enregistrée qu'une fois sur cette fenêtre
+SAFETY_ALERT_DEDUP_SECONDS = float(os.getenv('SAFETY_ALERT_DEDUP_SECONDS', '600'))
+
+log = get_logger('safety')
+
+SELF_HARM_CATEGORIES = ('self_harm', 'self_harm_intent', 'self_harm_instructions')
+
+EMERGENCY_MESSAGE = """🆘 Je suis là pour t'écouter, mais si tu es en danger, contacte immédiatement :
+📞 112
+☎️ SOS Suicide : 01 45 39 40 00 (gratuit, 24h/24)"""
+
+SAFETY_CLASSIFIER_SECONDS = metrics.histogram(
+    'nonotalk_safety_classifier_seconds', "Durée du classifieur de crise", ('outcome',)
+)
+CRISIS_DETECTIONS = metrics.counter(
+    'nonotalk_crisis_detections_total', "Tours signalés comme crise", ('source', 'entry_point')
+)
+
+
+def detect_crisis(message_content):
+    """Détecter les mots-clés de crise dans un message"""
+    message_lower = (message_content or '').lower()
+    for keyword in CRISIS_KEYWORDS:
+        keyword = keyword.strip().lower()
+        if keyword and keyword in message_lower:
+            return True
+    return False
+
+
+def classifier_enabled():
+    return bool(SAFETY_CLASSIFIER_MODEL) and bool(OPENAI_API_KEY) and OPENAI_API_KEY != 'sk-fake-key'
+
+
+def classify(text=None, image_url=None):
+    """Appel bloquant au classifieur: True si signalé, False sinon (exceptions propagées)."""
+    if image_url:
+        payload = [{'type': 'image_url', 'image_url': {'url': image_url}}]
+        if text:
+            payload.insert(0, {'type': 'text', 'text': text})
+    else:
+        payload = text
+    response = get_openai_client().moderations.create(model=SAFETY_CLASSIFIER_MODEL, input=payload)
+    for result in response.results:
+        categories = result.categories
+        scores = result.category_scores
+        for name in SELF_HARM_CATEGORIES:
+            if getattr(categories, name, False) or (getattr(scores, name, 0) or 0) >= SAFETY_SELF_HARM_THRESHOLD:
+                return True
+    return False
+
+
+# Pool recréé après un fork (comme le client httpx de openai_pool)
+_pool_lock = threading.Lock()
+_pool_state = {'pid': None, 'pool': None}
+
+
+def _pool():
+    pid = os.getpid()
+    if _pool_state['pid'] == pid:
+        return _pool_state['pool']
+    with _pool_lock:
+        if _pool_state['pid'] != pid:
+            _pool_state['pool'] = ThreadPoolExecutor(SAFETY_CLASSIFIER_WORKERS, thread_name_prefix='safety')
+            _pool_state['pid'] = pid
+    return _pool_state['pool']
+
+
+def _timed_classify(text, image_url):
+    started = time.perf_counter()
+    try:
+        flagged = classify(text, image_url)
+    except Exception as e:
+        SAFETY_CLASSIFIER_SECONDS.labels('error').observe(time.perf_counter() - started)
+        log.warning('classifieur indisponible: %s: %s', type(e).__name__, e)
+        return None
+    SAFETY_CLASSIFIER_SECONDS.labels('flagged' if flagged else 'ok').observe(time.perf_counter() - started)
+    return flagged
+
+
+class SafetyCheck:
+    """Classification d'un tour lancée en arrière-plan; interrogée sans bloquer pendant la génération."""
+
+    def __init__(self, text=None, image_url=None):
+        self.future = None
+        if classifier_enabled() and (text or image_url):
+            self.future = _pool().submit(_timed_classify, text, image_url)
+
+    def flagged_now(self):
+        """True si le classifieur a déjà répondu et signalé le tour (jamais bloquant)."""
+        return self.future is not None and self.future.done() and self.future.result() is True
+
+    def wait(self, timeout=SAFETY_CLASSIFIER_TIMEOUT):
+        """Attendre le verdict au plus `timeout` s: True / False, None si indisponible ou trop lent."""
+        if self.future is None:
+            return None
+        try:
+            return self.future.result(timeout=timeout)
+        except FutureTimeout:
+            SAFETY_CLASSIFIER_SECONDS.labels('timeout').observe(timeout)
+            return None
+
+
+def record_alert(user_id, message_content, source, entry_point):
+    """Ajouter une CrisisAlert à la session (commit par l'appelant), sauf doublon récent non résolu."""
+    CRISIS_DETECTIONS.labels(source, entry_point).inc()
+    since = datetime.utcnow() - timedelta(seconds=SAFETY_ALERT_DEDUP_SECONDS)
+    duplicate = db.session.query(CrisisAlert.id).filter(
+        CrisisAlert.user_id == user_id, CrisisAlert.resolved == false(),
+        CrisisAlert.message_content == message_content, CrisisAlert.timestamp >= since,
+    ).first()
+    if duplicate is not None:
+        return None
+    alert = CrisisAlert(user_id=user_id, message_content=message_content, source=source)
+    db.session.add(alert)
+    return alert
+
+
+def record_alert_when_flagged(app, check, user_id, message_content, entry_point):
+    """Enregistrer l'alerte dès que le classifieur signale le tour, sans bloquer la requête en cours."""
+    if check.future is None:
+        return
+
+    def on_result(future):
+        if future.result() is not True:
+            return
+        with app.app_context():
+            try:
+                record_alert(user_id, message_content, 'classifier', entry_point)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                log.exception('alerte de crise non enregistrée')
+            finally:
+                db.session.remove()
+
+    check.future.add_done_callback(on_result)
@@ -0,0 +1,368 @@
+"""
+Recherche plein texte dans l'historique d'un utilisateur.
+
+Deux moteurs selon la base:
+- Postgres: colonne `message.search_vector` (to_tsvector('french', content))
+  tenue à jour par trigger, et index GIN. Classement ts_rank_cd, extraits
+  ts_headline calculés pour la page seulement. La colonne et l'index sont
+  posés par une migration en ligne séparée (migrate_search_index.py: colonne
+  nullable, remplissage par lots, CREATE INDEX CONCURRENTLY), jamais dans la
+  transaction de déploiement; tant que l'index n'est pas valide, LIKE.
+- SQLite: table FTS5 `message_fts` à contenu externe (tokenizer unicode61
+  sans accents), tenue à jour par triggers; classement bm25, extraits snippet().
+Autre base ou SQLite sans FTS5: LIKE, tri par date uniquement.
+
+Le moteur est déterminé une fois par processus (init_app, ou
+ensure_search_index quand il crée l'index), jamais pendant une requête: les
+routes de recherche gardent leur budget d'une requête. Une fois la migration
+Postgres terminée, les workers passent à l'index à leur prochain démarrage.
+
+Pagination par curseur (keyset) sur (score, id) ou id: le coût d'une page ne
+dépend pas de sa position. Les extraits sont échappés en HTML et les termes
+trouvés entourés de <mark>.
+"""
+import base64
+import html
+import json
+import os
+import re
+import time
+
+from sqlalchemy import DateTime, text
+
+from src.models.user import db
+from src.services.logs import get_logger
+
+# Délimiteurs de la zone privée Unicode: survivent à ts_headline / snippet puis deviennent <mark>
+_MARK_START = '\ue000'
+_MARK_END = '\ue001'
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+HEADLINE_OPTIONS = f'StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=24, MinWords=8, MaxFragments=2'
+
+SEARCH_INDEX_BATCH_SIZE = int(os.getenv('SEARCH_INDEX_BATCH_SIZE', '5000'))
+
+log = get_logger('search')
+
+_backends = {}
+
+
+class InvalidCursor(ValueError):
+    """Curseur de pagination illisible ou d'un autre tri."""
+
+
+def detect_backend(engine):
+    """'postgresql' (index GIN valide), 'fts5' ou 'like', lu dans le catalogue de la base."""
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            ready = conn.execute(text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = 'ix_message_search' AND i.indisvalid"
+            )).first()
+            return 'postgresql' if ready else 'like'
+        if engine.dialect.name == 'sqlite':
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+            )).first()
+            return 'fts5' if exists else 'like'
+    return 'like'
+
+
+def search_backend(engine):
+    """Moteur déterminé au démarrage; 'like' si la détection n'a pas pu se faire (aucune requête ici)."""
+    return _backends.get(engine, 'like')
+
+
+def init_app(app, db):
+    """Déterminer le moteur de recherche de chaque bind (primaire et réplicas) avant les requêtes."""
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        try:
+            _backends[engine] = detect_backend(engine)
+        except Exception as e:
+            log.warning('moteur de recherche indéterminé, LIKE: %s: %s', type(e).__name__, e)
+
+
+def ensure_search_index(engine):
+    """SQLite: créer la table FTS5 et ses triggers (idempotent). Appelé par ensure_schema().
+
+    Postgres: rien ici, voir migrate_search_index() (migration en ligne, hors déploiement).
+    """
+    if engine.dialect.name != 'sqlite':
+        _backends[engine] = detect_backend(engine)
+        return
+    with engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+        )).first()
+        if exists:
+            _backends[engine] = 'fts5'
+            return
+        try:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE message_fts USING fts5("
+                "content, content='message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            ))
+        except Exception as e:
+            log.warning('FTS5 indisponible, recherche en LIKE: %s', e)
+            _backends[engine] = 'like'
+            return
+        conn.execute(text(
+            "CREATE TRIGGER message_fts_ai AFTER INSERT ON message BEGIN "
+            "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER message_fts_ad AFTER DELETE ON message BEGIN "
+            "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER message_fts_au AFTER UPDATE OF content ON message BEGIN "
+            "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+            "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END"
+        ))
+        # Messages déjà présents
+        conn.execute(text("INSERT INTO message_fts(message_fts) VALUES ('rebuild')"))
+    _backends[engine] = 'fts5'
+
+
+# Trigger plutôt que colonne GENERATED ... STORED: l'ajout d'une colonne générée réécrit toute la table
+# sous verrou ACCESS EXCLUSIVE, une colonne nullable sans défaut est un simple changement de catalogue
+SEARCH_VECTOR_TRIGGER_SQL = (
+    "CREATE OR REPLACE FUNCTION message_search_vector_update() RETURNS trigger AS $$ BEGIN "
+    "NEW.search_vector := to_tsvector('french', coalesce(NEW.content, '')); RETURN NEW; END $$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS message_search_vector ON message",
+    "CREATE TRIGGER message_search_vector BEFORE INSERT OR UPDATE OF content ON message "
+    "FOR EACH ROW EXECUTE FUNCTION message_search_vector_update()",
+)
+
+
+def migrate_search_index(engine, batch_size=SEARCH_INDEX_BATCH_SIZE, lock_timeout='5s', report=print):
+    """Postgres: poser search_vector et l'index GIN sans bloquer l'application (reprend là où elle s'est arrêtée).
+
+    1. colonne nullable + trigger (changement de catalogue, verrou bref borné par lock_timeout);
+    2. remplissage par lots d'identifiants, une transaction par lot;
+    3. CREATE INDEX CONCURRENTLY (par partition si `message` est partitionnée).
+    """
+    if engine.dialect.name != 'postgresql':
+        raise ValueError('migration réservée à Postgres (SQLite: ensure_schema crée la table FTS5)')
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        generated = conn.execute(text(
+            "SELECT attgenerated FROM pg_attribute "
+            "WHERE attrelid = 'message'::regclass AND attname = 'search_vector' AND NOT attisdropped"
+        )).first()
+    # Colonne générée d'un déploiement antérieur: déjà tenue à jour par Postgres, rien à remplir
+    if generated is None or not generated.attgenerated:
+        with engine.begin() as conn:
+            conn.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+            conn.execute(text("ALTER TABLE message ADD COLUMN IF NOT EXISTS search_vector tsvector"))
+            for statement in SEARCH_VECTOR_TRIGGER_SQL:
+                conn.execute(text(statement))
+        report('colonne search_vector et trigger en place')
+        _backfill_search_vector(engine, batch_size, report)
+    _create_search_index(engine, report)
+    _backends[engine] = detect_backend(engine)
+    report(f'index de recherche prêt en {time.perf_counter() - started:.1f} s')
+
+
+def _backfill_search_vector(engine, batch_size, report):
+    with engine.connect() as conn:
+        high = conn.execute(text("SELECT max(id) FROM message")).scalar()
+    if high is None:
+        return
+    after = 0
+    total = 0
+    while after < high:
+        # Les messages écrits pendant le remplissage passent par le trigger
+        with engine.begin() as conn:
+            upper = conn.execute(text(
+                "SELECT max(id) FROM (SELECT id FROM message WHERE id > :after ORDER BY id LIMIT :batch) s"
+            ), {'after': after, 'batch': batch_size}).scalar()
+            if upper is None:
+                break
+            total += conn.execute(text(
+                "UPDATE message SET search_vector = to_tsvector('french', coalesce(content, '')) "
+                "WHERE id > :after AND id <= :upper AND search_vector IS NULL"
+            ), {'after': after, 'upper': upper}).rowcount
+        after = upper
+        report(f'  messages jusqu\'à {after}/{high}: {total} remplis')
+
+
+def _create_search_index(engine, report):
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        valid = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = 'ix_message_search'"
+        )).scalar()
+        if valid:
+            return
+        partitions = conn.execute(text(
+            "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'message'::regclass"
+        )).scalars().all()
+        if not partitions:
+            if valid is False:
+                # Reste d'un CREATE INDEX CONCURRENTLY interrompu
+                conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_message_search"))
+            conn.execute(text("CREATE INDEX CONCURRENTLY ix_message_search ON message USING GIN (search_vector)"))
+            report('index ix_message_search créé')
+            return
+        # Table partitionnée: index parent ON ONLY (invalide), index de chaque partition en CONCURRENTLY, rattachés
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_message_search ON ONLY message USING GIN (search_vector)"))
+        for partition in partitions:
+            name = f'{partition}_search_idx'
+            partition_valid = conn.execute(text(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+            ), {'name': name}).scalar()
+            if partition_valid is False:
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+            conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON {partition} USING GIN (search_vector)'))
+            attached = conn.execute(text(
+                "SELECT 1 FROM pg_inherits WHERE inhrelid = CAST(:name AS regclass) "
+                "AND inhparent = 'ix_message_search'::regclass"
+            ), {'name': name}).first()
+            if not attached:
+                conn.execute(text(f'ALTER INDEX ix_message_search ATTACH PARTITION "{name}"'))
+            report(f'index de {partition} créé')
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    expected = 2 if order == 'rank' else 1
+    if not isinstance(values, list) or len(values) != expected or not all(
+            isinstance(v, (int, float)) for v in values):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def _fts5_query(q):
+    # Chaque mot entre guillemets: la syntaxe FTS5 (NEAR, -, ^...) n'est pas exposée aux utilisateurs
+    tokens = _TOKEN.findall(q)
+    return ' '.join('"' + t.replace('"', '""') + '"' for t in tokens)
+
+
+def _render_snippet(raw):
+    escaped = html.escape(raw or '', quote=False)
+    return escaped.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _like_snippet(content, tokens, width=160):
+    lowered = content.lower()
+    positions = [lowered.find(t.lower()) for t in tokens if lowered.find(t.lower()) >= 0]
+    start = max(0, min(positions) - width // 3) if positions else 0
+    excerpt = content[start:start + width]
+    marked = html.escape(excerpt, quote=False)
+    for token in sorted(set(tokens), key=len, reverse=True):
+        marked = re.sub(f'({re.escape(html.escape(token, quote=False))})', r'<mark>\1</mark>', marked, flags=re.IGNORECASE)
+    return ('…' if start else '') + marked + ('…' if start + width < len(content) else '')
+
+
+def search_messages(user_id, q, limit=20, cursor=None, order='rank'):
+    """Messages de l'utilisateur correspondant à `q`: (résultats, curseur suivant ou None)."""
+    engine = db.session.get_bind()
+    backend = search_backend(engine)
+    if backend == 'like':
+        order = 'recent'
+    after = decode_cursor(cursor, order) if cursor else None
+    params = {'user_id': user_id, 'limit': limit + 1}
+
+    if backend == 'postgresql':
+        page_filter = ''
+        if after and order == 'rank':
+            page_filter = 'AND (s.score < :after_score OR (s.score = :after_score AND s.id < :after_id))'
+            params.update(after_score=after[0], after_id=after[1])
+        elif after:
+            page_filter = 'AND s.id < :after_id'
+            params['after_id'] = after[0]
+        order_sql = 's.score DESC, s.id DESC' if order == 'rank' else 's.id DESC'
+        # Le classement s'applique aux seuls messages de l'utilisateur; ts_headline (coûteux) à la page seulement
+        sql = f"""
+            WITH query AS (SELECT websearch_to_tsquery('french', :q) AS tsq),
+            scored AS (
+                SELECT m.id, m.conversation_id, c.title, m.timestamp, m.is_user, m.content,
+                       ts_rank_cd(m.search_vector, query.tsq)::float8 AS score
+                FROM message m
+                JOIN conversation c ON c.id = m.conversation_id
+                CROSS JOIN query
+                WHERE c.user_id = :user_id AND c.deleted_at IS NULL AND m.search_vector @@ query.tsq
+            ),
+            page AS (
+                SELECT * FROM scored s WHERE true {page_filter} ORDER BY {order_sql} LIMIT :limit
+            )
+            SELECT s.id, s.conversation_id, s.title, s.timestamp, s.is_user, s.score,
+                   ts_headline('french', s.content, query.tsq, :headline) AS snippet
+            FROM page s CROSS JOIN query
+            ORDER BY {order_sql}
+        """
+        params.update(q=q, headline=HEADLINE_OPTIONS)
+    elif backend == 'fts5':
+        match = _fts5_query(q)
+        if not match:
+            return [], None
+        page_filter = ''
+        if after and order == 'rank':
+            page_filter = 'AND (s.score < :after_score OR (s.score = :after_score AND s.id < :after_id))'
+            params.update(after_score=after[0], after_id=after[1])
+        elif after:
+            page_filter = 'AND s.id < :after_id'
+            params['after_id'] = after[0]
+        order_sql = 's.score DESC, s.id DESC' if order == 'rank' else 's.id DESC'
+        sql = f"""
+            SELECT * FROM (
+                SELECT m.id, m.conversation_id, c.title, m.timestamp, m.is_user,
+                       -bm25(message_fts) AS score,
+                       snippet(message_fts, 0, char(57344), char(57345), '…', 20) AS snippet
+                FROM message_fts
+                JOIN message m ON m.id = message_fts.rowid
+                JOIN conversation c ON c.id = m.conversation_id
+                WHERE message_fts MATCH :match AND c.user_id = :user_id AND c.deleted_at IS NULL
+            ) s
+            WHERE 1 = 1 {page_filter}
+            ORDER BY {order_sql}
+            LIMIT :limit
+        """
+        params['match'] = match
+    else:
+        tokens = _TOKEN.findall(q)
+        if not tokens:
+            return [], None
+        conditions = ' AND '.join(f'lower(m.content) LIKE :t{i}' for i in range(len(tokens)))
+        params.update({f't{i}': f'%{t.lower()}%' for i, t in enumerate(tokens)})
+        page_filter = ''
+        if after:
+            page_filter = 'AND m.id < :after_id'
+            params['after_id'] = after[0]
+        sql = f"""
+            SELECT m.id, m.conversation_id, c.title, m.timestamp, m.is_user, 0.0 AS score, m.content AS snippet
+            FROM message m JOIN conversation c ON c.id = m.conversation_id
+            WHERE c.user_id = :user_id AND c.deleted_at IS NULL AND {conditions} {page_filter}
+            ORDER BY m.id DESC
+            LIMIT :limit
+        """
+
+    rows = db.session.execute(text(sql).columns(timestamp=DateTime), params).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    tokens = _TOKEN.findall(q) if backend == 'like' else None
+    results = [{
+        'message_id': row.id,
+        'conversation_id': row.conversation_id,
+        'conversation_title': row.title,
+        'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+        'is_user': bool(row.is_user),
+        'score': round(float(row.score), 6),
+        'snippet': _like_snippet(row.snippet or '', tokens) if tokens else _render_snippet(row.snippet),
+    } for row in rows]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor([float(last.score), last.id] if order == 'rank' else [last.id])
+    return results, next_cursor
@@ -0,0 +1,76 @@
+"""
+Sérialisation rapide des réponses volumineuses et GET conditionnels.
+
+- `dumps()`: orjson s'il est installé (datetime natif, UTF-8 direct, plusieurs
+  fois plus rapide que json), sinon json de la bibliothèque standard avec le
+  même format de sortie.
+- `json_response()`: réponse JSON construite à partir de `dumps()` au lieu de
+  jsonify, avec ETag faible optionnel.
+- `weak_etag()` / `not_modified()`: un ETag faible est dérivé d'un petit
+  validateur lu en base (ex: updated_at de la conversation et id du dernier
+  message); si le client présente le même dans If-None-Match, la route répond
+  304 sans charger les lignes.
+
+Les routes qui s'en servent lisent des colonnes (`select(Message.id, ...)`)
+plutôt que des objets ORM et assemblent les dictionnaires avec `rows_to_dicts`.
+"""
+import hashlib
+import json
+from datetime import date, datetime
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:  # optionnel: repli sur json
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson else 'json'
+
+# Réponses par utilisateur: le navigateur peut les garder mais doit revalider (If-None-Match)
+CACHE_CONTROL = 'private, no-cache'
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} non sérialisable en JSON')
+
+
+def dumps(payload):
+    """Encoder en JSON UTF-8 (bytes)."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def rows_to_dicts(keys, rows):
+    """Lignes de colonnes (tuples) -> dictionnaires, sans construire d'objets ORM."""
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def weak_etag(*parts):
+    """Étiquette (non quotée) d'un validateur: ne révèle rien des valeurs qui la composent."""
+    raw = '|'.join('' if p is None else (p.isoformat() if isinstance(p, (datetime, date)) else str(p)) for p in parts)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def _conditional_headers(response, etag):
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag):
+    """Réponse 304 si If-None-Match correspond à `etag` (comparaison faible), sinon None."""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return _conditional_headers(Response(status=304), etag)
+
+
+def json_response(payload, status=200, etag=None):
+    response = Response(dumps(payload), status=status, mimetype='application/json')
+    if etag is not None:
+        _conditional_headers(response, etag)
+    return response
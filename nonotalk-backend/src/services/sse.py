@@ -0,0 +1,95 @@
+"""
+Étage de sortie SSE: regroupement adaptatif des deltas et trames compactes.
+
+Plutôt qu'une trame `data:` (et un json.dumps) par token, les deltas d'une
+génération sont regroupés par fenêtre de temps/taille (SSE_COALESCE_MS /
+SSE_COALESCE_BYTES). Le premier delta part immédiatement pour ne pas dégrader
+le time-to-first-token; les autres évènements (start, done, error...) vident
+la fenêtre et partent tout de suite. Des commentaires de heartbeat remplacent
+l'ancien padding fixe de 2 Ko.
+"""
+import json
+import os
+import time
+
+COALESCE_MS = float(os.getenv('SSE_COALESCE_MS', '30'))
+COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', '64'))
+HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+# Encodeur préalloué, séparateurs compacts
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+HEARTBEAT_FRAME = ": hb\n\n"
+# Premier octet envoyé immédiatement: les proxys ouvrent le flux sans attendre le premier token
+OPEN_FRAME = ": ok\n\n"
+
+
+def encode_frame(payload, seq=None):
+    """Trame SSE: `data:` en premier (le front lit data: puis id:), `id:` pour Last-Event-ID."""
+    if seq is None:
+        return f"data: {_encode(payload)}\n\n"
+    return f"data: {_encode(payload)}\nid: {seq}\n\n"
+
+
+def coalesced_frames(gen, last_event_id=0, window_ms=COALESCE_MS, max_bytes=COALESCE_BYTES,
+                     heartbeat=HEARTBEAT_SECONDS):
+    """Générateur de trames SSE pour une génération, à partir de `last_event_id`."""
+    window = window_ms / 1000.0
+    cursor = last_event_id
+    pending = []
+    pending_bytes = 0
+    pending_seq = None
+    deadline = None
+    first_delta_sent = False
+
+    def flush():
+        nonlocal pending, pending_bytes, pending_seq, deadline
+        frame = encode_frame({'type': 'delta', 'content': ''.join(pending)}, pending_seq)
+        pending, pending_bytes, pending_seq, deadline = [], 0, None, None
+        return frame
+
+    yield OPEN_FRAME
+    last_write = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if deadline is not None:
+            timeout = max(0.0, deadline - now)
+        else:
+            timeout = max(0.0, heartbeat - (now - last_write))
+        events, finished = gen.read_after(cursor, timeout=timeout)
+
+        out = []
+        now = time.monotonic()
+        for seq, payload in events:
+            cursor = max(cursor, seq)
+            if payload.get('type') == 'delta':
+                content = payload.get('content') or ''
+                if not first_delta_sent:
+                    out.append(encode_frame(payload, seq))
+                    first_delta_sent = True
+                    continue
+                pending.append(content)
+                pending_bytes += len(content)
+                pending_seq = seq
+                if deadline is None:
+                    deadline = now + window
+                if pending_bytes >= max_bytes:
+                    out.append(flush())
+            else:
+                if pending:
+                    out.append(flush())
+                out.append(encode_frame(payload, seq))
+
+        if pending and (finished or now >= deadline):
+            out.append(flush())
+
+        if out:
+            # Une seule écriture pour toutes les trames prêtes
+            yield ''.join(out)
+            last_write = now
+        elif now - last_write >= heartbeat:
+            yield HEARTBEAT_FRAME
+            last_write = now
+
+        if finished and not pending and cursor >= gen.last_seq:
+            return
@@ -0,0 +1,40 @@
+"""
+Application Flask minimale pour les scripts (init_db.py, archive_messages.py...).
+
+Les scripts NE DOIVENT PAS importer src.main (routes, LangChain, threads des
+services): ils n'ont besoin que de SQLAlchemy. L'URL et les arguments de
+connexion passent par les mêmes fonctions que l'application
+(services/db_pool.py: driver psycopg, sslmode / PGSSLMODE, PgBouncer), si
+bien qu'une base que l'application atteint est aussi atteinte par le script
+de schéma du déploiement. Pas de pool dimensionné ni instrumenté: un script
+n'utilise qu'une connexion à la fois.
+"""
+import os
+
+from dotenv import load_dotenv
+from flask import Flask
+
+from src.models.user import db
+from src.services.db_pool import connect_args, normalize_database_url
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def create_app(database_url=None) -> Flask:
+    """Application Flask configurée uniquement pour SQLAlchemy (DATABASE_URL du .env par défaut)."""
+    load_dotenv(os.path.join(PROJECT_ROOT, ".env"))
+    database_url = normalize_database_url(database_url or os.getenv("DATABASE_URL"))
+    if not database_url:
+        raise RuntimeError(
+            "DATABASE_URL est manquante: ajoutez-la dans le fichier .env à la racine du projet "
+            "(ou passez --database-url)."
+        )
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    args = connect_args(database_url)
+    if args:
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"connect_args": args}
+    db.init_app(app)
+    return app
@@ -0,0 +1,72 @@
+"""
+Démarrage des workers: imports lourds différés et partage copy-on-write.
+
+Sans préchargement, chaque worker n'importe LangChain / le SDK OpenAI qu'au
+premier appel qui en a besoin (voir routes/chat.py et services/openai_pool.py):
+import de src.main plus rapide, RSS plus faible tant que la route n'est pas
+utilisée.
+
+Avec `gunicorn --preload` et PRELOAD_APP=1, c'est l'inverse: le maître importe
+tout une fois, puis gèle le tas (gc.freeze) pour que le ramasse-miettes des
+workers ne réécrive pas les en-têtes d'objets hérités; les pages restent
+partagées entre workers au lieu d'être copiées. Rien ne doit ouvrir de
+socket ni démarrer de thread avant le fork: les clients HTTP et le pinger
+keep-alive sont créés par processus, et le pool SQLAlchemy est vidé dans
+l'enfant.
+
+À l'arrêt (SIGTERM d'un déploiement), le worker passe en "draining":
+/api/ready répond 503 pendant que les réponses en cours se terminent.
+"""
+import gc
+import importlib
+import os
+import threading
+import time
+
+# Modules importés à la demande par les routes; préchargés dans le maître avec --preload
+HEAVY_MODULES = ('openai', 'langchain_openai', 'langchain_core.messages')
+
+
+def preload_enabled():
+    return os.getenv('PRELOAD_APP', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def warm_imports():
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+def dispose_pool_after_fork(engine):
+    """Ne jamais partager les connexions du pool entre le maître et les workers."""
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+
+def prepare_preload():
+    """À appeler dans le maître, après l'import complet de l'application et avant le fork."""
+    warm_imports()
+    gc.collect()
+    gc.freeze()
+
+
+_draining = threading.Event()
+_drain_started = [None]
+
+
+def begin_drain():
+    if not _draining.is_set():
+        _drain_started[0] = time.monotonic()
+        _draining.set()
+
+
+def draining():
+    return _draining.is_set()
+
+
+def drain_elapsed():
+    """Secondes écoulées depuis le début de l'arrêt gracieux (0 si aucun)."""
+    started = _drain_started[0]
+    return 0.0 if started is None else time.monotonic() - started
@@ -332,6 +332,8 @@ export default function ChatPage() {
     setIsLoading(true)
     try {
       const streamUrl = `${API_URL}/chat/conversations/${convId}/send-stream`
+      // Un retry réseau du même envoi ne relance pas la génération côté serveur
+      const idempotencyKey = window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`
 
       const res = await fetch(streamUrl, {
         method: 'POST',
@@ -339,7 +341,8 @@ export default function ChatPage() {
         headers: { 
           'Content-Type': 'application/json',
           'Accept': 'text/event-stream',
-          'Cache-Control': 'no-cache'
+          'Cache-Control': 'no-cache',
+          'Idempotency-Key': idempotencyKey
         },
         credentials: 'include',
         body: JSON.stringify({ message: messageContent, emotion })
@@ -350,9 +353,7 @@ export default function ChatPage() {
         return await sendMessage(messageContent, emotion, convId)
       }
 
-      const reader = res.body.getReader()
       const decoder = new TextDecoder()
-      let sseBuffer = ''
       let fullText = ''
       let firstSentenceSpoken = false
       let firstSentenceLength = 0
@@ -409,58 +410,103 @@ export default function ChatPage() {
         }
       }
 
-      while (true) {
-        const { done, value } = await reader.read()
-        if (done) break
-        const chunk = decoder.decode(value, { stream: true })
-        sseBuffer += chunk
-
-        const events = sseBuffer.split('\n\n')
-        sseBuffer = events.pop() || ''
-        for (const evt of events) {
-          const line = evt.trim()
-          if (!line.startsWith('data:')) continue
-          const payload = line.slice(5).trim()
-          if (!payload) continue
-          let data
+      // Lecture d'un flux SSE (champs data:/id: ligne par ligne)
+      let generationId = null
+      let lastEventId = 0
+      let finished = false
+      let crisis = false
+      const handleEvent = (data) => {
+        if (data.type === 'start' && data.generation_id) {
+          generationId = data.generation_id
+        } else if (data.type === 'snapshot') {
+          // Reprise après éviction du tampon serveur: texte cumulé jusque-là
+          fullText = data.content || ''
+        } else if (data.type === 'delta' && data.content) {
+          fullText += data.content
+          trySpeakImmediateFirst()
+          trySpeakNewSentences()
+        } else if (data.type === 'crisis') {
+          // Tour signalé par le backend: la réponse est remplacée par le message d'urgence
+          crisis = true
+          setCrisisAlert(data.emergency_message)
+        } else if (data.type === 'done') {
+          finished = true
+          if (fallbackTimer) {
+            clearTimeout(fallbackTimer)
+            fallbackTimer = null
+          }
+          // MAJ UI + quota
           try {
-            data = JSON.parse(payload)
-          } catch {
-            continue
+            setMessages(prev => {
+              const next = [...prev, data.user_message, data.ai_message]
+              try {
+                localStorage.setItem(`recentMessages:${convId}`, JSON.stringify(next.slice(-10)))
+              } catch {}
+              return next
+            })
+            if (user) updateUser({ ...user, quota_remaining: data.quota_remaining })
+          } catch (e) {
+            console.warn('[ChatPage] MAJ UI post-stream échouée', e)
           }
 
-          if (data.type === 'delta' && data.content) {
-            fullText += data.content
-            trySpeakImmediateFirst()
-            trySpeakNewSentences()
-          } else if (data.type === 'done') {
-            if (fallbackTimer) {
-              clearTimeout(fallbackTimer)
-              fallbackTimer = null
+          // Lire le reste du texte non encore joué (rien après un message d'urgence)
+          const remaining = crisis ? '' : fullText.slice(lastSpokenIndex).trim()
+          if (remaining) {
+            speakText(remaining)
+            lastSpokenIndex = fullText.length
+          }
+        }
+      }
+      const consume = async (body) => {
+        const reader = body.getReader()
+        let sseBuffer = ''
+        while (true) {
+          const { done, value } = await reader.read()
+          if (done) break
+          sseBuffer += decoder.decode(value, { stream: true })
+
+          const events = sseBuffer.split('\n\n')
+          sseBuffer = events.pop() || ''
+          for (const evt of events) {
+            let payload = ''
+            for (const rawLine of evt.split('\n')) {
+              const line = rawLine.trim()
+              if (line.startsWith('data:')) payload += line.slice(5).trim()
+              else if (line.startsWith('id:')) lastEventId = parseInt(line.slice(3).trim(), 10) || lastEventId
             }
-            // MAJ UI + quota
+            if (!payload) continue
+            let data
             try {
-              setMessages(prev => {
-                const next = [...prev, data.user_message, data.ai_message]
-                try {
-                  localStorage.setItem(`recentMessages:${convId}`, JSON.stringify(next.slice(-10)))
-                } catch {}
-                return next
-              })
-              if (user) updateUser({ ...user, quota_remaining: data.quota_remaining })
-            } catch (e) {
-              console.warn('[ChatPage] MAJ UI post-stream échouée', e)
-            }
-
-            // Lire le reste du texte non encore joué
-            const remaining = fullText.slice(lastSpokenIndex).trim()
-            if (remaining) {
-              speakText(remaining)
-              lastSpokenIndex = fullText.length
+              data = JSON.parse(payload)
+            } catch {
+              continue
             }
+            handleEvent(data)
           }
         }
       }
+
+      try {
+        await consume(res.body)
+      } catch (streamErr) {
+        // Sans generation_id, rien à reprendre: fallback sendMessage plus bas
+        if (!generationId) throw streamErr
+        console.warn('[ChatPage] Stream interrompu, reprise...', streamErr)
+      }
+      // Connexion perdue en cours de réponse: la génération continue côté serveur, on la reprend
+      for (let attempt = 0; !finished && generationId && attempt < 3; attempt++) {
+        try {
+          const resumed = await fetch(`${API_URL}/chat/generations/${generationId}/events`, {
+            mode: 'cors',
+            headers: { 'Accept': 'text/event-stream', 'Last-Event-ID': String(lastEventId) },
+            credentials: 'include'
+          })
+          if (!resumed.ok || !resumed.body) break
+          await consume(resumed.body)
+        } catch (resumeErr) {
+          console.warn('[ChatPage] Reprise du stream échouée', resumeErr)
+        }
+      }
     } catch (e) {
       console.error('[ChatPage] Erreur streaming:', e)
       return await sendMessage(messageContent, emotion, conversationIdOverride)
@@ -551,6 +597,9 @@ export default function ChatPage() {
       const data = await response.json()
 
       if (response.ok) {
+        if (data.crisis_detected) {
+          setCrisisAlert(data.emergency_message)
+        }
         setMessages(prev => {
           const next = [...prev, data.image_message, data.ai_message]
           try {